@@ -1,20 +1,39 @@
 import os
+import json
 import math
 import pickle
 import pathlib
 import warnings
+import time
+import threading
+import functools
 warnings.filterwarnings('ignore')
+from startup import StartupReport
+startup_report = StartupReport()
+import flask
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
 from dash.dependencies import Input, Output, State, ClientsideFunction
-import plotly.graph_objs as go
-import plotly.express as px
-import plotly.figure_factory as ff
-from plotly.subplots import make_subplots
+# Plotly Express is imported where figures are built, as importing it takes longer than the rest
+import plotly
 import pandas as pd
 import numpy as np
 import datetime
+from dataset import load_dataset, expand_frame, Selection
+from cube import top_n
+from refresh import DataStore, RefreshScheduler, REFRESH_INTERVAL
+from figure_cache import FigureCache
+from figure_pool import FigurePool
+from session_store import SessionStore, make_token
+from downsample import LINE_MAX_POINTS, WEBGL_THRESHOLD, minmax_downsample, line_render_mode
+from clientside import build_payload
+from rolling import ROLLING_WINDOWS, rolling_column
+import metrics
+import serializer
+import http_cache
+import export
+startup_report.mark('imports')
 
 # Get relative data folder
 PATH = pathlib.Path(__file__).parent
@@ -26,35 +45,60 @@ app = dash.Dash(
 )
 server = app.server
 
-# Load full data
-data = pd.read_csv(r'https://covid.ourworldindata.org/data/owid-covid-data.csv', parse_dates = ['date'],
-                   usecols = ['iso_code','continent','location','date','total_cases','new_cases','total_deaths',
-                              'new_deaths','icu_patients','hosp_patients','new_tests','total_tests'])
-metadata = pd.read_csv(
-    'https://github.com/owid/covid-19-data/blob/master/public/data/owid-covid-codebook.csv?raw=true'
-)
+# Load the cleaned data from the local snapshot (see dataset.py)
+store = DataStore(load_dataset())
+startup_report.mark('data')
+
+# Started on the first request rather than at import, so that with a preloading
+# gunicorn master (see gunicorn.conf.py) every worker runs its own refresh thread
+@server.before_first_request
+def start_refresh():
+    if REFRESH_INTERVAL > 0:
+        RefreshScheduler(store).start()
+
+# 'fused' serves all filter-dependent outputs from one callback, 'separate' uses one callback per output,
+# 'clientside' sends the rows of the selected countries once and handles dates and tabs in the browser
+CALLBACK_MODE = os.environ.get('CALLBACK_MODE', 'fused')
+
+# In 'clientside' mode, selections of more rows than this are computed on the server instead (about 40 bytes a row)
+CLIENTSIDE_MAX_ROWS = int(os.environ.get('CLIENTSIDE_MAX_ROWS', 20000))
+
+# Number of countries in the top-N bar chart
+TOP_N = int(os.environ.get('TOP_N', 10))
+
+# 'lazy' starts the page with empty figures that the page-load callbacks fill in, and computes the default
+# view in the background after the first request; 'eager' builds the first page's figures at import
+STARTUP_FIGURES = os.environ.get('STARTUP_FIGURES', 'lazy')
 
-# Select only a few columns
-df1 = data.drop_duplicates().sort_values(['location','date']).reset_index(drop = True)
+# Cache of callback outputs, emptied whenever a new snapshot is swapped in
+figure_cache = FigureCache()
+store.on_swap(lambda dataset: figure_cache.clear())
 
-# Drop World and International rows
-df2 = df1[~df1.location.isin(['World','International'])].copy().reset_index(drop = True)
-# Remove negative daily increases
-df2 = df2[~(df2['new_cases']<0)]
-df2 = df2[~(df2['new_deaths']<0)]
-df2 = df2[~(df2['new_tests']<0)]
-df2 = df2[~(df2['hosp_patients']<0)]
-df2 = df2.reset_index(drop = True)
-# Add cumsum for hosp_patients and icu_patients
-df2['total_hosp_patients'] = df2.groupby(['location'])['hosp_patients'].transform(pd.Series.cumsum)
-df2['total_icu_patients'] = df2.groupby(['location'])['icu_patients'].transform(pd.Series.cumsum)
+# Dates formatted once per snapshot for the JSON responses (see serializer.py)
+serializer.set_dates(store.current())
+store.on_swap(serializer.set_dates)
 
-# Get list of unique countries for reference
-df3 = df2[['iso_code','location']].drop_duplicates().sort_values(['location']).reset_index(drop = True)
+# Large line charts are built in a process pool when FIGURE_POOL_SIZE is set (see figure_pool.py)
+figure_pool = FigurePool(store)
 
-# Generate options
-country_options = sorted(df2['location'].unique().tolist())
-continent_options = sorted(df2['continent'].unique().tolist())
+# Server-side store of filtered selections, shared by the callbacks of one interaction
+session_store = SessionStore()
+store.on_swap(lambda dataset: session_store.clear())
+
+# Filters on page load; the dates and options are read from store.current() on every page load
+DEFAULT_CONTINENT = 'All'
+DEFAULT_TAB1 = 'total'
+DEFAULT_TAB2 = 'cases'
+
+def default_dates(dataset):
+    return dataset.df2.date.min(), datetime.datetime.now().date()
+
+def continent_countries(dataset, continent):
+    if continent == 'All':
+        countries = dataset.country_options
+    else:
+        countries = sorted(dataset.index.locations[dataset.index.continent(continent)].tolist())
+    return countries
 
 # Helper functions
 def human_format(num):
@@ -68,25 +112,70 @@ def human_format(num):
 def flatten_list(l):
     return sorted([item for sublist in l for item in sublist])
 
-def subset_data(continent, country_list, start_date, end_date):
+def make_selection(continent, country_list, start_date, end_date, dataset):
     end_date = datetime.datetime.strptime(end_date.split('T')[0],'%Y-%m-%d').date()
     end_date = datetime.datetime.combine(end_date, datetime.time(23,59,59))
     start_date = datetime.datetime.strptime(start_date.split('T')[0],'%Y-%m-%d').date()
     start_date = datetime.datetime.combine(start_date, datetime.time(0,0,0))
+    # df2 is sorted by location and date, so the selection is a set of row ranges (see location_index.py)
+    index = dataset.index
     if country_list != None:
-        country_list = flatten_list([country_list])
-        df = df2[df2.location.isin(country_list)]
-        df = df[((df.date >= start_date) & (df.date <= end_date))]
+        blocks = index.lookup(flatten_list([country_list]))
     else:
         if continent == 'All':
-            df = df2[df2.date <= end_date]
+            blocks = index.all()
+            start_date = None
         else:
-            df = df2[df2.continent == continent]
-            df = df[((df.date >= start_date) & (df.date <= end_date))]
-    df = df.sort_values(['location','date']).reset_index(drop = True)
+            blocks = index.continent(continent)
+    return dataset.select(blocks, start_date, end_date)
+
+def normalize_filters(continent, country_list, start_date, end_date):
+    # Normalize the filters the way make_selection reads them, so equivalent states share cache entries
+    start_day = start_date.split('T')[0]
+    end_day = end_date.split('T')[0]
+    if country_list != None:
+        continent = tuple(sorted(set(flatten_list([country_list]))))
+    elif continent == 'All':
+        start_day = None
+    return (continent, start_day, end_day)
+
+def filter_key(continent, country_list, start_date, end_date, *tabs):
+    return (store.current().version,) + normalize_filters(continent, country_list, start_date, end_date) + tabs
+
+@metrics.timed('filter')
+def select_data(continent, country_list, start_date, end_date, dataset = None):
+    # Reuses the stored selection when there is one
+    dataset = dataset or store.current()
+    key = (dataset.version,) + normalize_filters(continent, country_list, start_date, end_date)
+    return session_store.selection(
+        key, dataset, lambda: make_selection(continent, country_list, start_date, end_date, dataset)
+    )
+
+def subset_data(continent, country_list, start_date, end_date, dataset = None):
+    df = select_data(continent, country_list, start_date, end_date, dataset).frame()
     return df
 
-def get_total(input_df, metric = 'cases', level = 'country', sum = False):
+def selection_total(selection, metric, level, sum):
+    # A whole continent or the world is answered from the daily totals (see daily_totals.py)
+    if sum == True:
+        output = selection.dataset.daily.total(selection, 'total_{}'.format(metric))
+        if output is not None:
+            return output
+    return selection.dataset.cube.get_total(selection, metric, level, sum)
+
+def selection_new(selection, metric, level, sum):
+    if sum == True:
+        output = selection.dataset.daily.sum(selection, selection.dataset.cube.daily_column(metric))
+        if output is not None:
+            return output
+    return selection.dataset.cube.get_new(selection, metric, level, sum)
+
+@metrics.timed('aggregate')
+def get_total(input_df, metric = 'cases', level = 'country', sum = False, dataset = None):
+    # Selections are answered from the precomputed aggregates (see cube.py) and keep the result
+    if isinstance(input_df, Selection):
+        return input_df.aggregate(('total', metric, level, sum), lambda: selection_total(input_df, metric, level, sum))
+    df3 = (dataset or store.current()).df3
     if level == 'country':
         df = input_df[['location','total_{}'.format(metric)]]
         df = df.groupby('location').max().reset_index()
@@ -103,7 +192,12 @@ def get_total(input_df, metric = 'cases', level = 'country', sum = False):
     else:
         return df
 
-def get_new(input_df, metric = 'cases', level = 'country', sum = False):
+@metrics.timed('aggregate')
+def get_new(input_df, metric = 'cases', level = 'country', sum = False, dataset = None):
+    # Selections are answered from the precomputed aggregates (see cube.py) and keep the result
+    if isinstance(input_df, Selection):
+        return input_df.aggregate(('new', metric, level, sum), lambda: selection_new(input_df, metric, level, sum))
+    df3 = (dataset or store.current()).df3
     if level == 'country':
         try:
             df = input_df[['location','new_{}'.format(metric)]]
@@ -128,7 +222,14 @@ def get_new(input_df, metric = 'cases', level = 'country', sum = False):
     else:
         return df
 
-def get_average(input_df, metric = 'cases', level = 'country'):
+@metrics.timed('aggregate')
+def get_average(input_df, metric = 'cases', level = 'country', dataset = None):
+    # Selections are answered from the precomputed aggregates (see cube.py) and keep the result
+    if isinstance(input_df, Selection):
+        return input_df.aggregate(
+            ('average', metric, level), lambda: input_df.dataset.cube.get_average(input_df, metric, level)
+        )
+    df3 = (dataset or store.current()).df3
     if level == 'country':
         try:
             df = input_df[['location','new_{}'.format(metric)]]
@@ -149,97 +250,152 @@ def get_average(input_df, metric = 'cases', level = 'country'):
     except:
         df = df.dropna(subset = ['new_{}'.format(metric)]).reset_index(drop = True)
     return df
+
+def get_latest(selection, column):
+    # Each location's value on its last selected date, e.g. its latest rolling average (see rolling.py)
+    def compute():
+        present = selection.hi > selection.lo
+        df = pd.DataFrame({
+            'location': selection.dataset.index.locations[selection.blocks[present]],
+            column: selection.dataset.df2[column].to_numpy()[selection.hi[present] - 1]
+        })
+        return df.dropna(subset = [column]).reset_index(drop = True)
+    return selection.aggregate(('latest', column), compute)
+
+def daily_column(tab2):
+    return 'new_{}'.format(tab2) if tab2 != 'hosp_patients' else tab2
         
 ########### Set up the charts
-### Plot a map of country cases
-map1_df = df2[['iso_code','location','total_cases']].copy()
-map1_df = map1_df.dropna(subset = ['total_cases'], axis = 0)
-map1_df = map1_df.groupby(['iso_code','location']).max().reset_index()
-map1_df['total_cases'] = map1_df['total_cases'].astype(int)
-
-map1 = px.choropleth(map1_df, locations="iso_code", #[map1_df.location.isin(['United States','Canada'])]
-                    color = "total_cases", # lifeExp is a column of gapminder
-                    hover_name = "location", # column to add to hover information
-                    color_continuous_scale = px.colors.sequential.Blues,
-                    title = "Map of COVID-19 Cases (all countries)",
-                    labels={'iso_code':'ISO','total_cases':'Total cases','location':'Country'}
-                    # projection = "natural earth"
-                   )
-map1.update_layout(
-    margin={"r":0,"t":45,"l":0,"b":5},
-    coloraxis_showscale=True,autosize=True,
-    paper_bgcolor='rgb(249,249,249)',
-    plot_bgcolor='rgb(249,249,249)',
-    geo=dict(bgcolor= 'rgb(249,249,249)'))
-map1.update_geos(fitbounds="locations", showcountries=True, countrycolor="Black", visible=False) #showsubunits=True, subunitcolor="Blue",
-
-### Plot a graph showing daily new cases vs cumulative cases
-line1_df1 = df2[['date','total_cases']].groupby('date').sum().reset_index()
-line1_df2 = df2[['date','new_cases']].groupby('date').sum().reset_index()
-
-line1 = make_subplots(specs=[[{"secondary_y": True}]], shared_xaxes=True)
-line1.add_trace(
-    go.Scatter(
-        x=line1_df2['date'],
-        y=line1_df2['new_cases'],
-        mode='lines',
-        name='New daily cases'
-        ),
-    secondary_y=False
-)
-line1.add_trace(
-    go.Scatter(
-        x=line1_df1['date'],
-        y=line1_df1['total_cases'],
-        mode='lines',
-        name='Total cases'
-        ),
-    secondary_y=True
-)
-line1.update_layout(
-    title = 'New daily cases vs Total cases over time (all countries)',
-    plot_bgcolor='rgb(249,249,249)', paper_bgcolor='rgb(249,249,249)'
-)
-# Set y-axes titles
-line1.update_yaxes(title_text="New cases", secondary_y=False)
-line1.update_yaxes(title_text="Total cases", secondary_y=True)
-
-### Plot a graph showing new cases per country
-line2 = px.line(
-    df2,
-    x="date",
-    y="total_cases",
-    color='location',
-    labels={
-        "location": "Country",
-        "date": "Date",
-        "total_cases": "Total cases"
+def map_frame(dataset):
+    # Total cases of every country with an ISO code
+    df = get_total(dataset.select(dataset.index.all()))[['iso_code','location','total_cases']]
+    df = df.dropna(subset = ['iso_code','total_cases'], axis = 0)
+    df = df.sort_values(['iso_code','location']).reset_index(drop = True)
+    df['total_cases'] = df['total_cases'].astype(int)
+    return df
+
+# Template entries a figure with only a choropleth trace uses; the rest is left out of the payload
+MAP_TEMPLATE_LAYOUT = ['autotypenumbers','colorway','font','hovermode','hoverlabel','paper_bgcolor',
+                       'plot_bgcolor','coloraxis','colorscale','geo','title']
+
+def map_base(map1_df, color_continuous_scale):
+    # The layout, geos and trace settings of the map, built once; requests only add the data
+    import plotly.express as px
+    base = px.choropleth(map1_df, locations="iso_code", #[map1_df.location.isin(['United States','Canada'])]
+                        color = "total_cases", # lifeExp is a column of gapminder
+                        hover_name = "location", # column to add to hover information
+                        color_continuous_scale = color_continuous_scale,
+                        title = "Map of COVID-19 Cases (selected countries)",
+                        labels={'iso_code':'ISO','total_cases':'Total cases','location':'Country'}
+                        # projection = "natural earth"
+                       )
+    base.update_layout(
+        margin={"r":0,"t":45,"l":0,"b":5},
+        coloraxis_showscale=True,autosize=True,
+        paper_bgcolor='rgb(249,249,249)',
+        plot_bgcolor='rgb(249,249,249)',
+        geo=dict(bgcolor= 'rgb(249,249,249)'))
+    base.update_geos(fitbounds="locations", showcountries=True, countrycolor="Black", visible=False) #showsubunits=True, subunitcolor="Blue",
+    base = base.to_dict()
+    template = base['layout']['template']
+    base['layout']['template'] = {
+        'data': {'choropleth': template['data']['choropleth']},
+        'layout': {key: template['layout'][key] for key in MAP_TEMPLATE_LAYOUT if key in template['layout']}
     }
-)
-line2.update_layout(
-    title = 'Total cases over time across selected countries',
-    plot_bgcolor='rgb(249,249,249)', paper_bgcolor='rgb(249,249,249)',
-)
-line2.update_xaxes(showgrid=False)
-line2.update_yaxes(showgrid=False)
-
-### Plot a top N chart of average metric
-bar1_df = get_average(df2)
-bar1 = px.bar(bar1_df.sort_values(['new_cases'], ascending = True).tail(10),
-             y = 'location',
-             x = 'new_cases',
-             title = "Top {} Countries worldwide in terms of Average daily COVID cases".format(len(bar1_df.sort_values(['new_cases'], ascending = True).tail(10))),
-             labels = {'location':'Country','new_cases':'Average daily cases'},
-             orientation='h')
-bar1.update_layout(
-    plot_bgcolor='rgb(249,249,249)', paper_bgcolor='rgb(249,249,249)',
-)
-bar1.update_traces(marker_color='#119DFF')
-bar1.update_xaxes(showgrid=False)
-bar1.update_yaxes(showgrid=False)
+    for key in ['locations','z','hovertext']:
+        base['data'][0].pop(key, None)
+    return base
+
+@functools.lru_cache(maxsize = None)
+def map_bases():
+    # Built on first use, which also imports Plotly Express
+    import plotly.express as px
+    map1_df = map_frame(store.current())
+    return {
+        'Blues': map_base(map1_df, px.colors.sequential.Blues),
+        'Purples': map_base(map1_df, px.colors.sequential.Purples),
+    }
+
+def map_data(base, df, title = None):
+    # A plain figure dict, so neither Plotly Express nor figure validation runs per request
+    trace = dict(
+        base['data'][0],
+        locations = df['iso_code'].to_numpy(),
+        z = df['total_cases'].to_numpy(),
+        hovertext = df['location'].to_numpy()
+    )
+    layout = base['layout'] if title is None else dict(base['layout'], title = {'text': title})
+    return {'data': [trace], 'layout': layout}
+
+def initial_figures(dataset):
+    """The cards and figures of the first page: all countries over all dates."""
+    import plotly.express as px
+    all_data = dataset.select(dataset.index.all())
+
+    ### Plot a map of country cases
+    map1 = map_data(map_bases()['Blues'], map_frame(dataset), "Map of COVID-19 Cases (all countries)")
+
+    ### Plot a graph showing new cases per country
+    line2 = px.line(
+        expand_frame(dataset.df2),
+        x="date",
+        y="total_cases",
+        color='location',
+        labels={
+            "location": "Country",
+            "date": "Date",
+            "total_cases": "Total cases"
+        }
+    )
+    line2.update_layout(
+        title = 'Total cases over time across selected countries',
+        plot_bgcolor='rgb(249,249,249)', paper_bgcolor='rgb(249,249,249)',
+    )
+    line2.update_xaxes(showgrid=False)
+    line2.update_yaxes(showgrid=False)
+
+    ### Plot a top N chart of average metric
+    bar1_df = top_n(get_average(all_data), 'new_cases', TOP_N)
+    bar1 = px.bar(bar1_df,
+                 y = 'location',
+                 x = 'new_cases',
+                 title = "Top {} Countries worldwide in terms of Average daily COVID cases".format(len(bar1_df)),
+                 labels = {'location':'Country','new_cases':'Average daily cases'},
+                 orientation='h')
+    bar1.update_layout(
+        plot_bgcolor='rgb(249,249,249)', paper_bgcolor='rgb(249,249,249)',
+    )
+    bar1.update_traces(marker_color='#119DFF')
+    bar1.update_xaxes(showgrid=False)
+    bar1.update_yaxes(showgrid=False)
+
+    cards = [
+        human_format(get_total(all_data, sum = True)),
+        human_format(get_total(all_data, metric = 'deaths', sum = True)),
+        human_format(get_total(all_data, metric = 'tests', sum = True)),
+        human_format(get_new(all_data, metric = 'hosp_patients', sum = True)),
+    ]
+    return {'cards': cards, 'map1': map1, 'line2': line2, 'bar1': bar1}
+
+def placeholder_figures():
+    # The callbacks fire on page load with the default filters and fill these in
+    empty = {'data': [], 'layout': {'plot_bgcolor': 'rgb(249,249,249)', 'paper_bgcolor': 'rgb(249,249,249)'}}
+    return {'cards': ['-'] * 4, 'map1': empty, 'line2': empty, 'bar1': empty}
+
+def page_figures(dataset):
+    # The eager figures are only good for the snapshot they were built from
+    if initial is not None and initial['version'] == dataset.version:
+        return initial
+    return placeholder_figures()
+
+if STARTUP_FIGURES == 'eager':
+    initial = dict(initial_figures(store.current()), version = store.current().version)
+else:
+    initial = None
+startup_report.mark('figures')
 
 # Create global chart template
-mapbox_access_token = open(r"assets/token.file").read()
+mapbox_access_token = open(PATH.joinpath("assets", "token.file")).read()
 
 layout = dict(
     autosize=True,
@@ -275,281 +431,330 @@ tab_selected_style = {
     'padding': '6px'
 }
 
-# Create app layout
-app.layout = html.Div(
-    [
-        dcc.Store(id="aggregate_data"),
-        # empty Div to trigger javascript file for graph resizing
-        html.Div(id="output-clientside"),
-        html.Div(
-            [
-                html.Div(
-                    [
-                        html.Img(
-                            src=app.get_asset_url("dash-logo.png"),
-                            id="plotly-image",
-                            style={
-                                "height": "60px",
-                                "width": "auto",
-                                "margin-bottom": "25px",
-                            },
-                        )
-                    ],
-                    className="one-third column",
-                ),
-                html.Div(
-                    [
-                        html.Div(
-                            [
-                                html.H3(
-                                    "World COVID-19 Cases",
-                                    style={"margin-bottom": "0px"},
-                                ),
-                                html.H5(
-                                    "Country Comparison", style={"margin-top": "0px"}
-                                ),
-                            ]
-                        )
-                    ],
-                    className="one-half column",
-                    id="title",
-                ),
-                html.Div(
-                    [
-                        html.A(
-                            html.Button("Source code", id="learn-more-button"),
-                            href='https://github.com/at-nl/dash-demo1',
-                        )
-                    ],
-                    className="one-third column",
-                    id="button",
-                ),
-            ],
-            id="header",
-            className="row flex-display",
-            style={"margin-bottom": "25px"},
-        ),
-        html.Div(
-            [
-                html.Div(
-                    [
-                        html.P(
+# Set in CALLBACK_MODE=clientside (see clientside_figures below)
+clientside_figure_data = None
+
+# Create app layout, on every page load so that dates and options follow data refreshes
+def page_layout():
+    dataset = store.current()
+    metadata = dataset.metadata
+    country_options = dataset.country_options
+    continent_options = dataset.continent_options
+    start_date, end_date = default_dates(dataset)
+    initial = page_figures(dataset)
+    return html.Div(
+        [
+            dcc.Store(id="aggregate_data"),
+            # The bar chart mode shown, so CALLBACK_MODE=fused rebuilds the bar only when it changes
+            dcc.Store(id="bar_mode"),
+            # The countries of every continent, so the export form can send a whole continent by name
+            dcc.Store(id="continent_countries", data = {
+                c: continent_countries(dataset, c) for c in ['All'] + continent_options
+            }),
+            # Used by CALLBACK_MODE=clientside (see clientside.py)
+            dcc.Store(id="clientside_data"),
+            dcc.Store(id="clientside_figures", data = clientside_figure_data),
+            dcc.Store(id="server_request"),
+            dcc.Store(id="server_figures"),
+            # empty Div to trigger javascript file for graph resizing
+            html.Div(id="output-clientside"),
+            html.Div(
+                [
+                    html.Div(
+                        [
+                            html.Img(
+                                src=app.get_asset_url("dash-logo.png"),
+                                id="plotly-image",
+                                style={
+                                    "height": "60px",
+                                    "width": "auto",
+                                    "margin-bottom": "25px",
+                                },
+                            )
+                        ],
+                        className="one-third column",
+                    ),
+                    html.Div(
+                        [
+                            html.Div(
+                                [
+                                    html.H3(
+                                        "World COVID-19 Cases",
+                                        style={"margin-bottom": "0px"},
+                                    ),
+                                    html.H5(
+                                        "Country Comparison", style={"margin-top": "0px"}
+                                    ),
+                                ]
+                            )
+                        ],
+                        className="one-half column",
+                        id="title",
+                    ),
+                    html.Div(
+                        [
                             html.A(
-                                # children = [html.P('Click here for data source',id='data-source-text')],
-                                'Click here for data source',
-                                href = 'https://github.com/owid/covid-19-data/tree/master/public/data',
-                                id = 'data-source-link',
-                                className = 'data-source'
-                            ),
-                            className="control_label"
-                        ),
-                        html.P(
-                            [html.Strong("Filter by Date Range:")],
-                            className="control_label",
-                            title = metadata[metadata.column == 'date']['description'].tolist()[0]
-                        ),
-                        dcc.DatePickerRange(
-                            id='date_range_picker',
-                            min_date_allowed=df2.date.min(),
-                            max_date_allowed=datetime.datetime.now().date(),
-                            initial_visible_month=df2.date.min(),
-                            start_date = df2.date.min(),
-                            end_date = datetime.datetime.now().date(),
-                            className = 'dcc_control'
-                        ),
-                        html.P(
-                            [html.Strong("Filter by Continent:")],
-                            className="control_label",
-                            title = metadata[metadata.column == 'continent']['description'].tolist()[0]
-                        ),
-                        dcc.RadioItems(
-                            id="continent_selector",
-                            options=[
-                                {"label": 'All', "value": 'All', 'disabled':False}
-                            ] + [
-                                {"label": c, "value": c, 'disabled':False} for c in continent_options
-                            ],
-                            value = 'All',
-                            labelStyle={"display": 'block'},
-                            className="dcc_control",
-                        ),
-                        html.P(
-                            [html.Strong("Filter by Country:")],
-                            className="control_label",
-                            title = metadata[metadata.column == 'location']['description'].tolist()[0]
-                        ),
-                        dcc.Dropdown(
-                            id = 'select_country',
-                            multi = True,
-                            clearable = True,
-                            disabled = False,
-                            style = {'display': True},
-                            # value = 'United States',
-                            placeholder = 'Select country',
-                            options = [
-                                {'label': c, 'value': c} for c in country_options
-                            ],
-                            className = 'dcc_control'
-                        ),
-                        html.P(
-                            "The current selection contains {} countries.".format(len(country_options)),
-                            className="control_label",
-                            id='country-count'
-                        )
-                    ],
-                    className="pretty_container four columns",
-                    id="cross-filter-options",
-                ),
-                html.Div(
-                    [
-                        html.Div(
-                            [
-                                html.Div(
-                                    [html.H6(children = human_format(df2[['location','total_cases']].groupby('location').max()['total_cases'].sum()),
-                                             id="well_text"), html.P("Total cases")],
-                                    id="wells",
-                                    className="mini_container",
+                                html.Button("Source code", id="learn-more-button"),
+                                href='https://github.com/at-nl/dash-demo1',
+                            )
+                        ],
+                        className="one-third column",
+                        id="button",
+                    ),
+                ],
+                id="header",
+                className="row flex-display",
+                style={"margin-bottom": "25px"},
+            ),
+            html.Div(
+                [
+                    html.Div(
+                        [
+                            html.P(
+                                html.A(
+                                    # children = [html.P('Click here for data source',id='data-source-text')],
+                                    'Click here for data source',
+                                    href = 'https://github.com/owid/covid-19-data/tree/master/public/data',
+                                    id = 'data-source-link',
+                                    className = 'data-source'
                                 ),
-                                html.Div(
-                                    [html.H6(children = human_format(df2[['location','total_deaths']].groupby('location').max()['total_deaths'].sum()),
-                                             id="gasText"), html.P("Total deaths")],
-                                    id="gas",
-                                    className="mini_container",
-                                ),
-                                html.Div(
-                                    [html.H6(children = human_format(df2[['location','total_tests']].groupby('location').max()['total_tests'].sum()),
-                                             id="oilText"), html.P("Total tests")],
-                                    id="oil",
-                                    className="mini_container",
-                                ),
-                                html.Div(
-                                    [html.H6(children = human_format(df2['hosp_patients'].sum()),
-                                             id="waterText"), html.P("Total hospital patients")],
-                                    id="water",
-                                    className="mini_container",
-                                ),
-                            ],
-                            id="info-container",
-                            className="row container-display",
-                        ),
-                        html.Div(
-                            children = [
-                                dcc.Tabs(
-                                    id='tabs-1',
-                                    value='total',
-                                    children=[
-                                        dcc.Tab(
-                                            label='Up-to-date Total',
-                                            value='total',
-                                            style=tab_style,
-                                            selected_style=tab_selected_style,
-                                            id = 'total-tab'
-                                        ),
-                                        dcc.Tab(
-                                            label='Daily change',
-                                            value='new',
-                                            style=tab_style,
-                                            selected_style=tab_selected_style,
-                                            id = 'new-tab'
-                                        )
-                                    ]
-                                ),
-                                dcc.Tabs(
-                                    id='tabs-2',
-                                    value='cases',
-                                    children=[
-                                        dcc.Tab(
-                                            label='Cases',
-                                            value='cases',
-                                            style=tab_style,
-                                            selected_style=tab_selected_style,
-                                            id = 'cases-tab'
-                                        ),
-                                        dcc.Tab(
-                                            label='Deaths',
-                                            value='deaths',
-                                            style=tab_style,
-                                            selected_style=tab_selected_style,
-                                            id = 'deaths-tab'
-                                        ),
-                                        dcc.Tab(
-                                            label='Tests',
-                                            value='tests',
-                                            style=tab_style,
-                                            selected_style=tab_selected_style,
-                                            id = 'tests-tab'
-                                        ),
-                                        dcc.Tab(
-                                            label='Hospital patients',
-                                            value='hosp_patients',
-                                            style=tab_style,
-                                            selected_style=tab_selected_style,
-                                            id = 'patients-tab'
-                                        )
-                                    ]
-                                ),
-                            ],
-                            id="tabContainer",
-                            className="pretty_container"
-                        ),
+                                className="control_label"
+                            ),
+                            html.P(
+                                [html.Strong("Filter by Date Range:")],
+                                className="control_label",
+                                title = metadata[metadata.column == 'date']['description'].tolist()[0]
+                            ),
+                            dcc.DatePickerRange(
+                                id='date_range_picker',
+                                min_date_allowed=start_date,
+                                max_date_allowed=end_date,
+                                initial_visible_month=start_date,
+                                start_date = start_date,
+                                end_date = end_date,
+                                className = 'dcc_control'
+                            ),
+                            html.P(
+                                [html.Strong("Filter by Continent:")],
+                                className="control_label",
+                                title = metadata[metadata.column == 'continent']['description'].tolist()[0]
+                            ),
+                            dcc.RadioItems(
+                                id="continent_selector",
+                                options=[
+                                    {"label": 'All', "value": 'All', 'disabled':False}
+                                ] + [
+                                    {"label": c, "value": c, 'disabled':False} for c in continent_options
+                                ],
+                                value = DEFAULT_CONTINENT,
+                                labelStyle={"display": 'block'},
+                                className="dcc_control",
+                            ),
+                            html.P(
+                                [html.Strong("Filter by Country:")],
+                                className="control_label",
+                                title = metadata[metadata.column == 'location']['description'].tolist()[0]
+                            ),
+                            dcc.Dropdown(
+                                id = 'select_country',
+                                multi = True,
+                                clearable = True,
+                                disabled = False,
+                                style = {'display': True},
+                                # value = 'United States',
+                                placeholder = 'Select country',
+                                options = [
+                                    {'label': c, 'value': c} for c in country_options
+                                ],
+                                className = 'dcc_control'
+                            ),
+                            html.P(
+                                "The current selection contains {} countries.".format(len(country_options)),
+                                className="control_label",
+                                id='country-count'
+                            ),
+                            # The filters are posted, as a long country list does not fit in a URL
+                            html.Form(
+                                [
+                                    "Download the selected data: ",
+                                    dcc.Input(id = 'export-filters', type = 'hidden', name = 'filters'),
+                                    html.Button("CSV", formAction = '/export.csv', id = 'export-csv'),
+                                    " ",
+                                    html.Button("Parquet", formAction = '/export.parquet', id = 'export-parquet')
+                                ],
+                                method = 'post',
+                                className="control_label"
+                            )
+                        ],
+                        className="pretty_container four columns",
+                        id="cross-filter-options",
+                    ),
+                    html.Div(
+                        [
+                            html.Div(
+                                [
+                                    html.Div(
+                                        [html.H6(children = initial['cards'][0],
+                                                 id="well_text"), html.P("Total cases")],
+                                        id="wells",
+                                        className="mini_container",
+                                    ),
+                                    html.Div(
+                                        [html.H6(children = initial['cards'][1],
+                                                 id="gasText"), html.P("Total deaths")],
+                                        id="gas",
+                                        className="mini_container",
+                                    ),
+                                    html.Div(
+                                        [html.H6(children = initial['cards'][2],
+                                                 id="oilText"), html.P("Total tests")],
+                                        id="oil",
+                                        className="mini_container",
+                                    ),
+                                    html.Div(
+                                        [html.H6(children = initial['cards'][3],
+                                                 id="waterText"), html.P("Total hospital patients")],
+                                        id="water",
+                                        className="mini_container",
+                                    ),
+                                ],
+                                id="info-container",
+                                className="row container-display",
+                            ),
+                            html.Div(
+                                children = [
+                                    dcc.Tabs(
+                                        id='tabs-1',
+                                        value=DEFAULT_TAB1,
+                                        children=[
+                                            dcc.Tab(
+                                                label='Up-to-date Total',
+                                                value='total',
+                                                style=tab_style,
+                                                selected_style=tab_selected_style,
+                                                id = 'total-tab'
+                                            ),
+                                            dcc.Tab(
+                                                label='Daily change',
+                                                value='new',
+                                                style=tab_style,
+                                                selected_style=tab_selected_style,
+                                                id = 'new-tab'
+                                            ),
+                                            dcc.Tab(
+                                                label='7-day average',
+                                                value='avg7',
+                                                style=tab_style,
+                                                selected_style=tab_selected_style,
+                                                id = 'avg7-tab'
+                                            ),
+                                            dcc.Tab(
+                                                label='14-day average',
+                                                value='avg14',
+                                                style=tab_style,
+                                                selected_style=tab_selected_style,
+                                                id = 'avg14-tab'
+                                            )
+                                        ]
+                                    ),
+                                    dcc.Tabs(
+                                        id='tabs-2',
+                                        value=DEFAULT_TAB2,
+                                        children=[
+                                            dcc.Tab(
+                                                label='Cases',
+                                                value='cases',
+                                                style=tab_style,
+                                                selected_style=tab_selected_style,
+                                                id = 'cases-tab'
+                                            ),
+                                            dcc.Tab(
+                                                label='Deaths',
+                                                value='deaths',
+                                                style=tab_style,
+                                                selected_style=tab_selected_style,
+                                                id = 'deaths-tab'
+                                            ),
+                                            dcc.Tab(
+                                                label='Tests',
+                                                value='tests',
+                                                style=tab_style,
+                                                selected_style=tab_selected_style,
+                                                id = 'tests-tab'
+                                            ),
+                                            dcc.Tab(
+                                                label='Hospital patients',
+                                                value='hosp_patients',
+                                                style=tab_style,
+                                                selected_style=tab_selected_style,
+                                                id = 'patients-tab'
+                                            )
+                                        ]
+                                    ),
+                                ],
+                                id="tabContainer",
+                                className="pretty_container"
+                            ),
                         
-                        html.Div(
-                            [
-                                dcc.Graph(
-                                    id="count_graph",
-                                    figure = line2
-                                )
-                            ],
-                            id="countGraphContainer",
-                            className="pretty_container"
-                        ),
-                    ],
-                    id="right-column",
-                    className="eight columns",
-                ),
-            ],
-            className="row flex-display",
-        ),
-        html.Div(
-            [
-                html.Div(
-                    [
-                        dcc.Graph(
-                            id="main_graph",
-                            figure = map1
-                        )
-                    ],
-                    className="pretty_container seven columns",
-                ),
-                html.Div(
-                    [
-                        dcc.Graph(
-                            id="individual_graph",
-                            figure = bar1
-                        )
-                    ],
-                    className="pretty_container five columns",
-                ),
-            ],
-            className="row flex-display",
-        ),
-        # html.Div(
-        #     [
-        #         html.Div(
-        #             [dcc.Graph(id="pie_graph")],
-        #             className="pretty_container seven columns",
-        #         ),
-        #         html.Div(
-        #             [dcc.Graph(id="aggregate_graph")],
-        #             className="pretty_container five columns",
-        #         ),
-        #     ],
-        #     className="row flex-display",
-        # ),
-    ],
-    id="mainContainer",
-    style={"display": "flex", "flex-direction": "column"},
-)
+                            html.Div(
+                                [
+                                    dcc.Graph(
+                                        id="count_graph",
+                                        figure = initial['line2']
+                                    )
+                                ],
+                                id="countGraphContainer",
+                                className="pretty_container"
+                            ),
+                        ],
+                        id="right-column",
+                        className="eight columns",
+                    ),
+                ],
+                className="row flex-display",
+            ),
+            html.Div(
+                [
+                    html.Div(
+                        [
+                            dcc.Graph(
+                                id="main_graph",
+                                figure = initial['map1']
+                            )
+                        ],
+                        className="pretty_container seven columns",
+                    ),
+                    html.Div(
+                        [
+                            dcc.Graph(
+                                id="individual_graph",
+                                figure = initial['bar1']
+                            )
+                        ],
+                        className="pretty_container five columns",
+                    ),
+                ],
+                className="row flex-display",
+            ),
+            # html.Div(
+            #     [
+            #         html.Div(
+            #             [dcc.Graph(id="pie_graph")],
+            #             className="pretty_container seven columns",
+            #         ),
+            #         html.Div(
+            #             [dcc.Graph(id="aggregate_graph")],
+            #             className="pretty_container five columns",
+            #         ),
+            #     ],
+            #     className="row flex-display",
+            # ),
+        ],
+        id="mainContainer",
+        style={"display": "flex", "flex-direction": "column"},
+    )
+app.layout = page_layout
+startup_report.mark('layout')
 
 ############ CREATE CALLBACKS ############
 
@@ -561,55 +766,40 @@ app.layout = html.Div(
     ],
 )
 def update_countries(continent):
-    if continent == 'All':
-        countries = country_options
-    else:
-        countries = sorted(df2[df2.continent==continent].location.unique().tolist())
-    return countries
+    return continent_countries(store.current(), continent)
 
-# Update 4 cards
-@app.callback(
-    [
-        Output('well_text','children'),
-        Output('gasText','children'),
-        Output('oilText','children'),
-        Output('waterText','children')
-    ],
-    [
-        Input('continent_selector', 'value'),
-        Input('select_country', 'value'),
-        Input('date_range_picker', 'start_date'),
-        Input('date_range_picker', 'end_date')
-    ]
-)
-def update_cards(continent, country_list, start_date, end_date):
-    df = subset_data(continent, country_list, start_date, end_date)
-    cases = get_total(df, sum = True)
-    deaths = get_total(df, metric = 'deaths', sum = True)
-    tests = get_total(df, metric = 'tests', sum = True)
-    hosp_patients = get_new(df, metric = 'hosp_patients', sum = True)
+# Build the 4 cards
+@metrics.timed('figure')
+def card_values(selection):
+    cases = get_total(selection, sum = True)
+    deaths = get_total(selection, metric = 'deaths', sum = True)
+    tests = get_total(selection, metric = 'tests', sum = True)
+    hosp_patients = get_new(selection, metric = 'hosp_patients', sum = True)
     return human_format(cases), human_format(deaths), human_format(tests), human_format(hosp_patients)
 
-# Update line graph
-@app.callback(
-    Output('count_graph', 'figure'),
-    [
-        Input('continent_selector', 'value'),
-        Input('select_country', 'value'),
-        Input('date_range_picker', 'start_date'),
-        Input('date_range_picker', 'end_date'),
-        Input('tabs-1', 'value'),
-        Input('tabs-2', 'value')
-    ]
-)
-def update_line_graph1(continent, country_list, start_date, end_date, tab1, tab2):
-    df = subset_data(continent, country_list, start_date, end_date)
+# Build line graph
+@metrics.timed('figure')
+def line_figure(selection, tab1, tab2):
+    import plotly.express as px
+    df = selection.frame()
+    # Cap the points per country for long date ranges (see downsample.py)
+    if LINE_MAX_POINTS:
+        if tab1 == 'total':
+            column = 'total_{}'.format(tab2)
+        elif tab1 in ROLLING_WINDOWS:
+            column = rolling_column(daily_column(tab2), tab1)
+        elif 'new_{}'.format(tab2) in df.columns:
+            column = 'new_{}'.format(tab2)
+        else:
+            column = tab2
+        df = minmax_downsample(df, 'location', column)
     if tab1 == 'total':
         line = px.line(
             df,
             x="date",
             y="total_{}".format(tab2),
             color='location',
+            render_mode=line_render_mode(df),
             labels={
                 "location": "Country",
                 "date": "Date",
@@ -620,6 +810,27 @@ def update_line_graph1(continent, country_list, start_date, end_date, tab1, tab2
             title = 'Total {} over time across selected countries'.format(tab2.replace('hosp','hospital').replace('_',' ')),
             plot_bgcolor='rgb(249,249,249)', paper_bgcolor='rgb(249,249,249)'
         )
+    elif tab1 in ROLLING_WINDOWS:
+        # Precomputed per snapshot (see rolling.py)
+        column = rolling_column(daily_column(tab2), tab1)
+        line = px.line(
+            df,
+            x="date",
+            y=column,
+            color='location',
+            render_mode=line_render_mode(df),
+            labels={
+                "location": "Country",
+                "date": "Date",
+                column: "{}-day Average Daily {}".format(ROLLING_WINDOWS[tab1], tab2.replace('hosp','hospital').replace('_',' ').title())
+            }
+        )
+        line.update_layout(
+            title = '{}-day average daily {} over time across selected countries'.format(
+                ROLLING_WINDOWS[tab1], tab2.replace('hosp','hospital').replace('_',' ')
+            ),
+            plot_bgcolor='rgb(249,249,249)', paper_bgcolor='rgb(249,249,249)'
+        )
     else:
         try:
             line = px.line(
@@ -627,6 +838,7 @@ def update_line_graph1(continent, country_list, start_date, end_date, tab1, tab2
                 x="date",
                 y="new_{}".format(tab2),
                 color='location',
+                render_mode=line_render_mode(df),
                 labels={
                     "location": "Country",
                     "date": "Date",
@@ -639,6 +851,7 @@ def update_line_graph1(continent, country_list, start_date, end_date, tab1, tab2
                 x="date",
                 y=tab2,
                 color='location',
+                render_mode=line_render_mode(df),
                 labels={
                     "location": "Country",
                     "date": "Date",
@@ -653,112 +866,276 @@ def update_line_graph1(continent, country_list, start_date, end_date, tab1, tab2
     line.update_yaxes(showgrid=False)
     return line
 
-# Update map graph
-@app.callback(
-    Output('main_graph', 'figure'),
-    [
-        Input('continent_selector', 'value'),
-        Input('select_country', 'value'),
-        Input('date_range_picker', 'start_date'),
-        Input('date_range_picker', 'end_date')
-    ]
-)
-def update_map1(continent, country_list, start_date, end_date):
-    df = subset_data(continent, country_list, start_date, end_date)
-    df = get_total(df)
-    if len(df['location'].unique()) < len(country_options):
-        output_map = px.choropleth(
-            df, locations="iso_code",
-            color = "total_cases", 
-            hover_name = "location", # column to add to hover information
-            color_continuous_scale = px.colors.sequential.Purples,
-            title = "Map of COVID-19 Cases (selected countries)",
-            labels={'iso_code':'ISO','total_cases':'Total cases','location':'Country'}
-            # projection = "natural earth"
-            )
+# Build map graph
+@metrics.timed('figure')
+def map_figure(selection):
+    dataset = selection.dataset
+    df = get_total(selection)
+    if len(df['location'].unique()) < len(dataset.country_options):
+        return map_data(map_bases()['Purples'], df)
     else:
-        output_map = px.choropleth(
-            df, locations="iso_code",
-            color = "total_cases",
-            hover_name = "location", # column to add to hover information
-            color_continuous_scale = px.colors.sequential.Blues,
-            title = "Map of COVID-19 Cases (selected countries)",
-            labels={'iso_code':'ISO','total_cases':'Total cases','location':'Country'}
-            # projection = "natural earth"
-            )
-    output_map.update_layout(
-        margin={"r":0,"t":45,"l":0,"b":5},
-        coloraxis_showscale=True,
-        autosize=True,
-        paper_bgcolor='rgb(249,249,249)',
-        plot_bgcolor='rgb(249,249,249)',
-        geo=dict(bgcolor= 'rgb(249,249,249)'))
-    output_map.update_geos(fitbounds="locations", showcountries=True, countrycolor="Black", visible=False) #showsubunits=True, subunitcolor="Blue",
-    return output_map
+        return map_data(map_bases()['Blues'], df)
 
-# Update bar1
-@app.callback(
-    Output('individual_graph', 'figure'),
-    [
-        Input('continent_selector', 'value'),
-        Input('select_country', 'value'),
-        Input('date_range_picker', 'start_date'),
-        Input('date_range_picker', 'end_date'),
-        Input('tabs-2', 'value')
-    ]
-)
-def update_top_n_bar(continent, country_list, start_date, end_date, tab2):
-    df = subset_data(continent, country_list, start_date, end_date)
-    df = get_average(df, metric = tab2)
+# Build bar1
+@metrics.timed('figure')
+def bar_figure(selection, tab2, tab1 = 'total'):
+    import plotly.express as px
+    dataset = selection.dataset
+    if tab1 in ROLLING_WINDOWS:
+        # The latest rolling average of each country rather than the average over the date range
+        column = rolling_column(daily_column(tab2), tab1)
+        df = get_latest(selection, column)
+        measure = '{}-day average daily'.format(ROLLING_WINDOWS[tab1])
+    else:
+        # The averages come from the precomputed sums, and the top N is picked without sorting them all
+        df = get_average(selection, metric = tab2)
+        column = daily_column(tab2)
+        measure = 'Average daily'
+    top = top_n(df, column, TOP_N)
     # end_date = datetime.datetime.strptime(end_date.split('T')[0],'%Y-%m-%d').date()
     if tab2 != 'hosp_patients':
         bar = px.bar(
-            df.sort_values(['new_{}'.format(tab2)], ascending = True).tail(10),
+            top,
             y = 'location',
-            x = 'new_{}'.format(tab2),
-            title = "Top {} Countries in terms of Average daily COVID {}".format(
-                len(df.sort_values(['new_{}'.format(tab2)], ascending = True).tail(10)),
-                tab2
-                ),
-            labels = {'location':'Country','new_{}'.format(tab2):'Average daily {}'.format(tab2)},
+            x = column,
+            title = "Top {} Countries in terms of {} COVID {}".format(len(top), measure, tab2),
+            labels = {'location':'Country',column:'{} {}'.format(measure, tab2)},
             orientation='h',
             # color_discrete_sequence =['#119DFF']*3
             )
     else:
         bar = px.bar(
-            df.sort_values([tab2], ascending = True).tail(10),
+            top,
             y = 'location',
-            x = tab2,
-            title = "Top {} Countries in terms of Average daily COVID {}".format(
-                len(df.sort_values([tab2], ascending = True).tail(10)),
+            x = column,
+            title = "Top {} Countries in terms of {} COVID {}".format(
+                len(top),
+                measure,
                 tab2.replace('hosp','hospital').replace('_',' ')
                 ),
-            labels = {'location':'Country','new_cases':'Average daily {}'.format(tab2.replace('hosp','hospital').replace('_',' '))},
+            labels = {'location':'Country','new_cases':'{} {}'.format(measure, tab2.replace('hosp','hospital').replace('_',' '))},
             orientation='h'
                 )
     bar.update_layout(
         plot_bgcolor='rgb(249,249,249)', paper_bgcolor='rgb(249,249,249)',
     )
-    if len(df['location'].unique()) == len(country_options):
-        if tab2 != 'hosp_patients':
-            bar.update_layout(
-                title = "Top {} Countries worldwide in terms of Average daily COVID {}".format(
-                    len(df.sort_values([tab2], ascending = True).tail(10)),
-                    tab2.replace('hosp','hospital').replace('_',' ')
-                ),
-            )
-        else:
-            bar.update_layout(
-                title = "Top {} Countries worldwide in terms of Average daily COVID {}".format(
-                    len(df.sort_values(['new_{}'.format(tab2)], ascending = True).tail(10)),
-                    tab2.replace('hosp','hospital').replace('_',' ')
-                ),
-            )
+    if len(df['location'].unique()) == len(dataset.country_options):
+        bar.update_layout(
+            title = "Top {} Countries worldwide in terms of {} COVID {}".format(
+                len(top),
+                measure,
+                tab2.replace('hosp','hospital').replace('_',' ')
+            ),
+        )
     bar.update_traces(marker_color='#119DFF')
     bar.update_xaxes(showgrid=False)
     bar.update_yaxes(showgrid=False)
     return bar
 
+CARD_OUTPUTS = [
+    Output('well_text','children'),
+    Output('gasText','children'),
+    Output('oilText','children'),
+    Output('waterText','children')
+]
+FILTER_INPUTS = [
+    Input('continent_selector', 'value'),
+    Input('select_country', 'value'),
+    Input('date_range_picker', 'start_date'),
+    Input('date_range_picker', 'end_date')
+]
+
+@figure_cache.memoize(filter_key)
+def update_cards(continent, country_list, start_date, end_date):
+    return card_values(select_data(continent, country_list, start_date, end_date))
+
+def line_json(selection, tab1, tab2):
+    return figure_pool.build(line_figure, selection, tab1, tab2)
+
+@figure_cache.memoize(filter_key, serialized = True, raw = True)
+def update_line_graph1(continent, country_list, start_date, end_date, tab1, tab2):
+    return line_json(select_data(continent, country_list, start_date, end_date), tab1, tab2)
+
+@figure_cache.memoize(filter_key, raw = True)
+def update_map1(continent, country_list, start_date, end_date):
+    return map_figure(select_data(continent, country_list, start_date, end_date))
+
+def bar_mode(tab1):
+    # The bar chart is the same for every tabs-1 value but the rolling averages
+    return tab1 if tab1 in ROLLING_WINDOWS else 'total'
+
+def bar_key(continent, country_list, start_date, end_date, tab2, tab1):
+    return filter_key(continent, country_list, start_date, end_date, tab2, bar_mode(tab1))
+
+@figure_cache.memoize(bar_key, raw = True)
+def update_top_n_bar(continent, country_list, start_date, end_date, tab2, tab1):
+    return bar_figure(select_data(continent, country_list, start_date, end_date), tab2, bar_mode(tab1))
+
+def update_dashboard(continent, country_list, start_date, end_date, tab1, tab2, shown_bar_mode = None):
+    # One request per interaction: the selection is looked up once and shared by all outputs,
+    # and outputs that do not depend on the changed input are left as they are
+    triggered = set(t['prop_id'].split('.')[0] for t in dash.callback_context.triggered)
+    filters_changed = not triggered <= {'tabs-1', 'tabs-2'}
+    dataset = store.current()
+    selection = select_data(continent, country_list, start_date, end_date, dataset)
+    key = (dataset.version,) + normalize_filters(continent, country_list, start_date, end_date)
+
+    def output(name, build, *tabs, serialized = False, raw = False):
+        # A failing output keeps its previous value, as it would with a callback of its own
+        cached = figure_cache.cached_json if serialized else figure_cache.cached
+        try:
+            return metrics.timed_output(name, lambda: cached((name,) + key + tabs, lambda: build(selection, *tabs), raw))
+        except Exception:
+            server.logger.exception('Error building %s', name)
+            http_cache.skip()
+            return dash.no_update
+
+    cards = [dash.no_update] * len(CARD_OUTPUTS)
+    main_map = bar = mode = dash.no_update
+    line = output('update_line_graph1', line_json, tab1, tab2, serialized = True, raw = True)
+    if filters_changed:
+        cards = output('update_cards', card_values)
+        main_map = output('update_map1', map_figure, raw = True)
+    # Most tabs-1 values show the same bar chart, so a tabs-1 change only rebuilds it when its mode changes
+    if filters_changed or 'tabs-2' in triggered or bar_mode(tab1) != shown_bar_mode:
+        bar = output('update_top_n_bar', bar_figure, tab2, bar_mode(tab1), raw = True)
+        if bar is not dash.no_update:
+            mode = bar_mode(tab1)
+    if cards is dash.no_update:
+        cards = [dash.no_update] * len(CARD_OUTPUTS)
+    return list(cards) + [line, main_map, bar, mode]
+
+def clientside_payload(continent, country_list):
+    # The rows of the selected countries over all dates, cached per snapshot and country selection
+    dataset = store.current()
+    index = dataset.index
+    if country_list != None:
+        selected = tuple(sorted(set(flatten_list([country_list]))))
+        blocks = index.lookup(selected)
+    else:
+        selected = continent
+        blocks = list(index.all()) if continent == 'All' else index.continent(continent)
+    key = (dataset.version, selected)
+    rows = int((index.stops[blocks] - index.starts[blocks]).sum())
+    if rows > CLIENTSIDE_MAX_ROWS:
+        # Too large to send; the browser asks for the cards and figures instead (see update_server_figures)
+        return {'version': dataset.version, 'key': make_token(key), 'server': True, 'rows': rows}
+
+    def compute():
+        payload = build_payload(dataset, blocks, make_token(key))
+        # Like make_selection, 'All' without a country list ignores the start date
+        payload['ignore_start'] = country_list == None and continent == 'All'
+        payload['countries'] = len(dataset.country_options)
+        return payload
+    return figure_cache.cached(('clientside_payload',) + key, compute)
+
+def update_clientside_data(continent, country_list):
+    return clientside_payload(continent, country_list)
+
+def update_server_figures(request):
+    # Cards and figures of a selection above CLIENTSIDE_MAX_ROWS, built as in the 'separate' mode;
+    # a failing output is sent as null and keeps its previous value (see serverRequest in assets/clientside.js)
+    filters = tuple(request['filters'])
+    tab1, tab2 = request['tabs']
+
+    def output(build, *args):
+        try:
+            return metrics.timed_output(build.__name__, lambda: build(*args))
+        except Exception:
+            server.logger.exception('Error building %s', build.__name__)
+            return None
+
+    cards = output(update_cards, *filters) or [None] * len(CARD_OUTPUTS)
+    figures = [
+        output(update_line_graph1, *(filters + (tab1, tab2))),
+        output(update_map1, *filters),
+        output(update_top_n_bar, *(filters + (tab2, tab1))),
+    ]
+    return {'id': request['id'], 'outputs': list(cards) + figures}
+
+def clientside_figures():
+    # Layouts and trace settings for assets/clientside.js, taken from the server-side builders
+    selection = store.current().select([0])
+    line = line_figure(selection, 'total', 'cases').to_dict()
+    bar = bar_figure(selection, 'cases').to_dict()
+    template = line['layout'].pop('template')
+    bar['layout'].pop('template')
+    trace = {key: value for key, value in bar['data'][0].items() if key not in ['x', 'y']}
+    return {
+        'template': template,
+        'line': line['layout'],
+        'bar': {'layout': bar['layout'], 'trace': trace},
+        'map': map_bases(),
+        'colorway': template['layout']['colorway'],
+        'top_n': TOP_N,
+        'webgl_threshold': WEBGL_THRESHOLD,
+        'rolling_windows': ROLLING_WINDOWS,
+    }
+
+if CALLBACK_MODE == 'fused':
+    app.callback(
+        CARD_OUTPUTS + [
+            Output('count_graph', 'figure'),
+            Output('main_graph', 'figure'),
+            Output('individual_graph', 'figure'),
+            Output('bar_mode', 'data')
+        ],
+        FILTER_INPUTS + [
+            Input('tabs-1', 'value'),
+            Input('tabs-2', 'value')
+        ],
+        [State('bar_mode', 'data')]
+    )(update_dashboard)
+elif CALLBACK_MODE == 'clientside':
+    clientside_figure_data = json.loads(json.dumps(clientside_figures(), cls = plotly.utils.PlotlyJSONEncoder))
+    # Country changes fetch the rows of the selection; the figures are built in the browser
+    app.callback(Output('clientside_data', 'data'), FILTER_INPUTS[:2])(update_clientside_data)
+    app.clientside_callback(
+        ClientsideFunction(namespace = 'dashboard', function_name = 'update'),
+        CARD_OUTPUTS + [
+            Output('count_graph', 'figure'),
+            Output('main_graph', 'figure'),
+            Output('individual_graph', 'figure')
+        ],
+        [Input('clientside_data', 'data')] + FILTER_INPUTS[2:] + [
+            Input('tabs-1', 'value'),
+            Input('tabs-2', 'value'),
+            Input('server_figures', 'data')
+        ],
+        [State('clientside_figures', 'data')]
+    )
+    # Selections above CLIENTSIDE_MAX_ROWS: the browser only sends a request when the payload says so
+    app.clientside_callback(
+        ClientsideFunction(namespace = 'dashboard', function_name = 'serverRequest'),
+        Output('server_request', 'data'),
+        [Input('clientside_data', 'data')] + FILTER_INPUTS[2:] + [
+            Input('tabs-1', 'value'),
+            Input('tabs-2', 'value')
+        ],
+        [State('continent_selector', 'value'), State('select_country', 'value')]
+    )
+    app.callback(
+        Output('server_figures', 'data'), [Input('server_request', 'data')], prevent_initial_call = True
+    )(update_server_figures)
+else:
+    # Update 4 cards
+    app.callback(CARD_OUTPUTS, FILTER_INPUTS)(update_cards)
+    # Update line graph
+    app.callback(
+        Output('count_graph', 'figure'),
+        FILTER_INPUTS + [Input('tabs-1', 'value'), Input('tabs-2', 'value')]
+    )(update_line_graph1)
+    # Update map graph
+    app.callback(Output('main_graph', 'figure'), FILTER_INPUTS)(update_map1)
+    # Update bar1
+    app.callback(
+        Output('individual_graph', 'figure'),
+        FILTER_INPUTS + [Input('tabs-2', 'value'), Input('tabs-1', 'value')]
+    )(update_top_n_bar)
+
+startup_report.mark('callbacks')
+server.logger.info('Startup: %s', startup_report.format())
+
 @app.callback(
     Output('country-count','children'),
     Input('select_country','value')
@@ -773,6 +1150,129 @@ def update_country_count(country_list):
             )
         else:
             return "The current selection contains 1 country."
+
+@server.route('/clientside-data')
+def clientside_data():
+    # The clientside payload for ?continent=...&country=...&country=...
+    countries = flask.request.args.getlist('country') or None
+    payload = clientside_payload(flask.request.args.get('continent', 'All'), countries)
+    response = flask.jsonify(payload)
+    response.set_etag(payload['key'])
+    return response.make_conditional(flask.request)
+
+# The filters posted by the export form, updated in the browser
+app.clientside_callback(
+    ClientsideFunction(namespace = 'dashboard', function_name = 'exportFilters'),
+    Output('export-filters', 'value'),
+    FILTER_INPUTS,
+    [State('continent_countries', 'data')]
+)
+
+def export_filters():
+    # Continent, country list (None for the whole continent), start and end date of an export request
+    if flask.request.method == 'POST':
+        # The JSON written by exportFilters in assets/clientside.js
+        try:
+            filters = json.loads(flask.request.form.get('filters') or '{}')
+        except ValueError:
+            filters = None
+        if not isinstance(filters, dict):
+            flask.abort(400, 'The filters must be a JSON object')
+        countries = filters.get('country')
+        if not all(isinstance(filters.get(key, ''), str) for key in ['continent', 'start_date', 'end_date']):
+            flask.abort(400, 'The continent and dates must be strings')
+        if countries is not None and not (isinstance(countries, list) and all(isinstance(c, str) for c in countries)):
+            flask.abort(400, 'The countries must be a list of strings')
+    else:
+        filters = flask.request.args
+        countries = filters.getlist('country')
+        # An empty country= stands for an empty country list
+        countries = [c for c in countries if c] if countries else None
+    return filters.get('continent', 'All'), countries, filters.get('start_date'), filters.get('end_date')
+
+@server.route('/export.<fmt>', methods = ['GET', 'POST'])
+def export_data(fmt):
+    # The rows of the filters posted by the export form or given as ?continent=...&country=...&start_date=...&end_date=...,
+    # filtered like the charts; without countries, all the countries of the continent are exported
+    if fmt not in ['csv', 'parquet']:
+        flask.abort(404)
+    if fmt == 'parquet' and export.pyarrow is None:
+        flask.abort(501, 'Parquet export needs pyarrow')
+    continent, countries, start_date, end_date = export_filters()
+    dataset = store.current()
+    if continent != 'All' and continent not in dataset.continent_options:
+        flask.abort(400, 'Unknown continent')
+    if countries is None:
+        countries = continent_countries(dataset, continent)
+    dates = dataset.daily.dates
+    try:
+        selection = select_data(
+            continent, countries,
+            start_date or str(dates[0])[:10], end_date or str(dates[-1])[:10], dataset
+        )
+    except ValueError:
+        flask.abort(400, 'Dates must be given as YYYY-MM-DD')
+    filename = 'covid-{}.{}'.format(dataset.version, fmt)
+    if fmt == 'csv':
+        response = flask.Response(export.csv_chunks(selection), mimetype = 'text/csv')
+        response.headers['Content-Disposition'] = 'attachment; filename={}'.format(filename)
+        return response
+    return flask.send_file(
+        export.parquet_file(selection), mimetype = 'application/octet-stream',
+        as_attachment = True, attachment_filename = filename
+    )
+
+def warm_up():
+    # Compute the outputs of the default view into the figure cache; a page load that arrives
+    # meanwhile waits for these computations instead of repeating them (see single_flight.py)
+    start = time.time()
+    dataset = store.current()
+    start_date, end_date = default_dates(dataset)
+    filters = (DEFAULT_CONTINENT, continent_countries(dataset, DEFAULT_CONTINENT),
+               start_date.isoformat(), end_date.isoformat())
+    tab1, tab2 = DEFAULT_TAB1, DEFAULT_TAB2
+    try:
+        # In 'clientside' mode only a selection the browser does not get the rows of is computed here
+        if CALLBACK_MODE != 'clientside' or clientside_payload(*filters[:2]).get('server'):
+            update_cards(*filters)
+            update_map1(*filters)
+            update_top_n_bar(*(filters + (tab2, tab1)))
+            update_line_graph1(*(filters + (tab1, tab2)))
+    except Exception:
+        server.logger.exception('Error warming up the default view')
+    server.logger.info('Warmed up the default view in %.2fs', time.time() - start)
+
+@server.before_first_request
+def start_warm_up():
+    startup_report.request()
+    figure_pool.start()
+    if STARTUP_FIGURES == 'lazy':
+        threading.Thread(target = warm_up, name = 'warm-up', daemon = True).start()
+        # A refreshed snapshot is warmed up by the refresh thread that swaps it in
+        store.on_swap(lambda dataset: warm_up())
+
+@server.route('/startup')
+def startup():
+    return flask.jsonify(startup_report.as_dict())
+
+@server.route('/cache-stats')
+def cache_stats():
+    stats = figure_cache.stats()
+    stats['selection_flight'] = session_store.flight.stats()
+    stats['figure_pool'] = figure_pool.stats()
+    if http_responses is not None:
+        stats['http'] = http_responses.stats()
+    return flask.jsonify(stats)
+
+# Per-callback latency and payload histograms at /metrics (see metrics.py); installed first,
+# so responses served from the HTTP cache below are timed too, under the 'cache' stage
+metrics.install(app)
+
+# ETags and precompressed bodies for the callback responses (see http_cache.py)
+http_responses = http_cache.install(app, store)
+
+# Callback responses encoded by the fast JSON path (see serializer.py)
+serializer.install(app)
 ##########################################
 
 if __name__ == '__main__':
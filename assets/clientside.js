@@ -0,0 +1,356 @@
+if (!window.dash_clientside) {
+    window.dash_clientside = {};
+}
+// Cards and figures for CALLBACK_MODE=clientside. The server sends the daily rows of the
+// selected countries once (see clientside.py); date range and tab changes are handled here.
+window.dash_clientside.dashboard = (function() {
+    var DAY = 86400000;
+    var cache = {key: null, rows: null};
+
+    function decodeColumn(column, lengths) {
+        var values = column.values;
+        var out = new Float64Array(values.length);
+        var i = 0;
+        for (var b = 0; b < lengths.length; b++) {
+            var previous = 0;
+            for (var end = i + lengths[b]; i < end; i++) {
+                var v = values[i];
+                if (v === null) {
+                    out[i] = NaN;
+                } else if (column.delta) {
+                    previous += v;
+                    out[i] = previous;
+                } else {
+                    out[i] = v;
+                }
+            }
+        }
+        return out;
+    }
+
+    function decode(payload) {
+        var key = payload.version + '/' + payload.key;
+        if (cache.key !== key) {
+            var columns = {};
+            for (var name in payload.columns) {
+                columns[name] = decodeColumn(payload.columns[name], payload.lengths);
+            }
+            var starts = [];
+            var offset = 0;
+            for (var b = 0; b < payload.lengths.length; b++) {
+                starts.push(offset);
+                offset += payload.lengths[b];
+            }
+            cache = {key: key, rows: {
+                origin: Date.parse(payload.start),
+                days: decodeColumn(payload.days, payload.lengths),
+                columns: columns,
+                starts: starts,
+                rolling: {}
+            }};
+        }
+        return cache.rows;
+    }
+
+    function dayNumber(date, origin) {
+        return Math.round((Date.parse(date.split('T')[0]) - origin) / DAY);
+    }
+
+    function lowerBound(values, lo, hi, value) {
+        while (lo < hi) {
+            var mid = (lo + hi) >> 1;
+            if (values[mid] < value) {
+                lo = mid + 1;
+            } else {
+                hi = mid;
+            }
+        }
+        return lo;
+    }
+
+    // First and past-the-end row of every location within the date range
+    function bounds(payload, rows, startDate, endDate) {
+        var first = payload.ignore_start || !startDate ? -Infinity : dayNumber(startDate, rows.origin);
+        var last = endDate ? dayNumber(endDate, rows.origin) : Infinity;
+        var ranges = [];
+        for (var b = 0; b < payload.lengths.length; b++) {
+            var lo = rows.starts[b];
+            var hi = lo + payload.lengths[b];
+            var start = lowerBound(rows.days, lo, hi, first);
+            ranges.push([start, Math.max(start, lowerBound(rows.days, lo, hi, last + 1))]);
+        }
+        return ranges;
+    }
+
+    function rangeMax(values, lo, hi) {
+        var max = NaN;
+        for (var i = lo; i < hi; i++) {
+            if (!isNaN(values[i]) && !(values[i] <= max)) {
+                max = values[i];
+            }
+        }
+        return max;
+    }
+
+    function rangeSum(values, lo, hi) {
+        var sum = 0;
+        var count = 0;
+        for (var i = lo; i < hi; i++) {
+            if (!isNaN(values[i])) {
+                sum += values[i];
+                count++;
+            }
+        }
+        return [sum, count];
+    }
+
+    // Same as rolling_mean in rolling.py: the average of the known values of each row's location
+    // dated less than `span` days before it, added up in the same order; computed once per payload
+    function rollingMean(payload, rows, column, span) {
+        var name = column + '/' + span;
+        if (!rows.rolling[name]) {
+            var values = rows.columns[column];
+            var out = new Float64Array(values.length);
+            for (var b = 0; b < payload.lengths.length; b++) {
+                var first = rows.starts[b];
+                for (var i = first, end = first + payload.lengths[b]; i < end; i++) {
+                    while (rows.days[first] <= rows.days[i] - span) {
+                        first++;
+                    }
+                    var sum = 0;
+                    var count = 0;
+                    for (var j = i; j >= first; j--) {
+                        if (!isNaN(values[j])) {
+                            sum += values[j];
+                            count++;
+                        }
+                    }
+                    out[i] = count > 0 ? sum / count : NaN;
+                }
+            }
+            rows.rolling[name] = out;
+        }
+        return rows.rolling[name];
+    }
+
+    function nullable(values) {
+        return Array.prototype.map.call(values, function(v) { return isNaN(v) ? null : v; });
+    }
+
+    // Same as human_format in app.py
+    function humanFormat(num) {
+        if (num === 0) {
+            return '0';
+        }
+        var magnitude = Math.trunc(Math.log(num) / Math.log(1000));
+        var mantissa = String(Math.trunc(num / Math.pow(1000, magnitude)));
+        return mantissa + ['', 'K', 'M', 'G', 'T', 'P'][magnitude];
+    }
+
+    function pretty(tab2) {
+        return tab2.split('hosp').join('hospital').split('_').join(' ');
+    }
+
+    function titleCase(text) {
+        return text.replace(/\b[a-z]/g, function(c) { return c.toUpperCase(); });
+    }
+
+    function copy(value) {
+        return JSON.parse(JSON.stringify(value));
+    }
+
+    function cards(payload, rows, ranges) {
+        var values = [];
+        ['total_cases', 'total_deaths', 'total_tests'].forEach(function(column) {
+            var total = 0;
+            ranges.forEach(function(range) {
+                var max = rangeMax(rows.columns[column], range[0], range[1]);
+                if (!isNaN(max)) {
+                    total += max;
+                }
+            });
+            values.push(humanFormat(total));
+        });
+        var patients = 0;
+        ranges.forEach(function(range) {
+            patients += rangeSum(rows.columns['hosp_patients'], range[0], range[1])[0];
+        });
+        values.push(humanFormat(patients));
+        return values;
+    }
+
+    function lineFigure(payload, rows, ranges, figures, tab1, tab2) {
+        var column = tab1 === 'total' ? 'total_' + tab2 : (rows.columns['new_' + tab2] ? 'new_' + tab2 : tab2);
+        var span = figures.rolling_windows[tab1];
+        var values = span ? rollingMean(payload, rows, column, span) : rows.columns[column];
+        var prefix = span ? span + '-day average daily ' : (tab1 === 'total' ? 'Total ' : 'New ');
+        var label = span ? span + '-day Average Daily ' + titleCase(pretty(tab2)) : prefix + titleCase(pretty(tab2));
+        var points = 0;
+        var traces = [];
+        ranges.forEach(function(range, b) {
+            if (range[1] <= range[0]) {
+                return;
+            }
+            var name = payload.locations[b];
+            var x = [];
+            for (var i = range[0]; i < range[1]; i++) {
+                x.push(new Date(rows.origin + rows.days[i] * DAY).toISOString().slice(0, 10));
+            }
+            points += x.length;
+            traces.push({
+                type: 'scatter',
+                mode: 'lines',
+                name: name,
+                legendgroup: name,
+                line: {color: figures.colorway[traces.length % figures.colorway.length], dash: 'solid'},
+                hovertemplate: 'Country=' + name + '<br>Date=%{x}<br>' + label + '=%{y}<extra></extra>',
+                orientation: 'v',
+                showlegend: true,
+                x: x,
+                y: nullable(values.subarray(range[0], range[1])),
+                xaxis: 'x',
+                yaxis: 'y'
+            });
+        });
+        if (points > figures.webgl_threshold) {
+            traces.forEach(function(trace) { trace.type = 'scattergl'; });
+        }
+        var layout = copy(figures.line);
+        layout.template = figures.template;
+        layout.title = {text: prefix + pretty(tab2) + ' over time across selected countries'};
+        layout.yaxis.title = {text: label};
+        return {data: traces, layout: layout};
+    }
+
+    function mapFigure(payload, rows, ranges, figures) {
+        var locations = [];
+        var z = [];
+        var names = [];
+        ranges.forEach(function(range, b) {
+            if (range[1] > range[0]) {
+                var max = rangeMax(rows.columns['total_cases'], range[0], range[1]);
+                locations.push(payload.iso_codes[b]);
+                z.push(isNaN(max) ? null : max);
+                names.push(payload.locations[b]);
+            }
+        });
+        var base = figures.map[names.length < payload.countries ? 'Purples' : 'Blues'];
+        var trace = Object.assign({}, base.data[0], {locations: locations, z: z, hovertext: names});
+        return {data: [trace], layout: base.layout};
+    }
+
+    function barFigure(payload, rows, ranges, figures, tab1, tab2) {
+        var column = tab2 !== 'hosp_patients' ? 'new_' + tab2 : tab2;
+        var span = figures.rolling_windows[tab1];
+        // With a rolling average tab, each country's latest value in the range rather than its average
+        var measure = span ? span + '-day average daily' : 'Average daily';
+        var rolling = span ? rollingMean(payload, rows, column, span) : null;
+        var averages = [];
+        ranges.forEach(function(range, b) {
+            if (rolling) {
+                if (range[1] > range[0] && !isNaN(rolling[range[1] - 1])) {
+                    averages.push({name: payload.locations[b], value: rolling[range[1] - 1], position: b});
+                }
+                return;
+            }
+            var sum = rangeSum(rows.columns[column], range[0], range[1]);
+            if (sum[1] > 0) {
+                averages.push({name: payload.locations[b], value: sum[0] / sum[1], position: b});
+            }
+        });
+        // The top N in ascending order, ties kept in location order, as top_n in cube.py
+        var top = averages.slice().sort(function(a, b) {
+            return a.value - b.value || a.position - b.position;
+        }).slice(-figures.top_n);
+        var label = tab2 !== 'hosp_patients' ? measure + ' ' + tab2 : (rolling ? column + '_' + tab1 : column);
+        var title;
+        if (averages.length === payload.countries) {
+            title = 'Top ' + top.length + ' Countries worldwide in terms of ' + measure + ' COVID ' + pretty(tab2);
+        } else {
+            title = 'Top ' + top.length + ' Countries in terms of ' + measure + ' COVID ' +
+                (tab2 !== 'hosp_patients' ? tab2 : pretty(tab2));
+        }
+        var trace = Object.assign({}, figures.bar.trace, {
+            x: top.map(function(item) { return item.value; }),
+            y: top.map(function(item) { return item.name; }),
+            hovertemplate: label + '=%{x}<br>Country=%{y}<extra></extra>'
+        });
+        var layout = copy(figures.bar.layout);
+        layout.template = figures.template;
+        layout.title = {text: title};
+        layout.xaxis.title = {text: label};
+        return {data: [trace], layout: layout};
+    }
+
+    function sameCountries(countries, other) {
+        if (!other || countries.length !== other.length) {
+            return false;
+        }
+        var known = {};
+        other.forEach(function(country) { known[country] = true; });
+        return countries.every(function(country) { return known[country] === true; });
+    }
+
+    // Identifies the filters and tabs of a request for a selection computed on the server
+    function requestId(payload, startDate, endDate, tab1, tab2) {
+        return [payload.version, payload.key, startDate, endDate, tab1, tab2].join('/');
+    }
+
+    return {
+        // The filters posted by the export form (see export_data in app.py); a country list that holds
+        // exactly the countries of the continent, or of all continents, is sent as the continent alone
+        exportFilters: function(continent, countries, startDate, endDate, continentCountries) {
+            var filters = {continent: continent || 'All'};
+            if (countries) {
+                countries = [].concat(countries);
+                continentCountries = continentCountries || {};
+                if (sameCountries(countries, continentCountries['All'])) {
+                    filters.continent = 'All';
+                } else if (!sameCountries(countries, continentCountries[filters.continent])) {
+                    filters.country = countries;
+                }
+            }
+            if (startDate) {
+                filters.start_date = startDate.split('T')[0];
+            }
+            if (endDate) {
+                filters.end_date = endDate.split('T')[0];
+            }
+            return JSON.stringify(filters);
+        },
+
+        // For a selection above CLIENTSIDE_MAX_ROWS the payload only says so, and the cards and
+        // figures are requested from the server (see update_server_figures in app.py)
+        serverRequest: function(payload, startDate, endDate, tab1, tab2, continent, countries) {
+            if (!payload || !payload.server) {
+                return window.dash_clientside.no_update;
+            }
+            return {
+                id: requestId(payload, startDate, endDate, tab1, tab2),
+                filters: [continent, countries, startDate, endDate],
+                tabs: [tab1, tab2]
+            };
+        },
+
+        update: function(payload, startDate, endDate, tab1, tab2, server, figures) {
+            var noUpdate = window.dash_clientside.no_update;
+            if (!payload || !figures) {
+                return Array(7).fill(noUpdate);
+            }
+            if (payload.server) {
+                // Wait for the server's answer to the current request; outputs it failed to build stay as they are
+                if (!server || server.id !== requestId(payload, startDate, endDate, tab1, tab2)) {
+                    return Array(7).fill(noUpdate);
+                }
+                return server.outputs.map(function(output) { return output === null ? noUpdate : output; });
+            }
+            var rows = decode(payload);
+            var ranges = bounds(payload, rows, startDate, endDate);
+            return cards(payload, rows, ranges).concat([
+                lineFigure(payload, rows, ranges, figures, tab1, tab2),
+                mapFigure(payload, rows, ranges, figures),
+                barFigure(payload, rows, ranges, figures, tab1, tab2)
+            ]);
+        }
+    };
+})();
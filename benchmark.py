@@ -0,0 +1,176 @@
+"""Benchmarks of the data path and the dashboard callbacks.
+
+A synthetic dataset (see synthetic.py) is published as the snapshot the app
+loads, so no network access is needed. Every function is timed over a grid of
+filter scenarios (all countries, one continent, a few countries; the full date
+range and the last 30 days) with the figure cache and session store emptied
+before each call, so the numbers are for a cold computation. Peak memory is
+measured with tracemalloc in a separate run, as tracing slows the calls down.
+Results are written as JSON; ``--compare`` prints the change against an
+earlier results file.
+
+    python benchmark.py --locations 200 --days 600 --output before.json
+    python benchmark.py --locations 200 --days 600 --output after.json --compare before.json
+"""
+import os
+import json
+import shutil
+import time
+import platform
+import tempfile
+import argparse
+import subprocess
+import tracemalloc
+import datetime
+
+def scenarios(app):
+    dataset = app.store.current()
+    first, last = dataset.df2.date.min(), dataset.df2.date.max()
+    continent = dataset.continent_options[0]
+    filters = [
+        # The country list is what update_countries sets for the continent, as in the browser
+        ('all', 'All', app.update_countries.__wrapped__('All')),
+        ('continent', continent, app.update_countries.__wrapped__(continent)),
+        ('countries', 'All', dataset.country_options[:3]),
+    ]
+    ranges = [
+        ('long', first),
+        ('short', max(first, last - datetime.timedelta(days = 29))),
+    ]
+    for name, continent, country_list in filters:
+        for range_name, start in ranges:
+            yield '{}/{}'.format(name, range_name), (
+                continent, country_list, start.strftime('%Y-%m-%d'), last.strftime('%Y-%m-%d')
+            )
+
+def functions(app):
+    # Each entry turns the filter arguments into one call; callbacks are called without their cache
+    return [
+        ('subset_data', lambda f: app.subset_data(*f)),
+        ('get_total', lambda f: app.get_total(app.select_data(*f))),
+        ('get_new', lambda f: app.get_new(app.select_data(*f))),
+        ('get_average', lambda f: app.get_average(app.select_data(*f))),
+        ('get_total[frame]', lambda f: app.get_total(app.subset_data(*f))),
+        ('get_new[frame]', lambda f: app.get_new(app.subset_data(*f))),
+        ('get_average[frame]', lambda f: app.get_average(app.subset_data(*f))),
+        ('update_cards', lambda f: app.update_cards.__wrapped__(*f)),
+        ('update_line_graph1', lambda f: app.update_line_graph1.__wrapped__(*(f + ('total', 'cases')))),
+        ('update_map1', lambda f: app.update_map1.__wrapped__(*f)),
+        ('update_top_n_bar', lambda f: app.update_top_n_bar.__wrapped__(*(f + ('cases', 'total')))),
+    ]
+
+def reset(app):
+    app.figure_cache.clear()
+    app.session_store.clear()
+
+def run(app, repeat):
+    results = []
+    for scenario, filters in scenarios(app):
+        rows = len(app.subset_data(*filters))
+        for name, call in functions(app):
+            result = {'function': name, 'scenario': scenario, 'rows': rows}
+            try:
+                result.update(measure(app, call, filters, repeat))
+            except Exception as error:
+                # A failing callback is recorded rather than stopping the run
+                result['error'] = repr(error)
+                print('{:<20} {:<18} {:>8} rows failed: {!r}'.format(name, scenario, rows, error))
+            else:
+                print('{:<20} {:<18} {:>8} rows {:>10.2f} ms {:>10.1f} kB'.format(
+                    name, scenario, rows, result['median_ms'], result['peak_kb']
+                ))
+            results.append(result)
+    return results
+
+def measure(app, call, filters, repeat):
+    timings = []
+    for _ in range(repeat):
+        reset(app)
+        start = time.perf_counter()
+        call(filters)
+        timings.append((time.perf_counter() - start) * 1000)
+    reset(app)
+    tracemalloc.start()
+    try:
+        call(filters)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    timings.sort()
+    return {
+        'min_ms': round(timings[0], 3),
+        'median_ms': round(timings[len(timings) // 2], 3),
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd = os.path.dirname(os.path.abspath(__file__)),
+            stderr = subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, previous):
+    before = {(r['function'], r['scenario']): r for r in previous['results']}
+    print('\nchange against commit {}:'.format(previous['meta'].get('commit')))
+    for r in results:
+        old = before.get((r['function'], r['scenario']))
+        if old is None or not old.get('median_ms') or 'median_ms' not in r:
+            continue
+        print('{:<20} {:<18} {:>10.2f} -> {:>10.2f} ms ({:+.0%})'.format(
+            r['function'], r['scenario'], old['median_ms'], r['median_ms'], r['median_ms'] / old['median_ms'] - 1
+        ))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmark the data path and the callbacks on synthetic data.')
+    parser.add_argument('--locations', type = int, default = 200)
+    parser.add_argument('--days', type = int, default = 600)
+    parser.add_argument('--null-density', type = float, default = 0.2)
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--repeat', type = int, default = 5)
+    parser.add_argument('--output', default = 'benchmark.json')
+    parser.add_argument('--compare', default = None, help = 'earlier results file to compare against')
+    args = parser.parse_args()
+
+    # Publish the synthetic snapshot before app.py is imported, so it is what the app loads
+    snapshot = tempfile.mkdtemp(prefix = 'owid-benchmark-')
+    os.environ['OWID_SNAPSHOT_PATH'] = snapshot
+    os.environ['OWID_REFRESH_INTERVAL'] = '0'
+    import synthetic
+    synthetic.install(snapshot, locations = args.locations, days = args.days,
+                      null_density = args.null_density, seed = args.seed)
+    start = time.perf_counter()
+    import app
+    import_seconds = time.perf_counter() - start
+
+    import numpy as np
+    import pandas as pd
+    try:
+        results = run(app, args.repeat)
+    finally:
+        shutil.rmtree(snapshot, ignore_errors = True)
+    output = {
+        'meta': {
+            'commit': git_commit(),
+            'created': datetime.datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'locations': args.locations,
+            'days': args.days,
+            'null_density': args.null_density,
+            'seed': args.seed,
+            'repeat': args.repeat,
+            'rows': len(app.store.current().df2),
+            'import_seconds': round(import_seconds, 3),
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as handle:
+        json.dump(output, handle, indent = 1)
+    print('wrote {} results to {}'.format(len(results), args.output))
+    if args.compare:
+        with open(args.compare) as handle:
+            compare(results, json.load(handle))
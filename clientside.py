@@ -0,0 +1,69 @@
+"""Compact per-location daily data for the clientside callback mode.
+
+With ``CALLBACK_MODE=clientside`` the server sends the daily rows of the
+selected countries to the browser once per country selection. The cards and
+figures are then recomputed in the browser (``assets/clientside.js``) when the
+date range or a tab changes, without a request to the server.
+
+Each payload is versioned by the data snapshot and the selected locations.
+Rows are stored location after location, and every location's rows are sorted
+by date. Dates are day numbers counted from ``start``; they and the running
+totals are delta-encoded. Each location's first value is absolute; after that every value
+is the difference to the previous known value, and missing values are null.
+Whole-numbered columns are sent as integers.
+"""
+import numpy as np
+from location_index import range_rows
+
+DAILY_COLUMNS = ['new_cases', 'new_deaths', 'new_tests', 'hosp_patients']
+TOTAL_COLUMNS = ['total_cases', 'total_deaths', 'total_tests', 'total_hosp_patients']
+
+def encode_column(values, starts, delta):
+    """List of values with None for NaN, optionally as differences to the previous known value of the block."""
+    known = ~np.isnan(values)
+    whole = bool(np.all(values[known] == np.round(values[known])))
+    # Float columns are sent as they are, so summing differences in the browser cannot drift
+    delta = delta and whole
+    if delta and len(values):
+        # Row of the previous known value, if it is in the same block
+        last = np.maximum.accumulate(np.where(known, np.arange(len(values)), -1))
+        previous = np.concatenate([[-1], last[:-1]])
+        block_start = np.repeat(starts, np.diff(np.append(starts, len(values))))
+        previous = np.where(previous >= block_start, previous, -1)
+        base = np.where(previous >= 0, values[np.maximum(previous, 0)], 0.0)
+        values = np.where(known, values - base, np.nan)
+    if whole:
+        encoded = [int(v) if k else None for v, k in zip(values.tolist(), known.tolist())]
+    else:
+        encoded = [v if k else None for v, k in zip(values.tolist(), known.tolist())]
+    return {'delta': delta, 'values': encoded}
+
+def build_payload(dataset, blocks, key):
+    """The encoded daily rows of the given location blocks of a dataset."""
+    index = dataset.index
+    blocks = np.asarray(blocks, dtype = int)
+    lo, hi = index.starts[blocks], index.stops[blocks]
+    rows = range_rows(lo, hi)
+    lengths = hi - lo
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(int) if len(lengths) else lengths
+    df = dataset.df2
+
+    dates = df['date'].to_numpy()[rows]
+    start = dates.min() if len(dates) else np.datetime64('1970-01-01')
+    days = ((dates - start) // np.timedelta64(1, 'D')).astype(float)
+
+    columns = {}
+    for column in TOTAL_COLUMNS + DAILY_COLUMNS:
+        if column in df.columns:
+            values = df[column].to_numpy(dtype = float)[rows]
+            columns[column] = encode_column(values, starts, column in TOTAL_COLUMNS)
+    return {
+        'version': dataset.version,
+        'key': key,
+        'start': str(np.datetime_as_string(start, unit = 'D')),
+        'locations': index.locations[blocks].tolist(),
+        'iso_codes': [c if isinstance(c, str) else None for c in df['iso_code'].iloc[lo].tolist()],
+        'lengths': lengths.tolist(),
+        'days': encode_column(days, starts, True),
+        'columns': columns,
+    }
@@ -0,0 +1,171 @@
+"""Precomputed aggregates over the location blocks of ``df2``.
+
+For every daily column the cube keeps a prefix sum and a prefix count of the
+non-null values, and for every ``total_*`` column the running maximum within
+each location. The sum, mean or maximum of any location over any date range is
+then a couple of array lookups, so ``get_total``, ``get_new`` and
+``get_average`` cost O(locations) instead of O(rows). The counts are whole
+numbers, so the prefix sums are exact and the results equal the groupby
+versions in app.py.
+"""
+import threading
+import numpy as np
+import pandas as pd
+
+class AggregationCube(object):
+    def __init__(self, df2, index, df3):
+        self.df2 = df2
+        self.index = index
+        self.columns = set(df2.columns)
+        # A location maps to one iso_code unless the data says otherwise, then merge like app.py does
+        if df3['location'].is_unique:
+            self.iso_codes = df3.set_index('location')['iso_code'].reindex(index.locations).to_numpy()
+        else:
+            self.iso_codes = None
+        self.df3 = df3
+        self._prefix = {}
+        self._running_max = {}
+        self._lock = threading.Lock()
+
+    ########### Per-column structures, built on first use
+    def prefix(self, column):
+        """Prefix sums and prefix non-null counts of a column, both of length rows + 1."""
+        if column not in self._prefix:
+            with self._lock:
+                if column not in self._prefix:
+                    values = self.df2[column].to_numpy(dtype = float)
+                    valid = ~np.isnan(values)
+                    sums = np.concatenate([[0.0], np.cumsum(np.where(valid, values, 0.0))])
+                    counts = np.concatenate([[0], np.cumsum(valid)]).astype('int32')
+                    self._prefix[column] = (sums, counts)
+        return self._prefix[column]
+
+    def running_max(self, column):
+        """Maximum from the start of the location up to each row, and whether the location never decreases."""
+        if column not in self._running_max:
+            with self._lock:
+                if column not in self._running_max:
+                    values = self.df2[column].to_numpy(dtype = float)
+                    running = np.empty_like(values)
+                    monotonic = np.ones(len(self.index.starts), dtype = bool)
+                    for i, (start, stop) in enumerate(zip(self.index.starts, self.index.stops)):
+                        block = values[start:stop]
+                        running[start:stop] = np.fmax.accumulate(block)
+                        known = block[~np.isnan(block)]
+                        monotonic[i] = (np.diff(known) >= 0).all()
+                    self._running_max[column] = (running, monotonic)
+        return self._running_max[column]
+
+    def warm(self):
+        """Build the structures of every metric column now instead of on first use."""
+        for column in self.df2.columns:
+            if self.df2[column].dtype.kind == 'f':
+                self.prefix(column)
+                if column.startswith('total_'):
+                    self.running_max(column)
+
+    def nbytes(self):
+        arrays = [a for pair in list(self._prefix.values()) + list(self._running_max.values()) for a in pair]
+        return sum(a.nbytes for a in arrays)
+
+    ########### Per-location aggregates of a selection
+    def sums(self, selection, column):
+        sums, counts = self.prefix(column)
+        return sums[selection.hi] - sums[selection.lo], counts[selection.hi] - counts[selection.lo]
+
+    def maxima(self, selection, column):
+        running, monotonic = self.running_max(column)
+        counts = self.prefix(column)[1]
+        blocks, lo, hi = selection.blocks, selection.lo, selection.hi
+        n = counts[hi] - counts[lo]
+        output = np.full(len(blocks), np.nan)
+        for j in np.flatnonzero(n > 0):
+            # The running maximum covers lo:hi exactly when the range starts at the block start
+            # or the values never decrease; otherwise scan the range
+            if lo[j] == self.index.starts[blocks[j]] or monotonic[blocks[j]]:
+                output[j] = running[hi[j] - 1]
+            else:
+                output[j] = np.nanmax(self.df2[column].to_numpy()[lo[j]:hi[j]])
+        return output
+
+    ########### Frames in the shape of app.get_total / get_new / get_average
+    def daily_column(self, metric):
+        column = 'new_{}'.format(metric)
+        return column if column in self.columns else metric
+
+    def _by_location(self, selection, column, values):
+        present = selection.hi > selection.lo
+        blocks = selection.blocks[present]
+        df = pd.DataFrame({
+            'location': self.index.locations[blocks],
+            column: values[present],
+        })
+        if self.iso_codes is not None:
+            df['iso_code'] = self.iso_codes[blocks]
+        else:
+            df = pd.merge(df, self.df3, on = 'location', how = 'left')
+        return df
+
+    def _by_continent(self, selection, columns):
+        present = selection.hi > selection.lo
+        continents = self.index.block_continents[selection.blocks[present]]
+        df = pd.DataFrame({column: values[present] for column, values in columns.items()})
+        return df.groupby(continents).sum()
+
+    def get_total(self, selection, metric = 'cases', level = 'country', sum = False):
+        column = 'total_{}'.format(metric)
+        maxima = self.maxima(selection, column)
+        if level == 'country':
+            df = self._by_location(selection, column, maxima)
+        else:
+            df = self._by_continent(selection, {column: maxima})
+            df = df.rename_axis('continent').reset_index()
+        if sum == True:
+            return df[column].sum()
+        return df
+
+    def get_new(self, selection, metric = 'cases', level = 'country', sum = False):
+        column = self.daily_column(metric)
+        sums, counts = self.sums(selection, column)
+        if level == 'country':
+            df = self._by_location(selection, column, sums)
+        else:
+            df = self._by_continent(selection, {column: sums})
+            df = df.rename_axis('continent').reset_index()
+        if sum == True:
+            return df[column].sum()
+        return df
+
+    def get_average(self, selection, metric = 'cases', level = 'country'):
+        column = self.daily_column(metric)
+        sums, counts = self.sums(selection, column)
+        if level == 'country':
+            with np.errstate(invalid = 'ignore', divide = 'ignore'):
+                means = np.where(counts > 0, sums / counts, np.nan)
+            df = self._by_location(selection, column, means)
+        else:
+            df = self._by_continent(selection, {column: sums, 'count': counts})
+            with np.errstate(invalid = 'ignore', divide = 'ignore'):
+                df[column] = np.where(df['count'] > 0, df[column] / df['count'], np.nan)
+            df = df[[column]].rename_axis('continent').reset_index()
+        df = df.dropna(subset = [column]).reset_index(drop = True)
+        return df
+
+def top_n(df, column, n):
+    """The ``n`` rows of ``df`` with the largest ``column``, smallest first.
+
+    Gives the rows of ``df.sort_values(column, kind = 'mergesort').tail(n)`` for
+    a column without missing values, but with a partial selection
+    (``np.partition``) instead of sorting every row; only the picked rows are sorted.
+    """
+    values = df[column].to_numpy(dtype = float)
+    rows = np.flatnonzero(~np.isnan(values))
+    if n <= 0:
+        return df.iloc[:0]
+    if len(rows) > n:
+        kth = np.partition(values[rows], len(rows) - n)[len(rows) - n]
+        above = rows[values[rows] > kth]
+        # Ties with the n-th largest value are taken from the end, as tail() would
+        tied = rows[values[rows] == kth]
+        rows = np.concatenate([above, tied[len(tied) - (n - len(above)):]])
+    return df.iloc[rows[np.lexsort((rows, values[rows]))]]
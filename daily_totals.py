@@ -0,0 +1,108 @@
+"""Daily totals of every metric per continent and worldwide.
+
+Built once per dataset, so a refresh (which builds a new Dataset) keeps them
+current. For every group (each continent and ``World``) and every date of
+``df2`` there are two tables:
+
+- ``sums``: the sum of a column over the group's rows of that date, as a
+  prefix over the dates, so the sum over any date range is two lookups.
+- ``running``: for the ``total_*`` columns, the sum over the group's locations
+  of their running maximum up to that date, which is what the cards add up.
+
+A selection can be answered from them when it holds exactly the locations of
+a group over a date range (see ``match``); the cards then need no
+per-location rows.
+"""
+import numpy as np
+import pandas as pd
+
+WORLD = 'World'
+
+class DailyTotals(object):
+    def __init__(self, df2, index):
+        self.index = index
+        self.dates = np.unique(df2['date'].to_numpy())
+        self.groups = sorted(c for c in index.continents if isinstance(c, str)) + [WORLD]
+        self._blocks = {c: np.asarray(index.continents[c], dtype = int) for c in self.groups[:-1]}
+        self._blocks[WORLD] = np.arange(len(index.locations))
+
+        n_days = len(self.dates)
+        lengths = index.stops - index.starts
+        block = np.repeat(np.arange(len(lengths)), lengths)
+        day = np.searchsorted(self.dates, index.dates)
+        group_of_block = np.array([self.groups.index(c) if c in self._blocks else -1
+                                   for c in index.block_continents], dtype = int)
+        group = group_of_block[block]
+        known = group >= 0
+        # Rows are counted once under their continent and once under World
+        keys = [group[known] * n_days + day[known], (len(self.groups) - 1) * n_days + day]
+        rows = [known, slice(None)]
+        first = np.zeros(len(block), dtype = bool)
+        first[index.starts] = True
+
+        def daily(values):
+            output = np.zeros(len(self.groups) * n_days)
+            for key, row in zip(keys, rows):
+                # The continent rows hold no World keys, so the two passes do not overlap
+                output += np.bincount(key, weights = values[row], minlength = len(output))
+            return output.reshape(len(self.groups), n_days)
+
+        self.sums = {}
+        self.running = {}
+        for column in df2.columns:
+            if df2[column].dtype.kind != 'f':
+                continue
+            values = df2[column].to_numpy(dtype = float)
+            sums = daily(np.nan_to_num(values))
+            self.sums[column] = np.concatenate([np.zeros((len(self.groups), 1)), np.cumsum(sums, axis = 1)], axis = 1)
+            if column.startswith('total_'):
+                # Carry each location's running maximum forward and add up its increments per date
+                running = pd.Series(values).groupby(block).cummax().groupby(block).ffill().fillna(0).to_numpy()
+                increments = np.where(first, running, running - np.concatenate([[0.0], running[:-1]]))
+                self.running[column] = np.cumsum(daily(increments), axis = 1)
+
+    def nbytes(self):
+        return sum(a.nbytes for a in list(self.sums.values()) + list(self.running.values())) + self.dates.nbytes
+
+    def match(self, selection):
+        """The group and the [first, last) dates a selection covers, or None if it is not a whole group."""
+        blocks = np.asarray(selection.blocks, dtype = int)
+        for group, group_blocks in self._blocks.items():
+            if np.array_equal(blocks, group_blocks):
+                break
+        else:
+            return None
+        index = self.index
+        lo, hi = selection.lo, selection.hi
+        starts, stops = index.starts[blocks], index.stops[blocks]
+        present = hi > lo
+        if not present.any():
+            return group, 0, 0
+        start = index.dates[lo[present]].min()
+        end = index.dates[hi[present] - 1].max()
+        # Every location must hold all of its rows in [start, end], not only some of them
+        if (index.dates[lo[lo > starts] - 1] >= start).any() or (index.dates[hi[hi < stops]] <= end).any():
+            return None
+        first = np.searchsorted(self.dates, start, 'left')
+        last = np.searchsorted(self.dates, end, 'right')
+        return group, first, last
+
+    def sum(self, selection, column):
+        """Sum of a column over a selection, or None if the selection cannot be answered here."""
+        match = self.match(selection)
+        if match is None or column not in self.sums:
+            return None
+        group, first, last = match
+        sums = self.sums[column][self.groups.index(group)]
+        return sums[last] - sums[first]
+
+    def total(self, selection, column):
+        """Sum over the locations of their maximum of a ``total_*`` column, as get_total(sum = True)."""
+        match = self.match(selection)
+        if match is None or column not in self.running:
+            return None
+        # The running maximum only equals the maximum in the range when no location's start is cut off
+        if (selection.lo != self.index.starts[selection.blocks]).any():
+            return None
+        group, first, last = match
+        return self.running[column][self.groups.index(group)][last - 1] if last > 0 else 0.0
@@ -0,0 +1,391 @@
+"""Loading and local snapshots of the OWID COVID-19 dataset.
+
+The cleaned frames used by the dashboard (``df2``, ``df3`` and ``metadata``) are
+stored as a versioned snapshot with one ``.npy`` file per column, so a worker
+boot reads them from local disk instead of downloading and re-parsing the
+source CSV. The source is only read when no snapshot exists yet or when a
+refresh is asked for, e.g.
+
+    python dataset.py refresh --source /path/to/owid-covid-data.csv
+"""
+import os
+import json
+import shutil
+import pathlib
+import argparse
+import datetime
+import pandas as pd
+import numpy as np
+from location_index import LocationIndex, range_rows
+from cube import AggregationCube
+from daily_totals import DailyTotals
+from rolling import rolling_averages, rolling_columns
+
+PATH = pathlib.Path(__file__).parent
+SNAPSHOT_PATH = pathlib.Path(os.environ.get('OWID_SNAPSHOT_PATH', PATH.joinpath('data', 'snapshot')))
+
+# Source locations, either URLs or local file paths
+DATA_SOURCE = os.environ.get('OWID_DATA_SOURCE', 'https://covid.ourworldindata.org/data/owid-covid-data.csv')
+CODEBOOK_SOURCE = os.environ.get(
+    'OWID_CODEBOOK_SOURCE',
+    'https://github.com/owid/covid-19-data/blob/master/public/data/owid-covid-codebook.csv?raw=true'
+)
+
+USECOLS = ['iso_code','continent','location','date','total_cases','new_cases','total_deaths',
+           'new_deaths','icu_patients','hosp_patients','new_tests','total_tests']
+
+# Bump when the on-disk layout changes; older snapshots are then ignored
+SNAPSHOT_FORMAT = 1
+KEEP_SNAPSHOTS = 3
+
+# Parsed with fixed types, so pandas infers nothing and every chunk gets the same dtypes
+SOURCE_DTYPES = dict((column, object if column in ['iso_code','continent','location'] else 'float64')
+                     for column in USECOLS if column != 'date')
+DATE_FORMAT = '%Y-%m-%d'
+
+def parse_dates(data):
+    data['date'] = pd.to_datetime(data['date'], format = DATE_FORMAT)
+    return data
+
+def read_source(source = DATA_SOURCE, chunksize = None):
+    """The used columns of the source, or an iterator over chunks of them if ``chunksize`` is set."""
+    data = pd.read_csv(source, usecols = USECOLS, dtype = SOURCE_DTYPES, chunksize = chunksize)
+    if chunksize is None:
+        return parse_dates(data)
+    return (parse_dates(chunk) for chunk in data)
+
+def read_codebook(source = CODEBOOK_SOURCE):
+    return pd.read_csv(source)
+
+# Derived running totals and the daily column they are summed from
+CUMULATIVE_COLUMNS = {
+    'total_hosp_patients': 'hosp_patients',
+    'total_icu_patients': 'icu_patients',
+}
+
+# Rows of these locations and negative values in these columns are dropped
+AGGREGATE_LOCATIONS = ['World','International']
+NON_NEGATIVE_COLUMNS = ['new_cases','new_deaths','new_tests','hosp_patients']
+
+def sort_keys(data):
+    """An int64 key per row that orders the rows by location and date, missing values last."""
+    locations, names = pd.factorize(data['location'], sort = True)
+    dates, days = pd.factorize(data['date'], sort = True)
+    locations = np.where(locations < 0, len(names), locations)
+    dates = np.where(dates < 0, len(days), dates)
+    return locations.astype('int64') * (len(days) + 1) + dates, locations, names
+
+def cleaning_mask(data, counted = None):
+    """The rows to keep, their sort keys and the number of rows (of ``counted``, default all) dropped by each rule."""
+    keys, locations, names = sort_keys(data)
+    rules = {}
+    # Only rows sharing a location and date can be duplicates, so only those are compared in full
+    rules['duplicate'] = np.zeros(len(data), dtype = bool)
+    candidates = pd.Series(keys).duplicated(keep = False).to_numpy()
+    if candidates.any():
+        rules['duplicate'][candidates] = data[candidates].duplicated().to_numpy()
+    rules['aggregate'] = np.isin(locations, np.flatnonzero(names.isin(AGGREGATE_LOCATIONS)))
+    # Negative daily increases
+    for column in NON_NEGATIVE_COLUMNS:
+        rules['negative_{}'.format(column)] = data[column].to_numpy(dtype = float) < 0
+    # A row dropped by several rules is counted under the first
+    keep = np.ones(len(data), dtype = bool)
+    counted = keep.copy() if counted is None else np.asarray(counted, dtype = bool)
+    dropped = {}
+    for rule, mask in rules.items():
+        dropped[rule] = int((mask & keep & counted).sum())
+        keep &= ~mask
+    return keep, keys, dropped
+
+def filter_rows(data, counted = None):
+    """The kept rows sorted by location and date, and the number of rows dropped by each rule."""
+    keep, keys, dropped = cleaning_mask(data, counted)
+    rows = np.flatnonzero(keep)
+    # Stable, so rows with the same location and date stay in source order
+    rows = rows[np.argsort(keys[rows], kind = 'stable')]
+    return data.take(rows).reset_index(drop = True), dropped
+
+def clean_data(data):
+    df2, dropped = filter_rows(data)
+    # Add cumsum for hosp_patients and icu_patients
+    for total, daily in CUMULATIVE_COLUMNS.items():
+        df2[total] = df2.groupby('location', sort = False)[daily].cumsum()
+    return df2, dropped
+
+def add_dropped(*counts):
+    """Sum of several rows-dropped-per-rule counts, any of which may be None."""
+    total = {}
+    for dropped in counts:
+        for rule, count in (dropped or {}).items():
+            total[rule] = total.get(rule, 0) + count
+    return total
+
+def get_countries(df2):
+    # Get list of unique countries for reference
+    df3 = expand_frame(df2[['iso_code','location']]).drop_duplicates()
+    return df3.sort_values(['location']).reset_index(drop = True)
+
+########### Compact in-memory layout
+DIMENSION_COLUMNS = ['iso_code','continent','location']
+
+def compact_frame(df2):
+    """Store the dimension columns as categoricals and metrics as float32 wherever that is lossless."""
+    columns = {}
+    for column in df2.columns:
+        values = df2[column]
+        if column in DIMENSION_COLUMNS and values.dtype.name != 'category':
+            values = values.astype('category')
+        elif values.dtype == 'float64':
+            small = values.astype('float32')
+            if np.array_equal(small.to_numpy(dtype = 'float64'), values.to_numpy(), equal_nan = True):
+                values = small
+        columns[column] = values
+    return pd.DataFrame(columns)
+
+def expand_frame(df):
+    """Undo compact_frame, so rows handed out behave exactly like the cleaned CSV data."""
+    dtypes = {}
+    for column in df.columns:
+        if df[column].dtype.name == 'category':
+            dtypes[column] = object
+        elif df[column].dtype == 'float32':
+            dtypes[column] = 'float64'
+    return df.astype(dtypes) if dtypes else df
+
+class Dataset(object):
+    """The cleaned frames of one data snapshot."""
+
+    def __init__(self, df2, metadata, version = None, source = None, dropped = None):
+        df2 = compact_frame(df2.drop(columns = rolling_columns(), errors = 'ignore'))
+        self.df2 = df2
+        self.df3 = get_countries(df2)
+        self.index = LocationIndex(df2)
+        # Derived per snapshot, so they are not stored in it (see rolling.py)
+        for column, values in rolling_averages(df2, self.index).items():
+            df2[column] = values
+        self.cube = AggregationCube(df2, self.index, self.df3)
+        self.daily = DailyTotals(df2, self.index)
+        self.country_options = sorted(df2['location'].unique().tolist())
+        self.continent_options = sorted(df2['continent'].unique().tolist())
+        self.metadata = metadata
+        self.version = version or new_version()
+        self.source = source
+        # Rows of the source dropped by each cleaning rule, see filter_rows
+        self.dropped = dropped
+
+    def select(self, blocks, start_date = None, end_date = None):
+        lo, hi = self.index.bounds(blocks, start_date, end_date)
+        return Selection(self, np.asarray(blocks, dtype = int), lo, hi)
+
+class Selection(object):
+    """Rows of one Dataset picked by location blocks and a date range, kept as row ranges."""
+
+    def __init__(self, dataset, blocks, lo, hi):
+        self.dataset = dataset
+        self.blocks = blocks
+        self.lo = lo
+        self.hi = hi
+        self._frame = None
+        self._aggregates = {}
+
+    def frame(self):
+        """The selected rows of df2; built once and shared, so callers must not modify it."""
+        if self._frame is None:
+            df = self.dataset.df2.take(range_rows(self.lo, self.hi)).reset_index(drop = True)
+            self._frame = expand_frame(df)
+        return self._frame
+
+    def aggregate(self, key, compute):
+        """Memoize an aggregate of this selection under ``key``."""
+        if key not in self._aggregates:
+            self._aggregates[key] = compute()
+        return self._aggregates[key]
+
+    def nbytes(self):
+        size = self.blocks.nbytes + self.lo.nbytes + self.hi.nbytes
+        if self._frame is not None:
+            size += int(self._frame.memory_usage(index = False).sum())
+        for value in list(self._aggregates.values()):
+            if isinstance(value, pd.DataFrame):
+                size += int(value.memory_usage(index = False).sum())
+        return size
+
+def new_version():
+    return datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')
+
+def fetch_dataset(source = DATA_SOURCE, codebook_source = CODEBOOK_SOURCE):
+    data = read_source(source)
+    metadata = read_codebook(codebook_source)
+    df2, dropped = clean_data(data)
+    return Dataset(df2, metadata, source = str(source), dropped = dropped)
+
+########### Snapshot storage
+def _save_frame(df, path, name):
+    columns = []
+    for i, column in enumerate(df.columns):
+        values = df[column]
+        spec = {'name': column, 'file': '{}.{}.npy'.format(name, i)}
+        if values.dtype.name == 'category':
+            spec['categories'] = [str(c) for c in values.cat.categories]
+            spec['categorical'] = True
+            np.save(path.joinpath(spec['file']), values.cat.codes.to_numpy())
+        elif values.dtype == object:
+            # Strings are stored as int32 codes plus a list of categories, -1 marks NaN
+            codes, categories = pd.factorize(values)
+            spec['categories'] = [str(c) for c in categories]
+            np.save(path.joinpath(spec['file']), codes.astype('int32'))
+        else:
+            spec['dtype'] = str(values.dtype)
+            np.save(path.joinpath(spec['file']), values.to_numpy())
+        columns.append(spec)
+    return {'rows': len(df), 'columns': columns}
+
+def _load_frame(path, spec, mmap_mode = None):
+    columns = {}
+    for column in spec['columns']:
+        values = np.load(path.joinpath(column['file']), mmap_mode = mmap_mode)
+        if 'categories' in column:
+            values = pd.Categorical.from_codes(values, column['categories'])
+            if not column.get('categorical'):
+                values = values.astype(object)
+        columns[column['name']] = values
+    return pd.DataFrame(columns, columns = [c['name'] for c in spec['columns']])
+
+def current_version(path = SNAPSHOT_PATH):
+    try:
+        return path.joinpath('CURRENT').read_text().strip() or None
+    except FileNotFoundError:
+        return None
+
+def save_snapshot(dataset, path = SNAPSHOT_PATH):
+    path = pathlib.Path(path)
+    path.mkdir(parents = True, exist_ok = True)
+    tmp = path.joinpath('.tmp-{}'.format(dataset.version))
+    shutil.rmtree(tmp, ignore_errors = True)
+    tmp.mkdir()
+    manifest = {
+        'format': SNAPSHOT_FORMAT,
+        'version': dataset.version,
+        'source': dataset.source,
+        'dropped': dataset.dropped,
+        'created': datetime.datetime.utcnow().isoformat(),
+        'frames': {
+            'df2': _save_frame(dataset.df2.drop(columns = rolling_columns(), errors = 'ignore'), tmp, 'df2'),
+            'metadata': _save_frame(dataset.metadata.astype(object), tmp, 'metadata'),
+        }
+    }
+    tmp.joinpath('manifest.json').write_text(json.dumps(manifest, indent = 1))
+    # Publish the new version with renames so readers never see a partial snapshot
+    target = path.joinpath(dataset.version)
+    shutil.rmtree(target, ignore_errors = True)
+    os.rename(str(tmp), str(target))
+    pointer = path.joinpath('CURRENT.tmp')
+    pointer.write_text(dataset.version)
+    os.replace(str(pointer), str(path.joinpath('CURRENT')))
+    _prune_snapshots(path, dataset.version)
+    return target
+
+def _prune_snapshots(path, keep_version):
+    versions = sorted(p.name for p in path.iterdir() if p.is_dir() and not p.name.startswith('.'))
+    for version in versions[:-KEEP_SNAPSHOTS]:
+        if version != keep_version:
+            shutil.rmtree(path.joinpath(version), ignore_errors = True)
+
+def load_snapshot(path = SNAPSHOT_PATH, version = None, mmap_mode = None):
+    path = pathlib.Path(path)
+    version = version or current_version(path)
+    if version is None:
+        return None
+    snapshot = path.joinpath(version)
+    try:
+        manifest = json.loads(snapshot.joinpath('manifest.json').read_text())
+    except FileNotFoundError:
+        return None
+    if manifest.get('format') != SNAPSHOT_FORMAT:
+        return None
+    frames = manifest['frames']
+    df2 = _load_frame(snapshot, frames['df2'], mmap_mode)
+    metadata = _load_frame(snapshot, frames['metadata'], mmap_mode)
+    return Dataset(df2, metadata, version = manifest['version'], source = manifest.get('source'),
+                   dropped = manifest.get('dropped'))
+
+def load_dataset(refresh = False, source = None, codebook_source = None, path = SNAPSHOT_PATH):
+    """Load the current snapshot, reading the source only if there is none or ``refresh`` is set."""
+    if not refresh:
+        dataset = load_snapshot(path)
+        if dataset is not None:
+            return dataset
+    dataset = fetch_dataset(source or DATA_SOURCE, codebook_source or CODEBOOK_SOURCE)
+    save_snapshot(dataset, path)
+    return dataset
+
+########### Memory report
+def process_rss():
+    """Resident set size of this process in bytes, or None where /proc is not available."""
+    try:
+        with open('/proc/self/statm') as handle:
+            return int(handle.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, AttributeError):
+        return None
+
+def memory_report(dataset):
+    """Bytes held by each column of the dataset frames, its index, cube and daily totals, as (name, bytes) rows."""
+    rows = []
+    for name in ['df2', 'df3', 'metadata']:
+        usage = getattr(dataset, name).memory_usage(index = True, deep = True)
+        rows += [('{}.{}'.format(name, column), int(nbytes)) for column, nbytes in usage.items()]
+    rows.append(('index', int(dataset.index.nbytes())))
+    rows.append(('cube', int(dataset.cube.nbytes())))
+    rows.append(('daily totals', int(dataset.daily.nbytes())))
+    return rows
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Manage the local OWID data snapshot.')
+    parser.add_argument('command', choices = ['refresh', 'info', 'memory', 'clean'])
+    parser.add_argument('--source', default = None, help = 'URL or local path of owid-covid-data.csv')
+    parser.add_argument('--codebook', default = None, help = 'URL or local path of owid-covid-codebook.csv')
+    parser.add_argument('--path', default = str(SNAPSHOT_PATH), help = 'snapshot directory')
+    args = parser.parse_args()
+
+    def print_dropped(dropped):
+        for rule, count in dropped.items():
+            print('  dropped {:<28} {:>10,}'.format(rule, count))
+
+    if args.command == 'clean':
+        # Time parsing and cleaning the source without saving a snapshot
+        import time
+        start = time.perf_counter()
+        data = read_source(args.source or DATA_SOURCE)
+        parsed = time.perf_counter()
+        df2, dropped = clean_data(data)
+        cleaned = time.perf_counter()
+        print('{:,} source rows, {:,} kept: parse {:.3f}s, clean {:.3f}s'.format(
+            len(data), len(df2), parsed - start, cleaned - parsed
+        ))
+        print_dropped(dropped)
+        raise SystemExit(0)
+
+    if args.command == 'refresh':
+        dataset = load_dataset(refresh = True, source = args.source, codebook_source = args.codebook,
+                               path = pathlib.Path(args.path))
+    else:
+        dataset = load_snapshot(pathlib.Path(args.path))
+        if dataset is None:
+            raise SystemExit('No snapshot found in {}'.format(args.path))
+    print('version {}: {} rows, {} locations, dates {} to {} (source: {})'.format(
+        dataset.version, len(dataset.df2), len(dataset.df3),
+        dataset.df2.date.min().date(), dataset.df2.date.max().date(), dataset.source
+    ))
+    if dataset.dropped:
+        print_dropped(dataset.dropped)
+
+    if args.command == 'memory':
+        # Build the whole cube so the report shows what a warmed-up worker holds
+        dataset.cube.warm()
+        rows = memory_report(dataset)
+        for name, nbytes in rows:
+            print('{:<40} {:>12,}'.format(name, nbytes))
+        print('{:<40} {:>12,}'.format('dataset total', sum(nbytes for _, nbytes in rows)))
+        rss = process_rss()
+        if rss is not None:
+            print('{:<40} {:>12,}'.format('process RSS (per worker)', rss))
@@ -0,0 +1,85 @@
+"""Downsampling of the per-country line chart.
+
+Long date ranges over many countries put far more points in the figure than
+the chart has pixels. ``minmax_downsample`` splits every long trace into
+buckets and keeps the lowest and highest point of each bucket plus the first
+and last point of the trace, so peaks survive while the point count is capped.
+All traces are handled together with NumPy, without a loop over countries.
+
+Run ``python downsample.py`` to compare figure payload sizes on the current
+data snapshot.
+"""
+import os
+import numpy as np
+
+# Points kept per trace, about the pixel width of the chart; 0 turns downsampling off
+LINE_MAX_POINTS = int(os.environ.get('LINE_MAX_POINTS', 800))
+# Figures with more points than this are drawn with WebGL (Scattergl)
+WEBGL_THRESHOLD = int(os.environ.get('WEBGL_THRESHOLD', 1000))
+
+def minmax_downsample(df, group, y, max_points = LINE_MAX_POINTS):
+    """Rows of ``df`` (sorted by ``group``) keeping at most about ``max_points`` per group."""
+    n = len(df)
+    buckets = max_points // 2
+    if n == 0 or buckets < 1:
+        return df
+    groups = df[group].to_numpy()
+    starts = np.concatenate([[0], np.flatnonzero(groups[1:] != groups[:-1]) + 1])
+    lengths = np.diff(np.concatenate([starts, [n]]))
+    if lengths.max() <= max_points:
+        return df
+
+    # Group number, group length and position within the group of every row
+    number = np.repeat(np.arange(len(starts)), lengths)
+    length = lengths[number]
+    position = np.arange(n) - starts[number]
+    long_rows = length > max_points
+
+    # Rows of short groups and the ends of every group are always kept
+    keep = [np.flatnonzero(~long_rows), starts, starts + lengths - 1]
+
+    rows = np.flatnonzero(long_rows)
+    if len(rows):
+        # Bucket keys never decrease along the rows, so every bucket is a contiguous segment
+        key = number[rows] * buckets + position[rows] * buckets // length[rows]
+        segments = np.concatenate([[0], np.flatnonzero(key[1:] != key[:-1]) + 1])
+        sizes = np.diff(np.concatenate([segments, [len(key)]]))
+        values = df[y].to_numpy(dtype = float)[rows]
+        # Missing values never win, but an all-missing bucket still keeps its first and last row
+        low = np.where(np.isnan(values), np.inf, values)
+        high = np.where(np.isnan(values), -np.inf, values)
+        at = np.arange(len(key))
+        lowest = np.repeat(np.minimum.reduceat(low, segments), sizes)
+        highest = np.repeat(np.maximum.reduceat(high, segments), sizes)
+        keep += [
+            rows[np.minimum.reduceat(np.where(low == lowest, at, len(key)), segments)],
+            rows[np.maximum.reduceat(np.where(high == highest, at, -1), segments)],
+        ]
+
+    return df.take(np.unique(np.concatenate(keep))).reset_index(drop = True)
+
+def line_render_mode(df):
+    return 'webgl' if len(df) > WEBGL_THRESHOLD else 'svg'
+
+if __name__ == '__main__':
+    import json
+    import argparse
+    import plotly
+    import plotly.express as px
+    from dataset import load_snapshot
+
+    parser = argparse.ArgumentParser(description = 'Report line chart payload sizes with and without downsampling.')
+    parser.add_argument('--max-points', type = int, default = LINE_MAX_POINTS or 800)
+    args = parser.parse_args()
+
+    dataset = load_snapshot()
+    if dataset is None:
+        raise SystemExit('No data snapshot found, run "python dataset.py refresh" first')
+    for column in ['total_cases', 'new_cases']:
+        sizes = []
+        for df in [dataset.df2, minmax_downsample(dataset.df2, 'location', column, args.max_points)]:
+            figure = px.line(df, x = 'date', y = column, color = 'location', render_mode = line_render_mode(df))
+            sizes.append((len(df), len(json.dumps(figure, cls = plotly.utils.PlotlyJSONEncoder))))
+        print('{}: {} points, {:.1f} MB -> {} points, {:.1f} MB'.format(
+            column, sizes[0][0], sizes[0][1] / 1e6, sizes[1][0], sizes[1][1] / 1e6
+        ))
@@ -0,0 +1,139 @@
+"""CSV and Parquet export of a filtered selection.
+
+A selection is a set of row ranges of ``df2`` (see location_index.py), so the
+export walks those ranges ``EXPORT_CHUNK_ROWS`` rows at a time: each chunk is
+taken from ``df2``, expanded like ``Selection.frame`` and written out before
+the next one is read. Neither the whole selection nor its text is held in
+memory, so the peak stays at about one chunk whatever the selection size.
+
+- CSV is streamed as it is written. The concatenated chunks are the same text
+  as ``subset_data(...).to_csv(index = False)``.
+- Parquet needs its footer at the end, so every chunk is written as a row
+  group to a temporary file (on disk once it outgrows ``EXPORT_SPOOL_BYTES``),
+  which is then sent. Parquet needs pyarrow, which is optional.
+
+``python export.py`` measures rows per second and peak memory of both formats
+against building the whole CSV text at once.
+"""
+import os
+import tempfile
+import numpy as np
+from location_index import range_rows
+from dataset import expand_frame
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+EXPORT_CHUNK_ROWS = int(os.environ.get('EXPORT_CHUNK_ROWS', 20000))
+EXPORT_SPOOL_BYTES = int(os.environ.get('EXPORT_SPOOL_BYTES', 16 * 1024 * 1024))
+
+def chunk_ranges(lo, hi, chunk_rows = EXPORT_CHUNK_ROWS):
+    """Split the ranges lo[j]:hi[j] into consecutive pieces of at most ``chunk_rows`` rows each."""
+    lo = np.asarray(lo, dtype = int)
+    hi = np.maximum(np.asarray(hi, dtype = int), lo)
+    j, start = 0, lo[0] if len(lo) else 0
+    while j < len(lo):
+        pieces_lo, pieces_hi, rows = [], [], 0
+        while j < len(lo) and rows < chunk_rows:
+            stop = min(hi[j], start + chunk_rows - rows)
+            if stop > start:
+                pieces_lo.append(start)
+                pieces_hi.append(stop)
+                rows += stop - start
+            if stop >= hi[j]:
+                j += 1
+                start = lo[j] if j < len(lo) else 0
+            else:
+                start = stop
+        if rows:
+            yield np.array(pieces_lo), np.array(pieces_hi)
+
+def frames(selection, chunk_rows = EXPORT_CHUNK_ROWS):
+    """The rows of a selection as frames of at most ``chunk_rows`` rows, like slices of ``selection.frame()``."""
+    df2 = selection.dataset.df2
+    for lo, hi in chunk_ranges(selection.lo, selection.hi, chunk_rows):
+        yield expand_frame(df2.take(range_rows(lo, hi)).reset_index(drop = True))
+
+def empty_frame(selection):
+    return expand_frame(selection.dataset.df2.iloc[:0])
+
+def csv_chunks(selection, chunk_rows = EXPORT_CHUNK_ROWS):
+    """CSV text of a selection as a sequence of UTF-8 chunks, header first."""
+    header = True
+    for df in frames(selection, chunk_rows):
+        yield df.to_csv(index = False, header = header).encode('utf-8')
+        header = False
+    if header:
+        yield empty_frame(selection).to_csv(index = False).encode('utf-8')
+
+def write_parquet(selection, output, chunk_rows = EXPORT_CHUNK_ROWS):
+    """Write a selection to ``output`` (a path or binary file) as Parquet, one row group per chunk."""
+    if pyarrow is None:
+        raise RuntimeError('Parquet export needs pyarrow')
+    # Typed from the columns rather than from a chunk, in which a text column may hold only nulls
+    empty = empty_frame(selection)
+    schema = pyarrow.schema([
+        (column, pyarrow.string() if dtype == object else pyarrow.from_numpy_dtype(dtype))
+        for column, dtype in empty.dtypes.items()
+    ])
+    with pyarrow.parquet.ParquetWriter(output, schema) as writer:
+        for df in frames(selection, chunk_rows):
+            writer.write_table(pyarrow.Table.from_pandas(df, schema = schema, preserve_index = False))
+    return output
+
+def parquet_file(selection, chunk_rows = EXPORT_CHUNK_ROWS):
+    """A temporary binary file holding the Parquet export of a selection, positioned at its start."""
+    output = tempfile.SpooledTemporaryFile(max_size = EXPORT_SPOOL_BYTES)
+    try:
+        write_parquet(selection, output, chunk_rows)
+    except Exception:
+        output.close()
+        raise
+    output.seek(0)
+    return output
+
+if __name__ == '__main__':
+    import io
+    import time
+    import argparse
+    import tracemalloc
+
+    parser = argparse.ArgumentParser(description = 'Measure the export throughput and peak memory on the current snapshot.')
+    parser.add_argument('--chunk-rows', type = int, default = EXPORT_CHUNK_ROWS)
+    args = parser.parse_args()
+
+    os.environ['OWID_REFRESH_INTERVAL'] = '0'
+    from dataset import load_dataset
+    dataset = load_dataset()
+    selection = dataset.select(dataset.index.all())
+    rows = int((selection.hi - selection.lo).sum())
+
+    def whole_csv():
+        df = expand_frame(dataset.df2.take(range_rows(selection.lo, selection.hi)).reset_index(drop = True))
+        return len(df.to_csv(index = False).encode('utf-8'))
+
+    def streamed_csv():
+        return sum(len(chunk) for chunk in csv_chunks(selection, args.chunk_rows))
+
+    def parquet():
+        with parquet_file(selection, args.chunk_rows) as output:
+            output.seek(0, io.SEEK_END)
+            return output.tell()
+
+    runs = [('csv, whole frame', whole_csv), ('csv, streamed', streamed_csv)]
+    if pyarrow is not None:
+        runs.append(('parquet', parquet))
+    print('{} rows, {} per chunk'.format(rows, args.chunk_rows))
+    print('{:<18} {:>12} {:>14} {:>16}'.format('export', 'rows/s', 'bytes', 'peak Python MB'))
+    for name, run in runs:
+        start = time.perf_counter()
+        size = run()
+        seconds = time.perf_counter() - start
+        # Traced in a second run, as tracing slows it down
+        tracemalloc.start()
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print('{:<18} {:>12,.0f} {:>14,} {:>16.1f}'.format(name, rows / seconds, size, peak / 1e6))
@@ -0,0 +1,121 @@
+"""Bounded LRU/TTL cache for callback outputs.
+
+Outputs are stored as serialized JSON, which keeps the entries immutable and
+makes their size known; the cache is bounded by count and by bytes. Figures
+are returned as ``serializer.RawJSON``, so a hit is written into the response
+without parsing and encoding the stored text again. The key is built by a key function from the callback
+arguments, so equivalent filter states share one entry. Concurrent misses on
+the same key are computed once (see single_flight.py).
+"""
+import os
+import json
+import time
+import threading
+import functools
+from collections import OrderedDict
+from single_flight import SingleFlight
+import serializer
+
+CACHE_SIZE = int(os.environ.get('FIGURE_CACHE_SIZE', 256))
+CACHE_BYTES = int(os.environ.get('FIGURE_CACHE_BYTES', 128 * 1024 * 1024))
+CACHE_TTL = float(os.environ.get('FIGURE_CACHE_TTL', 3600))
+
+class FigureCache(object):
+    def __init__(self, maxsize = CACHE_SIZE, ttl = CACHE_TTL, max_bytes = CACHE_BYTES):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.flight = SingleFlight()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                self._bytes -= len(entry[1])
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[1])
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._bytes += len(value)
+            while self._entries and (len(self._entries) > self.maxsize or self._bytes > self.max_bytes):
+                _, (_, evicted) = self._entries.popitem(last = False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+        stats['flight'] = self.flight.stats()
+        return stats
+
+    def cached(self, key, compute, raw = False):
+        """Return the output stored under ``key``, calling ``compute()`` to fill it on a miss.
+
+        With ``raw`` it is returned as ``serializer.RawJSON`` rather than parsed.
+        """
+        return self.cached_json(key, lambda: serializer.dumps(compute()), raw)
+
+    def cached_json(self, key, compute, raw = False):
+        """Like ``cached``, for a ``compute()`` that returns the output already serialized."""
+        value = self.get(key)
+        if value is None:
+            value = self.flight.do(key, lambda: self._fill(key, compute))
+        return serializer.RawJSON(value) if raw else json.loads(value)
+
+    def _fill(self, key, compute):
+        # Another thread may have stored the value between the miss and this call
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry[0] >= time.monotonic():
+            return entry[1]
+        value = compute()
+        self.set(key, value)
+        return value
+
+    def memoize(self, key_function, serialized = False, raw = False):
+        """Cache a callback on ``key_function(*args)``; a key of None skips the cache.
+
+        With ``serialized`` the callback returns its output as JSON text; with ``raw``
+        the output is returned as ``serializer.RawJSON`` (see ``cached``).
+        """
+        def decorator(function):
+            cached = self.cached_json if serialized else self.cached
+            @functools.wraps(function)
+            def wrapper(*args):
+                key = key_function(*args)
+                if key is None:
+                    output = function(*args)
+                    if serialized:
+                        return serializer.RawJSON(output) if raw else json.loads(output)
+                    return output
+                return cached((function.__name__,) + key, lambda: function(*args), raw)
+            return wrapper
+        return decorator
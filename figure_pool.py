@@ -0,0 +1,134 @@
+"""Process pool for building the heavy figures.
+
+Building the per-country line chart with a few hundred traces in Plotly
+Express, and serializing it, is CPU-bound and holds the GIL, so in a threaded
+worker it stalls every other request. With ``FIGURE_POOL_SIZE`` above 0,
+figures for selections of at least ``FIGURE_POOL_MIN_ROWS`` rows are built and
+serialized in a pool of processes; smaller selections are built inline.
+
+The pool processes are forked from the worker by ``start``, after it has
+loaded the data and before it gets busy (app.py calls it on the first
+request), so they share its arrays copy-on-write. Only the row ranges of the
+selection are sent to them, and the figure comes back as the JSON text the
+figure cache stores. After a refresh the processes load the new snapshot from
+disk when they first see its version. Linux only, as it relies on fork.
+
+``python figure_pool.py`` compares the throughput of concurrent line chart
+builds inline and in the pool on the current data snapshot.
+"""
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataset import Selection, load_snapshot, SNAPSHOT_PATH
+import serializer
+import metrics
+
+FIGURE_POOL_SIZE = int(os.environ.get('FIGURE_POOL_SIZE', 0))
+FIGURE_POOL_MIN_ROWS = int(os.environ.get('FIGURE_POOL_MIN_ROWS', 20000))
+
+def serialize(figure):
+    return serializer.dumps(figure)
+
+# The dataset of the pool processes, set just before they are forked
+_dataset = None
+
+def _build(build, version, blocks, lo, hi, args):
+    # Runs in a pool process; None tells the caller to build the figure itself
+    global _dataset
+    if _dataset is None or _dataset.version != version:
+        dataset = load_snapshot(SNAPSHOT_PATH, version)
+        if dataset is None:
+            return None
+        _dataset = dataset
+        serializer.set_dates(dataset)
+    return serialize(build(Selection(_dataset, blocks, lo, hi), *args))
+
+class FigurePool(object):
+    def __init__(self, store, size = FIGURE_POOL_SIZE, min_rows = FIGURE_POOL_MIN_ROWS):
+        self.store = store
+        self.size = size
+        self.min_rows = min_rows
+        self.offloaded = 0
+        self.inline = 0
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Fork the pool processes now, if there is a pool."""
+        global _dataset
+        if self.size <= 0:
+            return
+        with self._lock:
+            if self._executor is not None:
+                return
+            # Imported before forking, so no pool process waits on an import lock held by another thread
+            import plotly.express
+            _dataset = self.store.current()
+            self._executor = ProcessPoolExecutor(self.size, mp_context = multiprocessing.get_context('fork'))
+            list(self._executor.map(abs, range(self.size)))
+
+    def shutdown(self, wait = True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait = wait)
+
+    def build(self, build, selection, *args):
+        """JSON text of ``build(selection, *args)``, built in the pool for large selections."""
+        if self.size > 0 and int((selection.hi - selection.lo).sum()) >= self.min_rows:
+            output = self._offload(build, selection, args)
+            if output is not None:
+                self.offloaded += 1
+                return output
+        self.inline += 1
+        return serialize(build(selection, *args))
+
+    @metrics.timed('pool')
+    def _offload(self, build, selection, args):
+        # The figure is built and serialized in another process, so the callback only waits for it here
+        self.start()
+        future = self._executor.submit(
+            _build, build, selection.dataset.version, selection.blocks, selection.lo, selection.hi, args
+        )
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            # A pool process died, e.g. killed for memory; build inline and fork a new pool next time
+            self.shutdown(wait = False)
+            return None
+
+    def stats(self):
+        return {'size': self.size, 'min_rows': self.min_rows, 'offloaded': self.offloaded, 'inline': self.inline}
+
+if __name__ == '__main__':
+    import time
+    import argparse
+    from concurrent.futures import ThreadPoolExecutor
+
+    parser = argparse.ArgumentParser(description = 'Compare concurrent line chart builds inline and in a process pool.')
+    parser.add_argument('--threads', type = int, default = 8, help = 'concurrent requests')
+    parser.add_argument('--requests', type = int, default = 32)
+    parser.add_argument('--pool-size', type = int, default = os.cpu_count())
+    args = parser.parse_args()
+
+    os.environ['OWID_REFRESH_INTERVAL'] = '0'
+    import app
+    dataset = app.store.current()
+    dates = dataset.daily.dates
+    # Every request has its own end date, so no two build the same figure
+    ends = [str(dates[len(dates) - 1 - i])[:10] for i in range(args.requests)]
+    selections = [app.make_selection('All', None, str(dates[0])[:10], end, dataset) for end in ends]
+    print('{} requests over {} rows each, {} threads, {} CPUs'.format(
+        args.requests, int((selections[0].hi - selections[0].lo).sum()), args.threads, os.cpu_count()
+    ))
+
+    for name, pool in [('inline', FigurePool(app.store, 0)), ('pool', FigurePool(app.store, args.pool_size, 0))]:
+        pool.start()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.threads) as threads:
+            list(threads.map(lambda s: pool.build(app.line_figure, s, 'total', 'cases'), selections))
+        seconds = time.perf_counter() - start
+        print('{:<8} {:>8.2f} s {:>8.2f} requests/s'.format(name, seconds, args.requests / seconds))
+        pool.shutdown()
@@ -0,0 +1,23 @@
+"""Gunicorn settings, loaded automatically by ``gunicorn app:server``.
+
+With ``preload_app`` the master imports app.py once: it loads the data
+snapshot, builds the startup figures and the whole aggregation cube, and then
+forks the workers, which share those pages copy-on-write. The column data are
+a few NumPy blocks that are never written, and ``gc.freeze()`` keeps the
+garbage collector from writing to the objects created at startup, so the
+pages stay shared instead of being copied into every worker.
+
+Set ``GUNICORN_PRELOAD=0`` to have every worker load its own copy instead.
+The number of workers comes from ``WEB_CONCURRENCY`` as usual.
+``python worker_memory.py`` measures the memory per worker in both modes.
+"""
+import os
+import gc
+
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') != '0'
+
+def when_ready(server):
+    if preload_app:
+        import app
+        app.store.current().cube.warm()
+        gc.freeze()
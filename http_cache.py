@@ -0,0 +1,194 @@
+"""ETags and precompressed bodies for the Dash callback responses.
+
+A callback response depends only on the request body and on the data
+snapshot, so ``/_dash-update-component`` responses get the strong ETag
+``"<snapshot version>-<hash of the request body>"``. A request whose
+``If-None-Match`` holds it is answered with 304 before any callback runs.
+Note that browsers do not revalidate the renderer's POST requests by
+themselves; the 304 serves clients and proxies that send the header.
+
+The bodies of successful responses are kept under that ETag, bounded by count
+and bytes, together with their gzip and (if the brotli module is installed)
+brotli encodings, each compressed the first time a client accepts it. Repeat
+views and other tabs with the same filters then get the stored bytes without
+running the callback or compressing again. ``skip`` leaves out a response,
+e.g. a fused one in which an output failed. Flask-Compress leaves responses
+that already have a ``Content-Encoding`` alone. The entries are dropped when a
+new snapshot is swapped in; ``HTTP_CACHE_ENABLED=0`` turns all of it off.
+
+Installed after ``metrics.install``, the lookups, stores and compression are
+timed as the ``cache`` stage of the callback, so hits and 304s are counted
+too, and the payload histogram gets the size before compression.
+"""
+import os
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+import flask
+import metrics
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+HTTP_CACHE_ENABLED = os.environ.get('HTTP_CACHE_ENABLED', '1') != '0'
+HTTP_CACHE_SIZE = int(os.environ.get('HTTP_CACHE_SIZE', 256))
+HTTP_CACHE_BYTES = int(os.environ.get('HTTP_CACHE_BYTES', 128 * 1024 * 1024))
+
+# In order of preference when a client accepts several
+ENCODINGS = (['br'] if brotli is not None else []) + ['gzip']
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality = 5)
+    return gzip.compress(body, compresslevel = 6)
+
+def choose_encoding(accept_encoding):
+    """The preferred encoding among those the Accept-Encoding header allows, or 'identity'."""
+    accepted = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding in ENCODINGS:
+        if accepted.get(encoding, accepted.get('*', 0.0)) > 0:
+            return encoding
+    return 'identity'
+
+class ResponseCache(object):
+    def __init__(self, maxsize = HTTP_CACHE_SIZE, max_bytes = HTTP_CACHE_BYTES):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def _size(self, bodies):
+        return sum(len(body) for body in bodies.values())
+
+    def get(self, etag):
+        """The bodies stored under ``etag`` by encoding, or None."""
+        with self._lock:
+            bodies = self._entries.get(etag)
+            if bodies is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(etag)
+            self.hits += 1
+            return bodies
+
+    def set(self, etag, body):
+        with self._lock:
+            old = self._entries.pop(etag, None)
+            if old is not None:
+                self._bytes -= self._size(old)
+            bodies = self._entries[etag] = {'identity': body}
+            self._bytes += len(body)
+            self._evict()
+            return bodies
+
+    def encoded(self, etag, bodies, encoding):
+        """The body of an entry in ``encoding``, compressed and stored the first time it is asked for."""
+        body = bodies.get(encoding)
+        if body is not None:
+            return body
+        body = compress(bodies['identity'], encoding)
+        with self._lock:
+            # The entry may have been evicted meanwhile; the body is still good for this response
+            if self._entries.get(etag) is bodies and encoding not in bodies:
+                bodies[encoding] = body
+                self._bytes += len(body)
+                self._evict()
+        return body
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.maxsize or self._bytes > self.max_bytes):
+            _, bodies = self._entries.popitem(last = False)
+            self._bytes -= self._size(bodies)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'not_modified': self.not_modified,
+            }
+
+def request_etag(version):
+    return '{}-{}'.format(version, hashlib.sha1(flask.request.get_data(cache = True)).hexdigest()[:20])
+
+def matches(etag):
+    # Tags are compared without their ':<encoding>' suffix, so a tag of any encoding revalidates
+    return etag in set(tag.split(':')[0] for tag in flask.request.if_none_match.as_set(include_weak = True))
+
+def skip():
+    """Leave the response of the current request out of the cache, e.g. when part of it failed."""
+    if flask.has_request_context():
+        flask.g.pop('http_etag', None)
+
+def install(app, store, cache = None):
+    """Serve the callback responses of a Dash app with ETags and from ``cache``."""
+    if not HTTP_CACHE_ENABLED:
+        return None
+    cache = cache if cache is not None else ResponseCache()
+    store.on_swap(lambda dataset: cache.clear())
+    server = app.server
+
+    def label(response, etag, encoding):
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+        response.set_etag(etag if encoding == 'identity' else '{}:{}'.format(etag, encoding))
+        response.vary.add('Accept-Encoding')
+        # Stored, but revalidated before every use
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    @server.before_request
+    @metrics.timed('cache')
+    def serve_cached():
+        if flask.request.method != 'POST' or not flask.request.path.endswith('/_dash-update-component'):
+            return None
+        etag = request_etag(store.current().version)
+        if matches(etag):
+            cache.not_modified += 1
+            flask.g.payload_bytes = 0
+            return label(flask.Response(status = 304), etag, 'identity')
+        bodies = cache.get(etag)
+        if bodies is None:
+            # Computed by the callback and stored on the way out
+            flask.g.http_etag = etag
+            return None
+        encoding = choose_encoding(flask.request.headers.get('Accept-Encoding', ''))
+        flask.g.payload_bytes = len(bodies['identity'])
+        return label(flask.Response(cache.encoded(etag, bodies, encoding), mimetype = 'application/json'), etag, encoding)
+
+    @server.after_request
+    @metrics.timed('cache')
+    def store_response(response):
+        etag = flask.g.pop('http_etag', None)
+        if (etag is None or response.status_code != 200 or response.mimetype != 'application/json'
+                or 'Content-Encoding' in response.headers):
+            return response
+        bodies = cache.set(etag, response.get_data())
+        flask.g.payload_bytes = len(bodies['identity'])
+        encoding = choose_encoding(flask.request.headers.get('Accept-Encoding', ''))
+        response.set_data(cache.encoded(etag, bodies, encoding))
+        return label(response, etag, encoding)
+
+    return cache
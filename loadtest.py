@@ -0,0 +1,410 @@
+"""Load test of the Dash callbacks over HTTP, offline.
+
+Publishes a synthetic snapshot (see synthetic.py), starts ``gunicorn
+app:server`` on it locally and runs a number of simulated users against
+``/_dash-update-component``. Each user loads the page and then repeats random
+interactions: a continent switch, a multi-select of countries, a date range
+drag (start, then end) or a tab flip, weighted by ``--mix``. Like the Dash
+renderer, a user keeps the value of every component, sends the server-side
+callbacks whose inputs changed (after the callbacks that feed them) and
+applies their outputs, so the requests follow the callbacks of whatever
+``CALLBACK_MODE`` the app runs in. Clientside callbacks are skipped, except
+the ones in ``RELAYS``, which only decide whether a server-side callback runs.
+
+For every concurrency given with ``--users`` it reports the throughput, the
+p50/p95/p99 latency per callback and the peak memory of each gunicorn worker
+(Linux only), and ``--output`` writes the numbers as JSON:
+
+    python loadtest.py --users 1 4 16 --duration 30 --workers 2
+    python loadtest.py --users 8 --env CALLBACK_MODE=separate --env FIGURE_POOL_SIZE=2
+    python loadtest.py --url http://127.0.0.1:8050 --users 4
+
+The users run as threads of this process, so on a small machine they compete
+with the server for CPU; compare runs made on the same machine.
+"""
+import os
+import json
+import gzip
+import time
+import random
+import shutil
+import tempfile
+import argparse
+import datetime
+import platform
+import threading
+import urllib.error
+import urllib.request
+import numpy as np
+from worker_memory import start_gunicorn, wait_until_served, children, memory
+from benchmark import git_commit
+
+UPDATE_PATH = '/_dash-update-component'
+INTERACTIONS = ['continent', 'countries', 'dates', 'tabs']
+
+########### HTTP
+class Client(object):
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+
+    def request(self, path, body = None, timeout = 120):
+        """Status, decoded body, seconds and bytes on the wire of one request."""
+        data = None if body is None else json.dumps(body).encode('utf-8')
+        request = urllib.request.Request(self.url + path, data = data, headers = {
+            'Content-Type': 'application/json', 'Accept-Encoding': 'gzip'
+        })
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout = timeout) as response:
+                status, raw, encoding = response.status, response.read(), response.headers.get('Content-Encoding')
+        except urllib.error.HTTPError as error:
+            status, raw, encoding = error.code, error.read(), error.headers.get('Content-Encoding')
+        seconds = time.perf_counter() - start
+        text = gzip.decompress(raw) if encoding == 'gzip' else raw
+        return status, text, seconds, len(raw)
+
+    def get_json(self, path):
+        status, text, _, _ = self.request(path)
+        if status != 200:
+            raise RuntimeError('GET {} returned {}'.format(path, status))
+        return json.loads(text)
+
+########### The app as the renderer sees it
+def walk(layout):
+    """Every component of a layout as (id, props), depth first."""
+    stack = [layout]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(reversed(node))
+        elif isinstance(node, dict) and 'props' in node:
+            props = node['props']
+            if 'id' in props:
+                yield props['id'], props
+            stack.append(props.get('children'))
+
+def output_props(output):
+    # '..a.b...c.d..' for several outputs, 'a.b' for one
+    parts = output[2:-2].split('...') if output.startswith('..') else [output]
+    return [tuple(part.rsplit('.', 1)) for part in parts]
+
+def server_request(payload, start_date, end_date, tab1, tab2, continent, countries):
+    # serverRequest in assets/clientside.js: a selection above CLIENTSIDE_MAX_ROWS is computed on the server
+    if not payload or not payload.get('server'):
+        return None
+    return {
+        'id': '/'.join(str(v) for v in [payload['version'], payload['key'], start_date, end_date, tab1, tab2]),
+        'filters': [continent, countries, start_date, end_date],
+        'tabs': [tab1, tab2],
+    }
+
+# Clientside callbacks run here, by function name; None stands for no update
+RELAYS = {'serverRequest': server_request}
+
+def callback_label(outputs):
+    ids = [component for component, _ in outputs]
+    return ids[0] if len(ids) == 1 else '{}+{}'.format(ids[0], len(ids) - 1)
+
+class AppModel(object):
+    """The server-side callbacks, the initial component values and the choices a user can make."""
+
+    def __init__(self, client, days = None):
+        layout = client.get_json('/_dash-layout')
+        self.props = {}
+        for component, props in walk(layout):
+            for name, value in props.items():
+                if name != 'children' or not isinstance(value, (dict, list)):
+                    self.props[(component, name)] = value
+            if component in ['tabs-1', 'tabs-2']:
+                self.props[(component, 'values')] = [tab['props']['value'] for tab in props['children']]
+        self.callbacks = []
+        for dependency in client.get_json('/_dash-dependencies'):
+            relay = None
+            if dependency.get('clientside_function'):
+                relay = RELAYS.get(dependency['clientside_function']['function_name'])
+                if relay is None:
+                    continue
+            outputs = output_props(dependency['output'])
+            self.callbacks.append({
+                'output': dependency['output'],
+                'outputs': outputs,
+                'label': callback_label(outputs),
+                'inputs': [(i['id'], i['property']) for i in dependency['inputs']],
+                'state': [(s['id'], s['property']) for s in dependency['state']],
+                'multi': dependency['output'].startswith('..'),
+                'initial': not dependency.get('prevent_initial_call'),
+                'relay': relay,
+            })
+        self.continents = [o['value'] for o in self.props[('continent_selector', 'options')]]
+        self.countries = [o['value'] for o in self.props[('select_country', 'options')]]
+        picker = ('date_range_picker', 'min_date_allowed'), ('date_range_picker', 'max_date_allowed')
+        first, last = [np.datetime64(str(self.props[p])[:10]) for p in picker]
+        # The picker allows dates up to today; ``days`` keeps the drags within the data
+        count = int((last - first) / np.timedelta64(1, 'D')) + 1
+        self.days = [str(first + np.timedelta64(i, 'D')) for i in range(min(count, days or count))]
+
+########### Simulated users
+class Stats(object):
+    def __init__(self):
+        self.latencies = {}
+        self.sizes = {}
+        self.errors = {}
+        self.interactions = 0
+        self._lock = threading.Lock()
+
+    def record(self, label, status, seconds, size):
+        with self._lock:
+            if status in (200, 204):
+                self.latencies.setdefault(label, []).append(seconds)
+                self.sizes.setdefault(label, []).append(size)
+            else:
+                self.errors[label] = self.errors.get(label, 0) + 1
+
+    def interaction(self):
+        with self._lock:
+            self.interactions += 1
+
+class User(object):
+    def __init__(self, model, client, stats, rng):
+        self.model = model
+        self.client = client
+        self.stats = stats
+        self.rng = rng
+        self.values = dict(model.props)
+
+    def send(self, callback, changed):
+        if callback['relay'] is not None:
+            value = callback['relay'](*[self.values.get(key) for key in callback['inputs'] + callback['state']])
+            if value is None:
+                return set()
+            self.values[callback['outputs'][0]] = value
+            return set(callback['outputs'])
+        def prop(key):
+            return {'id': key[0], 'property': key[1], 'value': self.values.get(key)}
+        outputs = [{'id': c, 'property': p} for c, p in callback['outputs']]
+        body = {
+            'output': callback['output'],
+            'outputs': outputs if callback['multi'] else outputs[0],
+            'inputs': [prop(key) for key in callback['inputs']],
+            'changedPropIds': ['{}.{}'.format(*key) for key in callback['inputs'] if key in changed],
+        }
+        if callback['state']:
+            body['state'] = [prop(key) for key in callback['state']]
+        status, text, seconds, size = self.client.request(UPDATE_PATH, body)
+        self.stats.record(callback['label'], status, seconds, size)
+        if status != 200:
+            return set()
+        updated = set()
+        for component, props in json.loads(text)['response'].items():
+            for name, value in props.items():
+                self.values[(component, name)] = value
+                updated.add((component, name))
+        return updated
+
+    def settle(self, changed, initial = False):
+        """Send the callbacks triggered by ``changed`` and by their outputs, feeding callbacks first."""
+        queued = {}
+        def trigger(props, initial = False):
+            for number, callback in enumerate(self.model.callbacks):
+                hit = props.intersection(callback['inputs'])
+                if hit and (callback['initial'] or not initial):
+                    queued.setdefault(number, set()).update(hit)
+        trigger(set(changed), initial)
+        while queued:
+            pending = set(o for number in queued for o in self.model.callbacks[number]['outputs'])
+            # Hold back the callbacks with an input still to be set by another queued callback
+            ready = [n for n in queued if not pending.intersection(
+                set(self.model.callbacks[n]['inputs']) - set(self.model.callbacks[n]['outputs']))] or list(queued)
+            for number in sorted(ready):
+                trigger(self.send(self.model.callbacks[number], queued.pop(number)))
+
+    def load(self):
+        self.settle(set(key for c in self.model.callbacks for key in c['inputs']), initial = True)
+
+    def set(self, component, name, value):
+        self.values[(component, name)] = value
+        self.settle([(component, name)])
+
+    def interact(self, kind):
+        model, rng = self.model, self.rng
+        if kind == 'continent':
+            self.set('continent_selector', 'value', rng.choice(model.continents))
+        elif kind == 'countries':
+            self.set('select_country', 'value', rng.sample(model.countries, min(rng.randint(1, 8), len(model.countries))))
+        elif kind == 'dates':
+            first, last = sorted(rng.sample(range(len(model.days)), 2))
+            self.set('date_range_picker', 'start_date', model.days[first])
+            self.set('date_range_picker', 'end_date', model.days[last])
+        else:
+            tabs = rng.choice(['tabs-1', 'tabs-2'])
+            self.set(tabs, 'value', rng.choice(model.props[(tabs, 'values')]))
+        self.stats.interaction()
+
+def run_users(model, url, users, duration, mix, think, seed):
+    stats = Stats()
+    deadline = time.time() + duration
+    kinds, weights = zip(*mix.items())
+
+    def session(number):
+        rng = random.Random(seed * 1000 + number)
+        user = User(model, Client(url), stats, rng)
+        user.load()
+        while time.time() < deadline:
+            user.interact(rng.choices(kinds, weights)[0])
+            if think > 0:
+                time.sleep(rng.expovariate(1 / think))
+
+    threads = [threading.Thread(target = session, args = (n,), daemon = True) for n in range(users)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return stats, time.time() - start
+
+########### Server and memory
+def start_server(workers, threads, env, timeout):
+    master, url = start_gunicorn(env, workers, '--threads', str(threads), '--timeout', '300')
+    wait_until_served(master, url + '/_dash-layout', timeout, interval = 0.2)
+    return master, url
+
+class MemorySampler(threading.Thread):
+    """Peak RSS and PSS of every worker of a gunicorn master, sampled every ``interval`` seconds."""
+
+    def __init__(self, master_pid, interval = 0.5):
+        super(MemorySampler, self).__init__(name = 'memory-sampler', daemon = True)
+        self.master_pid = master_pid
+        self.interval = interval
+        self.peaks = {}
+        self.stopped = threading.Event()
+
+    def sample(self):
+        for pid in children(self.master_pid):
+            try:
+                rss, pss, _ = memory(pid)
+            except (IOError, OSError):
+                continue
+            peak = self.peaks.setdefault(pid, [0, 0])
+            peak[0], peak[1] = max(peak[0], rss), max(peak[1], pss)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.sample()
+        return [{'pid': pid, 'rss_mb': round(rss / 1024, 1), 'pss_mb': round(pss / 1024, 1)}
+                for pid, (rss, pss) in sorted(self.peaks.items())]
+
+########### Report
+def summarize(stats, seconds):
+    callbacks = {}
+    for label in sorted(set(stats.latencies) | set(stats.errors)):
+        latencies = np.array(stats.latencies.get(label, [])) * 1000
+        summary = {'requests': len(latencies), 'errors': stats.errors.get(label, 0)}
+        if len(latencies):
+            summary.update({
+                'p50_ms': round(float(np.percentile(latencies, 50)), 1),
+                'p95_ms': round(float(np.percentile(latencies, 95)), 1),
+                'p99_ms': round(float(np.percentile(latencies, 99)), 1),
+                'max_ms': round(float(latencies.max()), 1),
+                'mean_kb': round(float(np.mean(stats.sizes[label])) / 1024, 1),
+            })
+        callbacks[label] = summary
+    requests = sum(c['requests'] + c['errors'] for c in callbacks.values())
+    return {
+        'seconds': round(seconds, 2),
+        'interactions': stats.interactions,
+        'requests': requests,
+        'interactions_per_s': round(stats.interactions / seconds, 2),
+        'requests_per_s': round(requests / seconds, 2),
+        'callbacks': callbacks,
+    }
+
+def print_run(users, result):
+    print('\n{} users: {} interactions ({:.2f}/s), {} requests ({:.2f}/s) in {:.1f}s'.format(
+        users, result['interactions'], result['interactions_per_s'], result['requests'],
+        result['requests_per_s'], result['seconds']
+    ))
+    print('  {:<22} {:>8} {:>7} {:>9} {:>9} {:>9} {:>9} {:>9}'.format(
+        'callback', 'requests', 'errors', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms', 'mean kB'))
+    for label, c in result['callbacks'].items():
+        if c['requests']:
+            print('  {:<22} {:>8} {:>7} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f}'.format(
+                label, c['requests'], c['errors'], c['p50_ms'], c['p95_ms'], c['p99_ms'], c['max_ms'], c['mean_kb']))
+        else:
+            print('  {:<22} {:>8} {:>7}'.format(label, 0, c['errors']))
+    for worker in result.get('memory', []):
+        print('  worker {:<8} peak RSS {:>8.1f} MB, peak PSS {:>8.1f} MB'.format(worker['pid'], worker['rss_mb'], worker['pss_mb']))
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name not in INTERACTIONS:
+            raise argparse.ArgumentTypeError('unknown interaction {!r}, expected one of {}'.format(name, INTERACTIONS))
+        mix[name] = float(weight or 1)
+    return mix
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Load test the Dash callbacks of a local server on synthetic data.')
+    parser.add_argument('--users', type = int, nargs = '+', default = [1, 4, 16], help = 'concurrent users, one run each')
+    parser.add_argument('--duration', type = float, default = 30, help = 'seconds per run')
+    parser.add_argument('--think', type = float, default = 0, help = 'mean pause between interactions in seconds')
+    parser.add_argument('--mix', type = parse_mix, default = parse_mix('continent=1,countries=2,dates=3,tabs=4'))
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--url', default = None, help = 'test a running server instead of starting one')
+    parser.add_argument('--workers', type = int, default = 1)
+    parser.add_argument('--threads', type = int, default = 4)
+    parser.add_argument('--env', action = 'append', default = [], help = 'NAME=VALUE for the server, e.g. CALLBACK_MODE=separate')
+    parser.add_argument('--locations', type = int, default = 200)
+    parser.add_argument('--days', type = int, default = 600)
+    parser.add_argument('--null-density', type = float, default = 0.2)
+    parser.add_argument('--timeout', type = float, default = 300, help = 'seconds to wait for gunicorn to start')
+    parser.add_argument('--output', default = None, help = 'write the results to this JSON file')
+    args = parser.parse_args()
+
+    snapshot = master = None
+    if args.url:
+        url = args.url
+    else:
+        # Publish the synthetic snapshot and point the server at it, so nothing is downloaded
+        import synthetic
+        snapshot = tempfile.mkdtemp(prefix = 'owid-loadtest-')
+        synthetic.install(snapshot, locations = args.locations, days = args.days,
+                          null_density = args.null_density, seed = args.seed)
+        env = dict(os.environ, OWID_SNAPSHOT_PATH = snapshot, OWID_REFRESH_INTERVAL = '0')
+        env.update(setting.split('=', 1) for setting in args.env)
+        master, url = start_server(args.workers, args.threads, env, args.timeout)
+    try:
+        model = AppModel(Client(url), days = None if args.url else args.days)
+        print('{} server callbacks: {}'.format(len(model.callbacks), ', '.join(c['label'] for c in model.callbacks)))
+        runs = []
+        for users in args.users:
+            sampler = MemorySampler(master.pid) if master is not None else None
+            if sampler is not None:
+                sampler.start()
+            stats, seconds = run_users(model, url, users, args.duration, args.mix, args.think, args.seed)
+            result = summarize(stats, seconds)
+            result['users'] = users
+            if sampler is not None:
+                result['memory'] = sampler.stop()
+            print_run(users, result)
+            runs.append(result)
+    finally:
+        if master is not None:
+            master.terminate()
+            master.wait()
+        if snapshot is not None:
+            shutil.rmtree(snapshot, ignore_errors = True)
+    if args.output:
+        meta = {'commit': git_commit(), 'created': datetime.datetime.utcnow().isoformat(),
+                'python': platform.python_version(), 'url': args.url,
+                'workers': args.workers, 'threads': args.threads, 'env': args.env,
+                'locations': args.locations, 'days': args.days, 'duration': args.duration,
+                'think': args.think, 'mix': args.mix, 'seed': args.seed}
+        with open(args.output, 'w') as handle:
+            json.dump({'meta': meta, 'runs': runs}, handle, indent = 1)
+        print('wrote {} runs to {}'.format(len(runs), args.output))
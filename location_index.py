@@ -0,0 +1,69 @@
+"""Row-range index over ``df2``.
+
+``df2`` is sorted by location and date, so the rows of every location form one
+contiguous block with ascending dates. A selection of locations and a date
+range is then a binary search inside each block, and the selected rows come
+out already in (location, date) order.
+"""
+import numpy as np
+
+class LocationIndex(object):
+    def __init__(self, df2):
+        location = df2['location']
+        # Compare category codes rather than strings when the column is categorical
+        keys = location.cat.codes.to_numpy() if location.dtype.name == 'category' else location.to_numpy()
+        # Block boundaries are where the location changes
+        if len(keys):
+            boundaries = np.flatnonzero(keys[1:] != keys[:-1]) + 1
+            self.starts = np.concatenate([[0], boundaries])
+            self.stops = np.concatenate([boundaries, [len(keys)]])
+        else:
+            self.starts = self.stops = np.zeros(0, dtype = int)
+        self.locations = np.asarray(location.iloc[self.starts], dtype = object)
+        self.positions = {location: i for i, location in enumerate(self.locations)}
+        self.dates = df2['date'].to_numpy()
+
+        # Continent of each location, taken from its first row
+        self.block_continents = np.asarray(df2['continent'].iloc[self.starts], dtype = object)
+        self.continents = {}
+        for i, continent in enumerate(self.block_continents):
+            self.continents.setdefault(continent, []).append(i)
+
+    def nbytes(self):
+        arrays = [self.starts, self.stops, self.locations, self.dates, self.block_continents]
+        return sum(a.nbytes for a in arrays)
+
+    def lookup(self, locations):
+        """Block numbers of the given location names in df2 order; unknown names are skipped."""
+        return sorted(set(self.positions[l] for l in locations if l in self.positions))
+
+    def continent(self, continent):
+        return self.continents.get(continent, [])
+
+    def all(self):
+        return range(len(self.locations))
+
+    def bounds(self, blocks, start_date = None, end_date = None):
+        """First and past-the-end row of each block within [start_date, end_date]."""
+        blocks = np.asarray(blocks, dtype = int)
+        lo = self.starts[blocks].copy()
+        hi = self.stops[blocks].copy()
+        start = None if start_date is None else np.datetime64(start_date, 'ns')
+        end = None if end_date is None else np.datetime64(end_date, 'ns')
+        for j in range(len(blocks)):
+            dates = self.dates[lo[j]:hi[j]]
+            first = lo[j]
+            if start is not None:
+                lo[j] = first + dates.searchsorted(start, 'left')
+            if end is not None:
+                hi[j] = first + dates.searchsorted(end, 'right')
+        return lo, np.maximum(hi, lo)
+
+def range_rows(lo, hi):
+    """Positional row numbers covered by the ranges lo[j]:hi[j], in order."""
+    lengths = np.maximum(hi - lo, 0)
+    if lengths.sum() == 0:
+        return np.zeros(0, dtype = int)
+    # Concatenate the ranges without a Python loop
+    offsets = np.repeat(lo - np.cumsum(lengths) + lengths, lengths)
+    return offsets + np.arange(lengths.sum())
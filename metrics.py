@@ -0,0 +1,192 @@
+"""Latency and payload histograms of the Dash callbacks, served at ``/metrics``.
+
+Each ``/_dash-update-component`` request is timed per callback and per stage.
+The stages are:
+
+- ``filter``: looking up or building the selection.
+- ``aggregate``: the get_total / get_new / get_average calls.
+- ``figure``: building the cards and figures, not counting the aggregates
+  they ask for.
+- ``pool``: waiting for a figure built and serialized in the process pool
+  (see figure_pool.py).
+- ``cache``: looking up, storing and compressing responses in the HTTP cache
+  (see http_cache.py); this is where the time of a response served from it goes.
+- ``serialize``: the rest of the request, which is mostly Dash encoding the
+  response as JSON.
+
+The size of the response body before compression is recorded as well; a
+handler that compresses it sets ``flask.g.payload_bytes`` first. Stages
+are marked with the ``timed`` decorator; nested stages are exclusive, so
+every millisecond is counted once.
+
+A callback that serves several outputs at once (``update_dashboard`` in the
+default fused mode) also times each output on its own with ``timed_output``,
+cache lookups and nested stages included, and records the size of its JSON.
+
+The histograms are kept per process in the Prometheus text format, so with
+several gunicorn workers each scrape sees the worker that answered it. Set
+``METRICS_ENABLED=0`` to turn all of it off; the decorators then return the
+functions unchanged.
+"""
+import os
+import time
+import bisect
+import threading
+import functools
+import flask
+import serializer
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') != '0'
+
+LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+PAYLOAD_BUCKETS = [1000, 10000, 30000, 100000, 300000, 1000000, 3000000, 10000000, 30000000]
+
+class Histogram(object):
+    def __init__(self, name, documentation, labelnames, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # One count per bucket plus +Inf, then the sum
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bisect.bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [
+            '# HELP {} {}'.format(self.name, self.documentation),
+            '# TYPE {} histogram'.format(self.name),
+        ]
+        with self._lock:
+            series = sorted((labels, list(values)) for labels, values in self._series.items())
+        for labels, values in series:
+            names = ','.join('{}="{}"'.format(n, v) for n, v in zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ['+Inf'], values[:-1]):
+                cumulative += count
+                lines.append('{}_bucket{{{},le="{}"}} {}'.format(self.name, names, bound, cumulative))
+            lines.append('{}_sum{{{}}} {}'.format(self.name, names, values[-1]))
+            lines.append('{}_count{{{}}} {}'.format(self.name, names, cumulative))
+        return '\n'.join(lines)
+
+callback_seconds = Histogram(
+    'dash_callback_duration_seconds', 'Time spent in each stage of a Dash callback request.',
+    ['callback', 'stage'], LATENCY_BUCKETS
+)
+callback_payload = Histogram(
+    'dash_callback_payload_bytes', 'Size of the Dash callback response before compression.',
+    ['callback'], PAYLOAD_BUCKETS
+)
+
+callback_output_seconds = Histogram(
+    'dash_callback_output_duration_seconds', 'Time spent on each output of a callback that serves several.',
+    ['callback', 'output'], LATENCY_BUCKETS
+)
+callback_output_payload = Histogram(
+    'dash_callback_output_payload_bytes', 'Size of each output of a callback that serves several, as JSON.',
+    ['callback', 'output'], PAYLOAD_BUCKETS
+)
+
+def json_size(value):
+    if isinstance(value, serializer.RawJSON):
+        return len(value.text)
+    return len(serializer.dumps(value))
+
+def timed_output(output, compute):
+    """Return ``compute()``, counting its time and JSON size as ``output`` of the current callback."""
+    timer = flask.g.get('metrics') if METRICS_ENABLED and flask.has_request_context() else None
+    if timer is None:
+        return compute()
+    start = time.perf_counter()
+    value = compute()
+    timer.outputs.append((output, time.perf_counter() - start, json_size(value)))
+    return value
+
+def timed(stage):
+    """Count the time spent in the decorated function towards ``stage`` of the current callback."""
+    def decorator(function):
+        if not METRICS_ENABLED:
+            return function
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            timer = flask.g.get('metrics') if flask.has_request_context() else None
+            if timer is None:
+                return function(*args, **kwargs)
+            timer.enter(stage)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                timer.exit()
+        return wrapper
+    return decorator
+
+class StageTimer(object):
+    """Exclusive time per stage of one request; an inner stage pauses the one around it."""
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.outputs = []
+        self._stack = []
+        self._since = None
+
+    def enter(self, stage):
+        now = time.perf_counter()
+        if self._stack:
+            self._add(self._stack[-1], now)
+        self._stack.append(stage)
+        self._since = now
+
+    def exit(self):
+        now = time.perf_counter()
+        self._add(self._stack.pop(), now)
+        self._since = now
+
+    def _add(self, stage, now):
+        self.stages[stage] = self.stages.get(stage, 0.0) + now - self._since
+
+def install(app):
+    """Time the callback requests of a Dash app and serve the histograms at /metrics."""
+    if not METRICS_ENABLED:
+        return
+    server = app.server
+
+    @server.before_request
+    def start_timer():
+        if flask.request.path.endswith('/_dash-update-component'):
+            body = flask.request.get_json(silent = True) or {}
+            entry = app.callback_map.get(body.get('output'))
+            if entry is not None:
+                flask.g.metrics = StageTimer(entry['callback'].__name__)
+
+    @server.after_request
+    def record(response):
+        timer = flask.g.pop('metrics', None)
+        if timer is not None:
+            total = time.perf_counter() - timer.start
+            for stage, seconds in timer.stages.items():
+                callback_seconds.observe(seconds, timer.callback, stage)
+            callback_seconds.observe(max(total - sum(timer.stages.values()), 0.0), timer.callback, 'serialize')
+            callback_seconds.observe(total, timer.callback, 'total')
+            for output, seconds, size in timer.outputs:
+                callback_output_seconds.observe(seconds, timer.callback, output)
+                callback_output_payload.observe(size, timer.callback, output)
+            size = flask.g.pop('payload_bytes', None)
+            if size is None:
+                size = response.calculate_content_length() or 0
+            callback_payload.observe(size, timer.callback)
+        return response
+
+    @server.route('/metrics')
+    def metrics():
+        histograms = [callback_seconds, callback_payload, callback_output_seconds, callback_output_payload]
+        text = '\n'.join(histogram.render() for histogram in histograms) + '\n'
+        return flask.Response(text, mimetype = 'text/plain; version=0.0.4')
@@ -0,0 +1,189 @@
+"""Incremental background refresh of the dashboard data.
+
+Callbacks read the data through a ``DataStore``. A ``RefreshScheduler`` thread
+periodically asks its source for the rows dated after the last snapshot, cleans
+and appends them, saves a new snapshot and swaps it into the store. Each
+callback takes one reference to the current ``Dataset`` and keeps using it, so
+a swap never changes the data under a running callback.
+
+When several gunicorn workers run a scheduler, only the one holding the
+refresh lock reads the source; the others pick up the new snapshot from disk.
+"""
+import os
+import pathlib
+import logging
+import threading
+import pandas as pd
+from dataset import (Dataset, DATA_SOURCE, CUMULATIVE_COLUMNS, SNAPSHOT_PATH, filter_rows, add_dropped,
+                     read_source, current_version, load_snapshot, save_snapshot)
+from rolling import rolling_columns
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Seconds between refreshes, 0 disables the scheduler
+REFRESH_INTERVAL = float(os.environ.get('OWID_REFRESH_INTERVAL', 0))
+
+class DataStore(object):
+    """Holds the current dataset; replacing it is a single reference swap."""
+
+    def __init__(self, dataset):
+        self._dataset = dataset
+        self._listeners = []
+
+    def current(self):
+        return self._dataset
+
+    def swap(self, dataset):
+        self._dataset = dataset
+        for listener in self._listeners:
+            listener(dataset)
+
+    def on_swap(self, listener):
+        self._listeners.append(listener)
+
+########### Sources
+def last_dates(df2):
+    return df2.groupby('location', observed = True)['date'].max()
+
+def select_new_rows(data, known_dates):
+    # Keep rows dated after the last known date of their location, and all rows of new locations
+    last = data['location'].map(known_dates)
+    return data[last.isna() | (data['date'] > last)]
+
+class CsvSource(object):
+    """The OWID CSV, read in chunks so only the new rows are kept in memory."""
+
+    def __init__(self, source = DATA_SOURCE, chunksize = 100000):
+        self.source = source
+        self.chunksize = chunksize
+
+    def read(self):
+        return read_source(self.source)
+
+    def read_since(self, known_dates):
+        chunks = read_source(self.source, chunksize = self.chunksize)
+        return pd.concat([select_new_rows(chunk, known_dates) for chunk in chunks], ignore_index = True)
+
+class LocalSource(object):
+    """Offline stand-in for the OWID source.
+
+    Serves a local raw frame (or CSV path) up to a cut-off date; ``advance``
+    moves the cut-off forward to simulate newly published days.
+    """
+
+    def __init__(self, data, until = None):
+        if not isinstance(data, pd.DataFrame):
+            data = read_source(data)
+        self.data = data
+        self.until = pd.Timestamp(until) if until is not None else data['date'].max()
+
+    def advance(self, days = 1):
+        self.until = self.until + pd.Timedelta(days = days)
+
+    def read(self):
+        return self.data[self.data['date'] <= self.until].reset_index(drop = True)
+
+    def read_since(self, known_dates):
+        return select_new_rows(self.read(), known_dates).reset_index(drop = True)
+
+########### Incremental update
+def extend_cumulative(df2, new):
+    # Continue each running total from the last known value of its location
+    for total, daily in CUMULATIVE_COLUMNS.items():
+        base = df2.groupby('location', observed = True)[total].last().reindex(new['location'].unique()).fillna(0)
+        seed = pd.DataFrame({'location': base.index, daily: base.values})
+        combined = pd.concat([seed, new[['location', daily]]], ignore_index = True)
+        new[total] = combined.groupby('location')[daily].cumsum().iloc[len(seed):].values
+    return new
+
+def append_rows(dataset, raw):
+    """Return a new Dataset with the cleaned ``raw`` rows appended, or None if nothing is new."""
+    new = select_new_rows(raw, last_dates(dataset.df2))
+    # Rows dated up to the last snapshot were counted by an earlier clean, even if they are read again
+    new, dropped = filter_rows(new, counted = (new['date'] > dataset.df2['date'].max()).to_numpy())
+    if len(new) == 0:
+        return None
+    new = extend_cumulative(dataset.df2, new)
+    # The rolling averages are derived again by the new Dataset
+    base = dataset.df2.drop(columns = rolling_columns(), errors = 'ignore')
+    df2 = pd.concat([base, new[base.columns]], ignore_index = True)
+    df2 = df2.sort_values(['location','date'], kind = 'mergesort').reset_index(drop = True)
+    return Dataset(df2, dataset.metadata, source = dataset.source, dropped = add_dropped(dataset.dropped, dropped))
+
+class RefreshScheduler(threading.Thread):
+    def __init__(self, store, source = None, interval = REFRESH_INTERVAL, path = SNAPSHOT_PATH):
+        super(RefreshScheduler, self).__init__(name = 'owid-refresh', daemon = True)
+        self.store = store
+        self.source = source or CsvSource()
+        self.interval = interval
+        self.path = pathlib.Path(path)
+        self.stopped = threading.Event()
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception('Data refresh failed, keeping version %s', self.store.current().version)
+
+    def refresh(self):
+        """Bring the store up to date; returns True if a new dataset was swapped in."""
+        if self.load_published():
+            return True
+        with RefreshLock(self.path) as acquired:
+            if not acquired:
+                return False
+            # Another process may have published between the check above and taking the lock
+            if self.load_published():
+                return True
+            dataset = append_rows(self.store.current(), self.source.read_since(last_dates(self.store.current().df2)))
+            if dataset is None:
+                return False
+            save_snapshot(dataset, self.path)
+            self.store.swap(dataset)
+            logger.info('Refreshed data to version %s (%d rows)', dataset.version, len(dataset.df2))
+            return True
+
+    def load_published(self):
+        version = current_version(self.path)
+        if version is None or version == self.store.current().version:
+            return False
+        dataset = load_snapshot(self.path, version)
+        if dataset is None:
+            return False
+        self.store.swap(dataset)
+        return True
+
+class RefreshLock(object):
+    """Non-blocking inter-process lock on the snapshot directory."""
+
+    def __init__(self, path):
+        self.path = path
+        self.handle = None
+
+    def __enter__(self):
+        if fcntl is None:
+            return True
+        self.path.mkdir(parents = True, exist_ok = True)
+        self.handle = open(str(self.path.joinpath('.refresh.lock')), 'w')
+        try:
+            fcntl.flock(self.handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self.handle.close()
+            self.handle = None
+            return False
+        return True
+
+    def __exit__(self, *exc):
+        if self.handle is not None:
+            fcntl.flock(self.handle, fcntl.LOCK_UN)
+            self.handle.close()
+            self.handle = None
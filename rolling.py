@@ -0,0 +1,62 @@
+"""Rolling averages of the daily columns, per location.
+
+For every row of ``df2`` the average of a daily column over the location's
+rows dated within the window ending on that row's date: the 7-day average of
+a row dated the 10th covers the 4th to the 10th. Windows count calendar days,
+so a location that skips days averages fewer rows rather than reaching further
+back, and missing values are left out of the average. A row whose window holds
+no value gets NaN. That is ``groupby('location').rolling('7D', on = 'date')
+.mean()`` in pandas.
+
+The averages are computed once per Dataset as extra columns of ``df2``, with
+one vectorized pass per row offset inside the window over the contiguous
+location blocks (see location_index.py), so no figure computes them.
+"""
+import numpy as np
+
+# tabs-1 value -> window in days
+ROLLING_WINDOWS = {'avg7': 7, 'avg14': 14}
+ROLLING_COLUMNS = ['new_cases', 'new_deaths', 'new_tests', 'hosp_patients']
+
+def rolling_column(column, mode):
+    return '{}_{}'.format(column, mode)
+
+def rolling_columns():
+    return [rolling_column(c, m) for c in ROLLING_COLUMNS for m in ROLLING_WINDOWS]
+
+def window_starts(days, starts, stops, window):
+    """First row of each row's window, i.e. of its location's rows dated less than ``window`` days before it."""
+    block = np.repeat(np.arange(len(starts)), stops - starts)
+    # Rows are sorted by (block, day), so one search over the combined key finds every window start
+    span = int(days.max() - days.min()) + window + 1 if len(days) else 1
+    keys = block.astype('int64') * span + (days - (days.min() if len(days) else 0))
+    return np.searchsorted(keys, keys - window + 1, 'left')
+
+def rolling_mean(values, days, starts, stops, window):
+    """Average of the known values in each row's window of ``window`` days, NaN where there are none."""
+    values = np.asarray(values, dtype = float)
+    first = window_starts(days, starts, stops, window)
+    known = ~np.isnan(values)
+    filled = np.where(known, values, 0.0)
+    rows = np.arange(len(values))
+    sums = np.zeros(len(values))
+    counts = np.zeros(len(values), dtype = int)
+    # Add the row itself, then the one before it, and so on while it is inside the window
+    for lag in range(int((rows - first).max()) + 1 if len(values) else 0):
+        inside = rows - lag >= first
+        sums += np.where(inside, filled[rows - lag * inside], 0.0)
+        counts += inside & known[rows - lag * inside]
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+def rolling_averages(df2, index):
+    """The rolling average columns of ``df2`` by name, for the daily columns it has."""
+    days = (df2['date'].to_numpy().astype('datetime64[D]')).astype('int64')
+    output = {}
+    for column in ROLLING_COLUMNS:
+        if column not in df2.columns:
+            continue
+        values = df2[column].to_numpy(dtype = float)
+        for mode, window in ROLLING_WINDOWS.items():
+            output[rolling_column(column, mode)] = rolling_mean(values, days, index.starts, index.stops, window)
+    return output
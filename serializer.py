@@ -0,0 +1,230 @@
+"""Fast JSON encoding of figures and callback responses.
+
+Plotly's encoder walks every value in Python: NumPy arrays become lists
+through ``tolist``, every date is formatted on its own, and whenever the text
+contains ``NaN`` it is parsed and written a second time to turn NaN into null.
+``dumps`` gives the same JSON (compared as parsed values) faster:
+
+- With orjson installed, the figure is encoded by orjson. NaN and infinity
+  become null as with Plotly's encoder.
+- Without it, the standard library encoder is used, with NumPy arrays
+  converted in one step and NaN replaced by null there, so the second pass
+  is only needed for NaN outside of arrays.
+
+Arrays of dates, which is how Plotly Express holds the x values of the line
+chart, are looked up in the ISO strings of the current snapshot's dates
+(``set_dates``), which are formatted once per snapshot rather than per figure.
+Output that is already JSON text, such as a figure from the figure cache, is
+passed as ``RawJSON`` and written as it is, without parsing it again.
+Anything the fast path cannot encode goes through Plotly's encoder, so the
+output never changes. ``install(app)`` makes Dash encode the callback
+responses with ``dumps``. Set ``JSON_SERIALIZER=plotly`` to use Plotly's
+encoder everywhere, as before.
+
+``python serializer.py`` compares both encoders on the line, map and bar
+figures of the current snapshot and checks that they encode the same values.
+"""
+import os
+import re
+import json
+import decimal
+import datetime
+import functools
+import collections
+import numpy as np
+import pandas as pd
+import plotly
+from dash import _validate
+from dash.dash import _NoUpdate
+from dash._utils import stringify_id
+from dash.exceptions import PreventUpdate
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_SERIALIZER = os.environ.get('JSON_SERIALIZER', 'fast')
+
+class RawJSON(object):
+    """JSON text that ``dumps`` writes as it is; other encoders parse it."""
+
+    def __init__(self, text):
+        self.text = text
+
+    def to_plotly_json(self):
+        return json.loads(self.text)
+
+# Stands in for RawJSON values while the rest is encoded
+_RAW_MARK = '__raw_json_{}_'.format(os.urandom(8).hex())
+_RAW_PATTERN = re.compile('"{}(\\d+)"'.format(_RAW_MARK))
+
+def _raw_placeholder(raw, value):
+    raw.append(value.text)
+    return '{}{}'.format(_RAW_MARK, len(raw) - 1)
+
+def _embed_raw(text, raw):
+    if not raw:
+        return text
+    return _RAW_PATTERN.sub(lambda match: raw[int(match.group(1))], text)
+
+def plotly_dumps(obj):
+    return json.dumps(obj, cls = plotly.utils.PlotlyJSONEncoder)
+
+########### ISO strings of the snapshot dates
+_dates = None
+
+class DateStrings(object):
+    def __init__(self, dates):
+        self.dates = np.unique(np.asarray(dates, dtype = 'datetime64[us]'))
+        # Formatted like datetime.isoformat(), which is what Plotly's encoder calls
+        self.strings = np.array([d.isoformat() for d in pd.DatetimeIndex(self.dates).to_pydatetime()], dtype = object)
+
+    def lookup(self, values):
+        """ISO strings of an object array of naive datetimes, or None if some are not snapshot dates."""
+        try:
+            keys = values.astype('datetime64[us]')
+        except (TypeError, ValueError):
+            return None
+        positions = np.minimum(np.searchsorted(self.dates, keys), len(self.dates) - 1)
+        if len(self.dates) == 0 or not (self.dates[positions] == keys).all():
+            return None
+        return self.strings[positions].tolist()
+
+def set_dates(dataset):
+    """Format the dates of a dataset once, for every figure built from it."""
+    global _dates
+    _dates = DateStrings(dataset.daily.dates)
+
+def _datetimes(values):
+    # Only naive datetimes can be compared through datetime64
+    first = values[0]
+    return type(first) is datetime.datetime and first.tzinfo is None
+
+def array_values(values):
+    """A NumPy array as a list, with dates as ISO strings and NaN as None."""
+    if values.dtype.kind == 'O' and len(values) and _dates is not None and _datetimes(values):
+        strings = _dates.lookup(values)
+        if strings is not None:
+            return strings
+    if values.dtype.kind == 'f' and values.ndim == 1:
+        finite = np.isfinite(values)
+        if not finite.all():
+            return np.where(finite, values, None).tolist()
+    return values.tolist()
+
+########### Encoders
+def _default(obj):
+    # The conversions of Plotly's encoder, in its order, for the values orjson does not know
+    if isinstance(obj, np.ndarray):
+        return array_values(obj)
+    if hasattr(obj, 'to_plotly_json'):
+        return obj.to_plotly_json()
+    if obj is pd.NaT:
+        return None
+    if isinstance(obj, (datetime.date, datetime.time)):
+        return obj.isoformat()
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    raise TypeError('Type is not JSON serializable: {}'.format(type(obj).__name__))
+
+class FastJSONEncoder(plotly.utils.PlotlyJSONEncoder):
+    def __init__(self, raw = None, **kwargs):
+        super(FastJSONEncoder, self).__init__(**kwargs)
+        self.raw = raw
+
+    def default(self, obj):
+        if isinstance(obj, np.ndarray):
+            return array_values(obj)
+        if isinstance(obj, RawJSON) and self.raw is not None:
+            return _raw_placeholder(self.raw, obj)
+        return super(FastJSONEncoder, self).default(obj)
+
+def fast_dumps(obj):
+    raw = []
+    if orjson is not None:
+        def default(value):
+            if isinstance(value, RawJSON):
+                return _raw_placeholder(raw, value)
+            return _default(value)
+        return _embed_raw(orjson.dumps(obj, default = default).decode('utf-8'), raw)
+    return _embed_raw(json.dumps(obj, cls = FastJSONEncoder, raw = raw), raw)
+
+def dumps(obj):
+    """JSON text of a figure or callback output, as Plotly's encoder would write it."""
+    if JSON_SERIALIZER != 'fast':
+        return plotly_dumps(obj)
+    try:
+        return fast_dumps(obj)
+    except (TypeError, ValueError, OverflowError):
+        return plotly_dumps(obj)
+
+########### Dash callback responses
+def install(app):
+    """Encode the responses of the app's server-side callbacks with ``dumps``."""
+    if JSON_SERIALIZER != 'fast':
+        return
+    for callback_id, entry in app.callback_map.items():
+        if 'callback' in entry:
+            entry['callback'] = _respond(callback_id, entry['callback'].__wrapped__)
+
+def _respond(callback_id, function):
+    # What Dash 1.18 does around a callback, with the response encoded by dumps
+    multi = callback_id.startswith('..')
+
+    @functools.wraps(function)
+    def respond(*args, **kwargs):
+        output_spec = kwargs.pop('outputs_list')
+        output_value = function(*args, **kwargs)
+        if isinstance(output_value, _NoUpdate):
+            raise PreventUpdate
+        if not multi:
+            output_value, output_spec = [output_value], [output_spec]
+        _validate.validate_multi_return(output_spec, output_value, callback_id)
+
+        component_ids = collections.defaultdict(dict)
+        has_update = False
+        for val, spec in zip(output_value, output_spec):
+            if isinstance(val, _NoUpdate):
+                continue
+            for vali, speci in (zip(val, spec) if isinstance(spec, list) else [[val, spec]]):
+                if not isinstance(vali, _NoUpdate):
+                    has_update = True
+                    component_ids[stringify_id(speci['id'])][speci['property']] = vali
+        if not has_update:
+            raise PreventUpdate
+        return dumps({'response': component_ids, 'multi': True})
+    return respond
+
+if __name__ == '__main__':
+    import time
+    import argparse
+
+    parser = argparse.ArgumentParser(description = 'Compare the JSON encoders on the figures of the current snapshot.')
+    parser.add_argument('--repeat', type = int, default = 5)
+    args = parser.parse_args()
+
+    os.environ['OWID_REFRESH_INTERVAL'] = '0'
+    import app
+    dataset = app.store.current()
+    selection = app.make_selection('All', None, str(dataset.daily.dates[0])[:10], str(dataset.daily.dates[-1])[:10], dataset)
+    figures = [
+        ('line', app.line_figure(selection, 'total', 'cases')),
+        ('line new', app.line_figure(selection, 'new', 'tests')),
+        ('map', app.map_figure(selection)),
+        ('bar', app.bar_figure(selection, 'cases')),
+    ]
+    encoders = [('plotly', plotly_dumps), ('fast' if orjson is None else 'fast (orjson)', fast_dumps)]
+    print('{:<10} {:<16} {:>10} {:>12} {:>10}'.format('figure', 'encoder', 'ms', 'bytes', 'same'))
+    for name, figure in figures:
+        reference = json.loads(plotly_dumps(figure))
+        for encoder_name, encode in encoders:
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                text = encode(figure)
+                timings.append((time.perf_counter() - start) * 1000)
+            print('{:<10} {:<16} {:>10.2f} {:>12,} {:>10}'.format(
+                name, encoder_name, min(timings), len(text.encode('utf-8')), str(json.loads(text) == reference)
+            ))
@@ -0,0 +1,68 @@
+"""Server-side store of filtered selections.
+
+Each filter state is hashed into a short token, under which the selection, its
+materialized rows and the aggregates computed from it stay in process, so tab
+switches and later callbacks reuse them without filtering again.
+
+Entries are kept with LRU eviction bounded by count and bytes. Concurrent
+requests for the same missing selection build it once (see single_flight.py).
+"""
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from single_flight import SingleFlight
+
+SESSION_STORE_SIZE = int(os.environ.get('SESSION_STORE_SIZE', 64))
+SESSION_STORE_BYTES = int(os.environ.get('SESSION_STORE_BYTES', 256 * 1024 * 1024))
+
+def make_token(key):
+    return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:16]
+
+class SessionStore(object):
+    def __init__(self, maxsize = SESSION_STORE_SIZE, max_bytes = SESSION_STORE_BYTES):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.flight = SingleFlight()
+
+    def get(self, token, dataset):
+        """The selection stored under ``token`` for this dataset, or None."""
+        with self._lock:
+            selection = self._entries.get(token)
+            if selection is None or selection.dataset is not dataset:
+                return None
+            self._entries.move_to_end(token)
+        return selection
+
+    def selection(self, key, dataset, compute):
+        """Return the selection for a filter key, calling ``compute()`` on a miss."""
+        token = make_token(key)
+        selection = self.get(token, dataset)
+        if selection is None:
+            selection = self.flight.do((dataset.version, token), lambda: self._fill(token, dataset, compute))
+        return selection
+
+    def _fill(self, token, dataset, compute):
+        # Another thread may have stored the selection between the miss and this call
+        selection = self.get(token, dataset)
+        if selection is not None:
+            return selection
+        selection = compute()
+        self._remember(token, selection)
+        return selection
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _remember(self, token, selection):
+        with self._lock:
+            self._entries[token] = selection
+            self._entries.move_to_end(token)
+            # Sizes change as rows and aggregates are materialized, so they are measured here
+            total = sum(entry.nbytes() for entry in self._entries.values())
+            while len(self._entries) > 1 and (len(self._entries) > self.maxsize or total > self.max_bytes):
+                _, evicted = self._entries.popitem(last = False)
+                total -= evicted.nbytes()
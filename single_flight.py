@@ -0,0 +1,53 @@
+"""Coalescing of identical concurrent computations.
+
+When several threads ask for the same key at once, the first one computes it
+and the others wait for that result instead of computing it again. Once the
+computation is done the key is forgotten, so this is not a cache; it covers
+the gap between a cache miss and the cache being filled, e.g. the burst of
+identical default-view callbacks when many users open the dashboard at once.
+"""
+import threading
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+class SingleFlight(object):
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.computed = 0
+        self.coalesced = 0
+
+    def do(self, key, compute):
+        """Return ``compute()``, sharing one call among concurrent callers with the same key."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.computed += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            call.done.wait()
+            # The waiters see the same failure as the caller that computed it
+            if call.error is not None:
+                raise call.error
+            return call.value
+        try:
+            call.value = compute()
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.value
+
+    def stats(self):
+        with self._lock:
+            return {'computed': self.computed, 'coalesced': self.coalesced, 'in_flight': len(self._calls)}
@@ -0,0 +1,83 @@
+"""Startup time of the app, stage by stage.
+
+app.py marks the end of each import stage (libraries, data, figures, layout,
+callbacks) with ``report.mark``; the breakdown is logged once the import is
+done and served at ``/startup`` together with the time from process start to
+the first request. Running this module starts the app under gunicorn in both
+``STARTUP_FIGURES`` modes and reports how long it takes until ``/`` answers:
+
+    python startup.py
+"""
+import os
+import json
+import time
+import argparse
+import urllib.request
+from worker_memory import start_gunicorn, wait_until_served
+
+def process_age():
+    """Seconds since this process started, or None where /proc is not available."""
+    try:
+        with open('/proc/self/stat') as handle:
+            # The start time is the 20th field after the parenthesized command name, in clock ticks since boot
+            started = int(handle.read().rsplit(')', 1)[1].split()[19]) / os.sysconf('SC_CLK_TCK')
+        with open('/proc/uptime') as handle:
+            return float(handle.read().split()[0]) - started
+    except (IOError, OSError, IndexError, ValueError, AttributeError):
+        return None
+
+class StartupReport(object):
+    def __init__(self):
+        self.started = time.time() - (process_age() or 0.0)
+        self.stages = []
+        self.first_request = None
+        self._last = time.time()
+
+    def mark(self, stage):
+        """End the current stage; it is counted from the previous mark, or from process start for the first one."""
+        now = time.time()
+        since = self.started if not self.stages else self._last
+        self.stages.append((stage, now - since))
+        self._last = now
+
+    def request(self):
+        if self.first_request is None:
+            self.first_request = time.time() - self.started
+
+    def as_dict(self):
+        return {
+            'stages': [{'stage': stage, 'seconds': round(seconds, 3)} for stage, seconds in self.stages],
+            'import_seconds': round(self._last - self.started, 3),
+            'first_request_seconds': None if self.first_request is None else round(self.first_request, 3),
+        }
+
+    def format(self):
+        return ', '.join('{} {:.2f}s'.format(stage, seconds) for stage, seconds in self.stages)
+
+########### Time to the first response under gunicorn
+def measure(mode, timeout):
+    env = dict(os.environ, STARTUP_FIGURES = mode)
+    start = time.time()
+    master, base = start_gunicorn(env, 1)
+    try:
+        wait_until_served(master, base + '/', timeout, interval = 0.05)
+        served = time.time() - start
+        layout_start = time.time()
+        urllib.request.urlopen(base + '/_dash-layout', timeout = 30).read()
+        layout = time.time() - layout_start
+        report = json.loads(urllib.request.urlopen(base + '/startup', timeout = 30).read())
+        return served, layout, report
+    finally:
+        master.terminate()
+        master.wait()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Measure the time from starting gunicorn to serving /.')
+    parser.add_argument('--timeout', type = float, default = 300)
+    args = parser.parse_args()
+
+    for mode in ['eager', 'lazy']:
+        served, layout, report = measure(mode, args.timeout)
+        print('STARTUP_FIGURES={}: / served after {:.2f}s, layout in {:.3f}s'.format(mode, served, layout))
+        for stage in report['stages']:
+            print('  {:<12} {:>8.2f}s'.format(stage['stage'], stage['seconds']))
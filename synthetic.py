@@ -0,0 +1,119 @@
+"""Synthetic OWID-shaped data for benchmarks and offline runs.
+
+``make_raw`` builds a frame with the columns of ``read_source`` for any number
+of locations and days, with a configurable share of missing values, plus a few
+rows the cleaning step has to remove (World/International, negative daily
+counts and duplicates). ``install`` cleans it and publishes it as the current
+snapshot, so the app loads it instead of downloading the real data:
+
+    python synthetic.py --locations 200 --days 600 --snapshot /tmp/owid-snapshot
+    OWID_SNAPSHOT_PATH=/tmp/owid-snapshot gunicorn app:server
+
+``--csv`` writes the raw frame and a codebook as CSV files instead, for use
+with ``OWID_DATA_SOURCE`` and ``OWID_CODEBOOK_SOURCE``.
+"""
+import argparse
+import numpy as np
+import pandas as pd
+from dataset import Dataset, clean_data, save_snapshot
+
+CONTINENTS = ['Africa', 'Asia', 'Europe', 'North America', 'Oceania', 'South America']
+
+def make_raw(locations = 200, days = 600, null_density = 0.2, seed = 0, start = '2020-01-01'):
+    """Raw rows for ``locations`` countries over up to ``days`` days, plus World and International."""
+    rng = np.random.default_rng(seed)
+    names = ['Country {:04d}'.format(i) for i in range(locations)] + ['World', 'International']
+    n_locations = len(names)
+    # Every location starts reporting on its own day, like the real data
+    lengths = days - rng.integers(0, max(days // 5, 1), n_locations)
+    location = np.repeat(np.arange(n_locations), lengths)
+    day = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths) + np.repeat(days - lengths, lengths)
+    n = len(location)
+
+    iso_codes = np.array(['C{:04d}'.format(i) for i in range(locations)] + ['OWID_WRL', np.nan], dtype = object)
+    continents = np.array([CONTINENTS[i % len(CONTINENTS)] for i in range(locations)] + [np.nan, np.nan], dtype = object)
+    scale = rng.uniform(10, 1000, n_locations)[location]
+
+    def daily(mean, missing):
+        values = rng.poisson(scale * mean).astype(float)
+        values[rng.random(n) < missing] = np.nan
+        return values
+
+    new_cases = daily(1.0, null_density / 4)
+    new_deaths = daily(0.02, null_density)
+    new_tests = daily(10.0, null_density * 2)
+    hosp_patients = daily(0.1, min(null_density * 3, 0.95))
+    icu_patients = daily(0.01, min(null_density * 3, 0.95))
+    # A few negative corrections, which the cleaning step drops
+    new_cases[rng.random(n) < 0.01] = -1.0
+
+    def total(values):
+        # Running totals per location, missing wherever the daily value is
+        sums = np.cumsum(np.nan_to_num(np.maximum(values, 0)))
+        sums = sums - np.repeat(np.concatenate([[0.0], sums[np.cumsum(lengths)[:-1] - 1]]), lengths)
+        return np.where(np.isnan(values), np.nan, sums)
+
+    raw = pd.DataFrame({
+        'iso_code': iso_codes[location],
+        'continent': continents[location],
+        'location': np.array(names, dtype = object)[location],
+        'date': pd.Timestamp(start) + pd.to_timedelta(day, unit = 'D'),
+        'total_cases': total(new_cases),
+        'new_cases': new_cases,
+        'total_deaths': total(new_deaths),
+        'new_deaths': new_deaths,
+        'icu_patients': icu_patients,
+        'hosp_patients': hosp_patients,
+        'new_tests': new_tests,
+        'total_tests': total(new_tests),
+    })
+    # Some duplicated rows, and the rows in file order rather than sorted
+    raw = pd.concat([raw, raw.sample(frac = 0.001, random_state = seed)], ignore_index = True)
+    return raw.sample(frac = 1, random_state = seed).reset_index(drop = True)
+
+def make_codebook():
+    return pd.DataFrame({
+        'column': ['iso_code', 'continent', 'location', 'date'],
+        'source': 'Synthetic',
+        'description': [
+            'ISO 3166-1 alpha-3 - three-letter country codes',
+            'Continent of the geographical location',
+            'Geographical location',
+            'Date of observation',
+        ],
+    })
+
+def make_dataset(locations = 200, days = 600, null_density = 0.2, seed = 0):
+    raw = make_raw(locations, days, null_density, seed)
+    df2, dropped = clean_data(raw)
+    return Dataset(df2, make_codebook(), source = 'synthetic', dropped = dropped)
+
+def install(path, **kwargs):
+    """Save a synthetic dataset as the current snapshot in ``path`` and return it."""
+    dataset = make_dataset(**kwargs)
+    save_snapshot(dataset, path)
+    return dataset
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Generate synthetic OWID-shaped data.')
+    parser.add_argument('--locations', type = int, default = 200)
+    parser.add_argument('--days', type = int, default = 600)
+    parser.add_argument('--null-density', type = float, default = 0.2)
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--snapshot', default = None, help = 'publish a cleaned snapshot in this directory')
+    parser.add_argument('--csv', default = None, help = 'write the raw rows to this CSV file (and a codebook next to it)')
+    args = parser.parse_args()
+    if not args.snapshot and not args.csv:
+        parser.error('give --snapshot and/or --csv')
+
+    raw = make_raw(args.locations, args.days, args.null_density, args.seed)
+    if args.csv:
+        raw.to_csv(args.csv, index = False, date_format = '%Y-%m-%d')
+        codebook = args.csv.rsplit('.', 1)[0] + '-codebook.csv'
+        make_codebook().to_csv(codebook, index = False)
+        print('wrote {} rows to {} and the codebook to {}'.format(len(raw), args.csv, codebook))
+    if args.snapshot:
+        df2, dropped = clean_data(raw)
+        dataset = Dataset(df2, make_codebook(), source = 'synthetic', dropped = dropped)
+        target = save_snapshot(dataset, args.snapshot)
+        print('saved {} rows as snapshot {}'.format(len(dataset.df2), target))
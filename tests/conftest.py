@@ -0,0 +1,15 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# app.py loads the current snapshot at import, so a small synthetic one is published before any test imports it
+SNAPSHOT = tempfile.mkdtemp(prefix = 'owid-test-')
+os.environ['OWID_SNAPSHOT_PATH'] = SNAPSHOT
+os.environ['OWID_REFRESH_INTERVAL'] = '0'
+
+import synthetic
+
+synthetic.install(SNAPSHOT, locations = 30, days = 120)
@@ -0,0 +1,71 @@
+"""clean_data against the chain of DataFrame operations it replaced."""
+import numpy as np
+import pandas as pd
+import pytest
+from pandas.testing import assert_frame_equal
+
+import synthetic
+from dataset import AGGREGATE_LOCATIONS, CUMULATIVE_COLUMNS, NON_NEGATIVE_COLUMNS, clean_data
+
+def baseline_clean(data):
+    # drop_duplicates, sort, drop World and International, drop each negative column in turn, then the running totals
+    dropped = {}
+    df = data.drop_duplicates()
+    dropped['duplicate'] = len(data) - len(df)
+    df = df.sort_values(['location','date']).reset_index(drop = True)
+    rows = len(df)
+    df = df[~df.location.isin(AGGREGATE_LOCATIONS)]
+    dropped['aggregate'], rows = rows - len(df), len(df)
+    for column in NON_NEGATIVE_COLUMNS:
+        df = df[~(df[column] < 0)]
+        dropped['negative_{}'.format(column)], rows = rows - len(df), len(df)
+    df = df.reset_index(drop = True)
+    for total, daily in CUMULATIVE_COLUMNS.items():
+        df[total] = df.groupby(['location'])[daily].transform(pd.Series.cumsum)
+    return df, dropped
+
+def make_raw(seed):
+    raw = synthetic.make_raw(locations = 20, days = 60, seed = seed)
+    rng = np.random.default_rng(seed)
+    # Exact copies, some of them of World rows, which count as duplicates
+    copies = raw.iloc[rng.choice(len(raw), 25, replace = False)]
+    world = raw[raw.location == 'World'].iloc[:3]
+    # Rows sharing a location and date with another but differing in other columns are kept,
+    # in source order, unless one of their values is negative
+    revised = raw.iloc[rng.choice(len(raw), 15, replace = False)].copy()
+    revised['new_tests'] = revised['new_tests'].fillna(0) + 1
+    revised.iloc[:3, revised.columns.get_loc('new_cases')] = -5.0
+    raw = pd.concat([raw, copies, world, revised], ignore_index = True)
+    for column in NON_NEGATIVE_COLUMNS:
+        raw.loc[rng.random(len(raw)) < 0.02, column] = -1.0
+    # Negative in several columns, and a negative World row
+    raw.loc[rng.choice(len(raw), 5, replace = False), NON_NEGATIVE_COLUMNS] = -2.0
+    raw.loc[raw.index[raw.location == 'World'][5], 'new_deaths'] = -1.0
+    return raw.iloc[rng.permutation(len(raw))].reset_index(drop = True)
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_same_as_baseline(seed):
+    raw = make_raw(seed)
+    df2, dropped = clean_data(raw.copy())
+    expected, expected_dropped = baseline_clean(raw)
+    assert_frame_equal(df2, expected, check_exact = True)
+    assert dropped == expected_dropped
+    # Every rule dropped something, and every source row is kept or counted once
+    assert all(count > 0 for count in dropped.values())
+    assert len(df2) + sum(dropped.values()) == len(raw)
+
+def test_rows_sharing_location_and_date():
+    raw = synthetic.make_raw(locations = 3, days = 10, seed = 5)
+    raw['new_cases'] = raw.new_cases.abs()
+    row = raw[raw.location == 'Country 0001'].iloc[[4]]
+    revised = row.assign(new_cases = row.new_cases + 1)
+    negative = row.assign(new_cases = -1.0)
+    raw = pd.concat([raw, row, revised, negative, revised], ignore_index = True)
+    df2, dropped = clean_data(raw)
+    # The copy of the row and the second revision are duplicates, the negative revision is not
+    assert dropped['duplicate'] == 2
+    assert dropped['negative_new_cases'] == 1
+    assert dropped['aggregate'] == raw.location.isin(AGGREGATE_LOCATIONS).sum()
+    same = df2[(df2.location == 'Country 0001') & (df2.date == row.date.iloc[0])]
+    # The original row, then its revision, in source order
+    assert same.new_cases.tolist() == [row.new_cases.iloc[0], row.new_cases.iloc[0] + 1]
@@ -0,0 +1,76 @@
+"""The Selection path (cube.py, daily_totals.py) against the DataFrame groupby path of app.py."""
+import numpy as np
+import pandas as pd
+import pytest
+from pandas.testing import assert_frame_equal
+
+import app
+import synthetic
+from dataset import Dataset, clean_data
+
+REVISED = 'Country 0003'
+UNREPORTED = 'Country 0005'
+
+def make_dataset():
+    raw = synthetic.make_raw(locations = 24, days = 90, seed = 1)
+    # A running total revised down part way through, and a location that never reports deaths
+    revised = (raw.location == REVISED) & (raw.date >= '2020-03-01')
+    raw.loc[revised, 'total_cases'] = raw.loc[revised, 'total_cases'] // 2
+    unreported = raw.location == UNREPORTED
+    raw.loc[unreported, ['new_deaths', 'total_deaths']] = np.nan
+    df2, dropped = clean_data(raw)
+    return Dataset(df2, synthetic.make_codebook(), source = 'test')
+
+@pytest.fixture(scope = 'module')
+def dataset():
+    return make_dataset()
+
+FILTERS = [
+    ('All', None, '2020-01-01', '2020-03-31'),
+    ('All', None, '2020-02-10', '2020-03-05'),
+    ('Asia', None, '2020-01-01', '2020-03-31'),
+    ('Europe', None, '2020-02-10T00:00:00', '2020-03-05T00:00:00'),
+    ('All', [REVISED, UNREPORTED, 'Country 0010'], '2020-01-01', '2020-03-31'),
+    ('All', [REVISED, UNREPORTED, 'Country 0010'], '2020-02-20', '2020-03-15'),
+    ('Asia', [UNREPORTED], '2020-02-01', '2020-02-28'),
+]
+
+CALLS = [
+    (app.get_total, metric, level, {'sum': sum})
+    for metric in ['cases', 'deaths', 'tests'] for level in ['country', 'continent'] for sum in [False, True]
+] + [
+    (app.get_new, metric, level, {'sum': sum})
+    for metric in ['cases', 'deaths', 'tests', 'hosp_patients'] for level in ['country', 'continent'] for sum in [False, True]
+] + [
+    (app.get_average, metric, level, {})
+    for metric in ['cases', 'deaths', 'tests', 'hosp_patients'] for level in ['country', 'continent']
+]
+
+def assert_same(cube, frame):
+    if isinstance(frame, pd.DataFrame):
+        assert_frame_equal(cube, frame, check_exact = True)
+    elif pd.isnull(frame):
+        assert pd.isnull(cube)
+    else:
+        assert cube == frame
+
+@pytest.mark.parametrize('filters', FILTERS)
+@pytest.mark.parametrize('function,metric,level,kwargs', CALLS)
+def test_selection_matches_frame(dataset, filters, function, metric, level, kwargs):
+    selection = app.make_selection(*filters, dataset = dataset)
+    frame = function(selection.frame(), metric = metric, level = level, dataset = dataset, **kwargs)
+    cube = function(selection, metric = metric, level = level, **kwargs)
+    assert_same(cube, frame)
+
+def test_revised_total_is_the_maximum(dataset):
+    selection = app.make_selection('All', [REVISED], '2020-01-01', '2020-03-31', dataset)
+    frame = selection.frame()
+    assert frame.total_cases.is_monotonic_increasing == False
+    assert app.get_total(selection, sum = True) == frame.total_cases.max()
+
+def test_unreported_location(dataset):
+    selection = app.make_selection('All', [UNREPORTED], '2020-01-01', '2020-03-31', dataset)
+    df = app.get_total(selection, metric = 'deaths')
+    assert df.location.tolist() == [UNREPORTED]
+    assert df.total_deaths.isnull().all()
+    assert app.get_total(selection, metric = 'deaths', sum = True) == 0
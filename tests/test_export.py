@@ -0,0 +1,49 @@
+"""Filters of the /export.csv route, posted by the export form or given in the query string."""
+import io
+import json
+import pandas as pd
+import pytest
+
+import app
+
+@pytest.fixture
+def client():
+    return app.server.test_client()
+
+def countries():
+    return app.store.current().country_options[:2]
+
+def post(client, filters):
+    return client.post('/export.csv', data = {'filters': json.dumps(filters)})
+
+def rows(response):
+    return pd.read_csv(io.BytesIO(response.get_data()))
+
+def test_posted_filters(client):
+    response = post(client, {'continent': 'All', 'country': countries(), 'start_date': '2020-02-01', 'end_date': '2020-02-10'})
+    assert response.status_code == 200
+    df = rows(response)
+    assert sorted(df.location.unique()) == countries()
+    assert df.date.min() >= '2020-02-01' and df.date.max() <= '2020-02-10'
+
+def test_query_string(client):
+    response = client.get('/export.csv', query_string = [('country', c) for c in countries()] + [('end_date', '2020-02-10')])
+    assert response.status_code == 200
+    assert sorted(rows(response).location.unique()) == countries()
+
+@pytest.mark.parametrize('filters', [
+    {'start_date': 5},
+    {'end_date': ['2020-02-10']},
+    {'continent': None},
+    {'country': 'Country 0001'},
+    {'country': [1, 2]},
+    {'country': {'Country 0001': True}},
+    {'start_date': 'yesterday'},
+    {'continent': 'Atlantis'},
+    ['Country 0001'],
+])
+def test_bad_filters(client, filters):
+    assert post(client, filters).status_code == 400
+
+def test_filters_that_are_not_json(client):
+    assert client.post('/export.csv', data = {'filters': '{continent'}).status_code == 400
@@ -0,0 +1,36 @@
+"""Bounds of the figure cache and the raw JSON it returns."""
+import json
+
+import serializer
+from figure_cache import FigureCache
+
+def test_evicts_by_bytes():
+    cache = FigureCache(maxsize = 100, max_bytes = 25)
+    for key in 'abc':
+        cache.set(key, '"{}"'.format(key * 8))
+    # Each entry is 10 bytes, so only the two most recent fit
+    assert cache.get('a') is None
+    assert cache.get('b') == '"bbbbbbbb"'
+    assert cache.stats()['bytes'] == 20
+    assert cache.evictions == 1
+
+def test_replacing_an_entry_keeps_the_byte_count():
+    cache = FigureCache(maxsize = 100, max_bytes = 1000)
+    cache.set('a', '[1, 2, 3]')
+    cache.set('a', '[1]')
+    assert cache.stats()['bytes'] == 3
+    cache.clear()
+    assert cache.stats()['bytes'] == 0
+
+def test_raw_hits_are_not_parsed():
+    cache = FigureCache()
+    calls = []
+    compute = lambda: calls.append(1) or {'data': [1.5, float('nan')]}
+    first = cache.cached('figure', compute, raw = True)
+    second = cache.cached('figure', compute, raw = True)
+    assert len(calls) == 1
+    assert isinstance(second, serializer.RawJSON) and second.text == first.text
+    assert cache.cached('figure', compute) == {'data': [1.5, None]}
+    # Written into a response as it is, and parsed by Plotly's encoder
+    response = {'response': {'count_graph': {'figure': second}}}
+    assert json.loads(serializer.dumps(response)) == json.loads(serializer.plotly_dumps(response))
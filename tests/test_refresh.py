@@ -0,0 +1,42 @@
+"""An incremental refresh against a full clean of the same rows."""
+import pandas as pd
+import pytest
+from pandas.testing import assert_frame_equal
+
+import synthetic
+from dataset import Dataset, clean_data
+from refresh import DataStore, LocalSource, RefreshScheduler
+
+def full_clean(source):
+    df2, dropped = clean_data(source.read())
+    return Dataset(df2, synthetic.make_codebook(), source = 'test', dropped = dropped)
+
+@pytest.fixture
+def scheduler(tmp_path):
+    raw = synthetic.make_raw(locations = 20, days = 80, seed = 2)
+    source = LocalSource(raw, until = raw['date'].min() + pd.Timedelta(days = 50))
+    store = DataStore(full_clean(source))
+    return RefreshScheduler(store, source, interval = 0, path = tmp_path)
+
+@pytest.mark.parametrize('steps', [[1], [7, 3], [30]])
+def test_refresh_matches_full_clean(scheduler, steps):
+    for days in steps:
+        scheduler.source.advance(days)
+        assert scheduler.refresh() == True
+    expected = full_clean(scheduler.source)
+    refreshed = scheduler.store.current()
+    # Including the running totals of hosp_patients and icu_patients, continued from the last snapshot
+    assert_frame_equal(refreshed.df2, expected.df2, check_exact = True)
+    assert refreshed.dropped == expected.dropped
+
+def test_refresh_without_new_rows(scheduler):
+    version = scheduler.store.current().version
+    assert scheduler.refresh() == False
+    assert scheduler.store.current().version == version
+
+def test_published_snapshot_is_picked_up(scheduler, tmp_path):
+    scheduler.source.advance(2)
+    assert scheduler.refresh() == True
+    other = RefreshScheduler(DataStore(full_clean(LocalSource(scheduler.source.data))), scheduler.source, path = tmp_path)
+    assert other.refresh() == True
+    assert other.store.current().version == scheduler.store.current().version
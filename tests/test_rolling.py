@@ -0,0 +1,43 @@
+"""rolling.py against pandas' time-based rolling mean per location."""
+import numpy as np
+import pytest
+
+import synthetic
+from dataset import Dataset, clean_data
+from rolling import ROLLING_COLUMNS, ROLLING_WINDOWS, rolling_column, rolling_mean
+
+GAP = 'Country 0002'
+
+def make_dataset():
+    df2, dropped = clean_data(synthetic.make_raw(locations = 16, days = 70, null_density = 0.3, seed = 3))
+    rng = np.random.default_rng(3)
+    # Skipped days everywhere, and a location with a run of skipped days longer than either window
+    df2 = df2[rng.random(len(df2)) > 0.3]
+    df2 = df2[~((df2.location == GAP) & (df2.date >= '2020-02-01') & (df2.date < '2020-02-20'))]
+    # A run of missing values as long as the 7-day window
+    missing = (df2.location == 'Country 0004') & (df2.date >= '2020-02-10') & (df2.date < '2020-02-17')
+    df2.loc[missing, ROLLING_COLUMNS] = np.nan
+    return Dataset(df2.reset_index(drop = True), synthetic.make_codebook(), source = 'test')
+
+@pytest.fixture(scope = 'module')
+def dataset():
+    return make_dataset()
+
+@pytest.mark.parametrize('mode', sorted(ROLLING_WINDOWS))
+@pytest.mark.parametrize('column', ROLLING_COLUMNS)
+def test_same_as_pandas(dataset, column, mode):
+    df2 = dataset.df2
+    window = '{}D'.format(ROLLING_WINDOWS[mode])
+    expected = df2.groupby('location').rolling(window, on = 'date')[column].mean()
+    # Grouped by location, so in the order of df2's rows, which are sorted by location and date
+    actual = df2[rolling_column(column, mode)]
+    np.testing.assert_allclose(actual.to_numpy(), expected.to_numpy(), rtol = 1e-9)
+    # Windows with no known value are NaN, and the data holds some
+    assert actual.isnull().any() and actual.notnull().any()
+
+def test_skipped_days_shorten_the_window():
+    # One location on days 0, 1, 5 and 9, another starting on day 2
+    values = np.array([1.0, 3.0, np.nan, 8.0, 10.0, 20.0])
+    days = np.array([0, 1, 5, 9, 2, 3])
+    means = rolling_mean(values, days, np.array([0, 4]), np.array([4, 6]), 7)
+    np.testing.assert_array_equal(means, [1.0, 2.0, 2.0, 8.0, 10.0, 15.0])
@@ -0,0 +1,61 @@
+"""serializer.dumps against Plotly's own encoding, with orjson and with the standard library."""
+import datetime
+import json
+import numpy as np
+import plotly
+import plotly.graph_objects as go
+import pytest
+
+import app
+import serializer
+
+@pytest.fixture(params = ['orjson', 'stdlib'])
+def encoder(request, monkeypatch):
+    if request.param == 'orjson' and serializer.orjson is None:
+        pytest.skip('orjson is not installed')
+    if request.param == 'stdlib':
+        monkeypatch.setattr(serializer, 'orjson', None)
+    return request.param
+
+def selection():
+    dataset = app.store.current()
+    return app.make_selection('All', dataset.country_options[:6], '2020-01-01', '2020-12-31', dataset)
+
+def dated_figure():
+    # Dates that are not snapshot dates, a timezone and NaN outside of arrays
+    dates = np.array([datetime.datetime(2019, 1, 1, 12, 30), datetime.datetime(2021, 6, 1)], dtype = object)
+    aware = [datetime.datetime(2020, 3, 1, tzinfo = datetime.timezone.utc), datetime.datetime(2020, 3, 2, tzinfo = datetime.timezone.utc)]
+    return go.Figure([
+        go.Scatter(x = dates, y = np.array([1.5, np.nan])),
+        go.Scatter(x = aware, y = [float('nan'), 2]),
+        go.Bar(x = np.array(['2020-01-01', '2020-01-02'], dtype = 'datetime64[ns]'), y = np.array([np.inf, 3.0])),
+    ])
+
+FIGURES = {
+    'line total': lambda: app.line_figure(selection(), 'total', 'cases'),
+    'line new': lambda: app.line_figure(selection(), 'new', 'hosp_patients'),
+    'line rolling': lambda: app.line_figure(selection(), 'avg7', 'deaths'),
+    'map': lambda: app.map_figure(selection()),
+    'bar': lambda: app.bar_figure(selection(), 'deaths'),
+    'dates': dated_figure,
+}
+
+@pytest.mark.parametrize('name', sorted(FIGURES))
+def test_same_as_plotly(encoder, name):
+    fig = FIGURES[name]()
+    # Without validation, so the map's dict (with its cut down template) is encoded as it is sent
+    expected = json.loads(plotly.io.to_json(fig, validate = False))
+    assert json.loads(serializer.dumps(fig)) == expected
+    # Without falling back to Plotly's encoder
+    assert json.loads(serializer.fast_dumps(fig)) == expected
+
+def test_figures_hold_nan_and_dates():
+    fig = app.line_figure(selection(), 'new', 'hosp_patients')
+    assert any(np.isnan(np.asarray(trace.y, dtype = float)).any() for trace in fig.data)
+    assert isinstance(fig.data[0].x[0], datetime.datetime)
+
+def test_callback_output(encoder):
+    # Cards and figures together, as a fused callback response holds them
+    outputs = list(app.card_values(selection())) + [app.map_figure(selection()), float('nan'), None]
+    expected = json.loads(json.dumps(outputs, cls = plotly.utils.PlotlyJSONEncoder))
+    assert json.loads(serializer.dumps(outputs)) == expected
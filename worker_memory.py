@@ -0,0 +1,102 @@
+"""Resident memory of the gunicorn master and workers, with and without preloading.
+
+Starts ``gunicorn app:server`` with N workers, sends every worker a few
+requests, and reads ``/proc/<pid>/smaps_rollup`` of the master and each
+worker. RSS counts shared pages in every process that maps them; PSS splits
+them between the processes, so the PSS total is what the dyno actually needs.
+Linux only.
+
+    python worker_memory.py --workers 4
+"""
+import os
+import sys
+import time
+import socket
+import argparse
+import subprocess
+import urllib.request
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_gunicorn(env, workers, *options):
+    """Start ``gunicorn app:server`` on a free local port; returns the master process and its base URL."""
+    port = free_port()
+    # gunicorn 20.0 has no __main__ module, so run its entry point directly
+    command = [sys.executable, '-c', 'from gunicorn.app.wsgiapp import run; run()', 'app:server', '--workers', str(workers),
+               '--bind', '127.0.0.1:{}'.format(port), '--log-level', 'warning'] + list(options)
+    master = subprocess.Popen(command, env = env, cwd = os.path.dirname(os.path.abspath(__file__)))
+    return master, 'http://127.0.0.1:{}'.format(port)
+
+def wait_until_served(master, url, timeout, interval = 0.5):
+    """Poll ``url`` until it answers; the master is killed if it exits or ``timeout`` seconds pass first."""
+    deadline = time.time() + timeout
+    while True:
+        try:
+            urllib.request.urlopen(url, timeout = 30).read()
+            return
+        except OSError:
+            if time.time() > deadline or master.poll() is not None:
+                master.kill()
+                raise SystemExit('gunicorn did not start')
+            time.sleep(interval)
+
+def children(pid):
+    pids = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/{}/stat'.format(entry)) as handle:
+                # The parent pid is the second field after the parenthesized command name
+                ppid = int(handle.read().rsplit(')', 1)[1].split()[1])
+        except (IOError, OSError, IndexError, ValueError):
+            continue
+        if ppid == pid:
+            pids.append(int(entry))
+    return sorted(pids)
+
+def memory(pid):
+    """Rss, Pss and private kB of a process."""
+    values = {}
+    with open('/proc/{}/smaps_rollup'.format(pid)) as handle:
+        for line in handle:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                values[parts[0].rstrip(':')] = int(parts[1])
+    private = values.get('Private_Clean', 0) + values.get('Private_Dirty', 0)
+    return values.get('Rss', 0), values.get('Pss', 0), private
+
+def measure(workers, preload, requests, timeout):
+    env = dict(os.environ, GUNICORN_PRELOAD = '1' if preload else '0')
+    master, base = start_gunicorn(env, workers)
+    try:
+        url = base + '/_dash-layout'
+        wait_until_served(master, url, timeout)
+        # Spread requests over the workers so each one has served the layout
+        for _ in range(requests * workers):
+            urllib.request.urlopen(url, timeout = 30).read()
+        rows = [('master', master.pid)] + [('worker', pid) for pid in children(master.pid)]
+        return [(name, pid) + memory(pid) for name, pid in rows]
+    finally:
+        master.terminate()
+        master.wait()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Measure gunicorn memory per worker with and without preloading.')
+    parser.add_argument('--workers', type = int, default = 4)
+    parser.add_argument('--requests', type = int, default = 5, help = 'layout requests per worker before measuring')
+    parser.add_argument('--timeout', type = float, default = 120)
+    args = parser.parse_args()
+
+    for preload in [False, True]:
+        rows = measure(args.workers, preload, args.requests, args.timeout)
+        print('{} workers, preload {}'.format(args.workers, 'on' if preload else 'off'))
+        print('  {:<8} {:>8} {:>10} {:>10} {:>10}'.format('process', 'pid', 'RSS MB', 'PSS MB', 'private MB'))
+        for name, pid, rss, pss, private in rows:
+            print('  {:<8} {:>8} {:>10.1f} {:>10.1f} {:>10.1f}'.format(name, pid, rss / 1024, pss / 1024, private / 1024))
+        print('  {:<8} {:>8} {:>10.1f} {:>10.1f} {:>10.1f}'.format(
+            'total', '', sum(r[2] for r in rows) / 1024, sum(r[3] for r in rows) / 1024, sum(r[4] for r in rows) / 1024
+        ))